@@ -0,0 +1,119 @@
+import os
+import gzip
+import json
+import datetime
+import logging
+import threading
+from gcs_uploader import Payload
+from processor import get_base_dir
+
+logger = logging.getLogger(__name__)
+
+# 環境変数 GCS_BUNDLE_MODE=ndjson で、サイクル毎のNDJSONパートファイルにまとめてアップロードする
+BUNDLE_MODE = os.environ.get("GCS_BUNDLE_MODE", "none")
+
+# 圧縮済みペイロードの後ろに付ける改行だけのgzipメンバー
+NEWLINE_MEMBER = gzip.compress(b"\n", mtime=0)
+
+class CycleBundler:
+    """
+    同期サイクル毎のスナップショット群を、1つのNDJSONパートファイルにまとめる。
+    パートファイルは1スナップショット=1 gzipメンバーの連結で、全体をgunzipすればNDJSONとして読める。
+    パート毎のマニフェスト (manifests/ 以下) に 従来のblob名 → (パートファイル, オフセット, 長さ) を記録するため、
+    読み手は該当範囲だけをレンジ読み込みしてgunzipすれば1スナップショットを取得できる。
+    マニフェストはパートのアップロード成功後に manifest_tasks で作成する (存在しないパートを指さないようにする)。
+    ※ レンジ読み込みのため、パートファイルには Content-Encoding を付与しない。
+    """
+    def __init__(self, source_prefix, manifest_filename=None):
+        self.source_prefix = source_prefix
+        self.manifest_file = os.path.join(get_base_dir(), manifest_filename or f"bundle_manifest_{source_prefix}.json")
+        self.lock = threading.Lock()
+        self.part_seq = 0
+        self.date = None
+        self.pending = {}  # part_name -> {blob_name: [part_name, offset, length]} (アップロード結果待ち)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.date = saved.get("date")
+            self.part_seq = saved.get("part_seq", 0)
+        except Exception as e:
+            logger.warning(f"バンドルの採番状態の読み込みに失敗しました。新規作成します: {e}")
+
+    def _save(self):
+        """再起動後もパート名が重複しないよう、日付と採番だけを保存する"""
+        try:
+            tmp_file = self.manifest_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"date": self.date, "part_seq": self.part_seq}, f)
+            os.replace(tmp_file, self.manifest_file)
+        except Exception as e:
+            logger.error(f"Bundle manifest save error: {e}")
+
+    def manifest_blob_name(self, today_str, part_name):
+        """パート毎のマニフェストのblob名 (odds_history/{source}/{日付}/manifests/{パート名}.json)"""
+        part_base = part_name.rsplit("/", 1)[-1][:-len(".ndjson.gz")]
+        return f"odds_history/{self.source_prefix}/{today_str}/manifests/{part_base}.json"
+
+    def bundle(self, today_str, upload_tasks):
+        """
+        (blob_name, Payload, cache_key) の並びを、1件のパートファイルのタスクに置き換える。
+        戻り値: [(part_blob_name, Payload, [cache_key, ...])]
+        """
+        if not upload_tasks:
+            return []
+
+        with self.lock:
+            if self.date != today_str:
+                self.date = today_str
+                self.part_seq = 0
+            self.part_seq += 1
+            self._save()
+            part_name = (
+                f"odds_history/{self.source_prefix}/{today_str}/parts/"
+                f"{datetime.datetime.now().strftime('%H%M%S')}_{self.part_seq:05d}.ndjson.gz"
+            )
+
+            members = []
+            entries = {}
+            offset = 0
+            raw_size = 0
+            for blob_name, payload, _ in upload_tasks:
+                # 圧縮済みのペイロードはそのままgzipメンバーとして使う (再シリアライズしない)
+                if payload.content_encoding == "gzip":
+                    member = payload.data + NEWLINE_MEMBER
+                else:
+                    member = gzip.compress(payload.data + b"\n", mtime=0)
+                members.append(member)
+                entries[blob_name] = [part_name, offset, len(member)]
+                offset += len(member)
+                raw_size += payload.raw_size
+            self.pending[part_name] = entries
+
+        cache_keys = [cache_key for _, _, cache_key in upload_tasks]
+        part_payload = Payload(b"".join(members), raw_size, content_type="application/gzip")
+
+        logger.info(f"[{self.source_prefix}] NDJSONパート作成: {len(upload_tasks)}件 → {part_name} ({offset / 1024:.1f}KB)")
+        return [(part_name, part_payload, cache_keys)]
+
+    def manifest_tasks(self, today_str, uploaded_parts):
+        """
+        アップロードに成功したパートのマニフェストのタスクを返す。それ以外の結果待ちのパートは破棄する。
+        戻り値: [(manifest_blob_name, Payload, [])]
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        tasks = []
+        for part_name in uploaded_parts:
+            entries = pending.get(part_name)
+            if entries is None:
+                continue
+            manifest = {"date": today_str, "source": self.source_prefix, "part": part_name, "entries": entries}
+            manifest_raw = json.dumps(manifest).encode("utf-8")
+            manifest_payload = Payload(gzip.compress(manifest_raw, mtime=0), len(manifest_raw), content_encoding="gzip")
+            tasks.append((self.manifest_blob_name(today_str, part_name), manifest_payload, []))
+        return tasks
@@ -0,0 +1,285 @@
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextlib
+import collections
+
+logger = logging.getLogger(__name__)
+
+# 1回の取得で計測するサイクル数 (既定) と上限
+DEFAULT_PROFILE_CYCLES = int(os.environ.get("PROFILE_CYCLES", "3"))
+MAX_PROFILE_CYCLES = 50
+# このファイルを置くと取得を要求する (内容例: "jra 5" / "nar" / "all 3"、読み込み後に削除)
+PROFILE_CONTROL_FILE = os.environ.get("PROFILE_CONTROL_FILE", "profile_request.txt")
+CONTROL_POLL_INTERVAL = 5  # 秒
+# 要求したソースのサイクルがこの時間 (秒) 進まない場合 (ワーカー停止中など) は、それまでの分で取得を終える
+PROFILE_IDLE_TIMEOUT = 1800
+PROFILE_SOURCES = ("jra", "nar")
+# テキストの集計に載せる関数の数
+SUMMARY_LINES = 60
+# Python 3.12 以降の cProfile はプロセス全体で1つしか有効化できず、有効化したスレッド以外 (もう一方のワーカー等) も計測してしまう。
+# そのため 3.12 以降は cProfile を使わず、対象スレッドのスタックだけを一定間隔で採取する
+SAMPLE_STACKS = sys.version_info >= (3, 12)
+SAMPLE_INTERVAL = 0.005  # 秒
+MAX_STACK_DEPTH = 128
+
+class _Capture:
+    """1回分の取得 (ソース毎に指定サイクル数) の途中結果"""
+    def __init__(self, sources, cycles):
+        self.label = "all" if len(sources) > 1 else sources[0]
+        self.remaining = {source: cycles for source in sources}
+        self.done = 0
+        self.stats = None
+        self.samples = collections.Counter()  # SAMPLE_STACKS の場合の スタック -> 採取数
+        self.started_at = time.strftime("%Y%m%d_%H%M%S")
+        self.elapsed = 0.0
+        self.last_progress = time.monotonic()
+
+    @property
+    def complete(self):
+        return not any(self.remaining.values())
+
+class CycleProfiler:
+    """
+    fetch_worker_loop の指定したソースの、次の N サイクルを cProfile で計測するトグル (プロセスに1つ)。
+    タスクトレイのメニューか制御ファイル (PROFILE_CONTROL_FILE、start() したスレッドが監視) で要求し、
+    N サイクル計測すると自動で終了する。同時に進める取得は1つだけとする。
+    計測対象は計測中のサイクルのワーカースレッドと、同じソースのストリーミング処理スレッド (thread_profile) のみで、
+    もう一方のワーカーや送信スレッドは計測しない。
+    Python 3.11 以前はスレッド毎に cProfile を有効化し、output_dir に profile_{ソース}_{開始時刻}.pstats
+    (snakeviz / flameprof 等で読める) と .txt の集計を書き出す。他のツールが既にプロファイラを有効化している場合は計測せずに処理を続ける。
+    3.12 以降 (SAMPLE_STACKS) は採取用のスレッドが対象スレッドのスタックを SAMPLE_INTERVAL 秒毎に読み取り、
+    .collapsed (flamegraph.pl / speedscope で読める折り畳みスタック) と .txt の集計を書き出す。
+    """
+    def __init__(self, output_dir, control_file=PROFILE_CONTROL_FILE):
+        self.output_dir = output_dir
+        self.control_path = os.path.join(output_dir, control_file)
+        self.lock = threading.Lock()
+        self.capture = None        # 要求済み・取得中の _Capture
+        self.active = 0             # SAMPLE_STACKS の場合の、計測中のサイクル・スレッド数
+        self.sampled_threads = collections.Counter()  # SAMPLE_STACKS の場合の 計測中のスレッドID -> 計測区間の数
+        self.sampler = None         # SAMPLE_STACKS の場合の、採取用のスレッド
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # ------------------------------------------
+    # 要求 (タスクトレイ / 制御ファイル)
+    # ------------------------------------------
+    def request(self, source_prefix, cycles=None):
+        """source_prefix ("jra"/"nar"/"all") の次の cycles サイクルの計測を要求する"""
+        cycles = min(max(int(cycles or DEFAULT_PROFILE_CYCLES), 1), MAX_PROFILE_CYCLES)
+        sources = PROFILE_SOURCES if source_prefix == "all" else (source_prefix,)
+        with self.lock:
+            if self.capture is not None:
+                logger.info(f"[{self.capture.label}] プロファイル取得中のため要求を無視します")
+                return
+            self.capture = _Capture(sources, cycles)
+        logger.info(f"[{source_prefix}] 📈 次の {cycles} サイクルのプロファイルを取得します")
+
+    def poll_control_file(self):
+        """制御ファイルがあれば要求として読み込み、削除する"""
+        if not os.path.exists(self.control_path):
+            return
+        try:
+            with open(self.control_path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            os.remove(self.control_path)
+        except OSError as e:
+            logger.warning(f"プロファイル制御ファイルを読み込めませんでした: {e}")
+            return
+        for line in lines or ["all"]:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] not in PROFILE_SOURCES + ("all",) or (len(fields) > 1 and not fields[1].isdigit()):
+                logger.warning(f"プロファイル制御ファイルの書式が不正です: {line!r} (例: \"jra 5\")")
+                continue
+            self.request(fields[0], fields[1] if len(fields) > 1 else None)
+
+    def expire_idle(self):
+        """サイクルが PROFILE_IDLE_TIMEOUT 秒進んでいない取得を、それまでの分で終える"""
+        with self.lock:
+            capture = self.capture
+            if capture is None or self.active or time.monotonic() - capture.last_progress < PROFILE_IDLE_TIMEOUT:
+                return
+            self.capture = None
+        logger.warning(f"[{capture.label}] サイクルが進まないため、プロファイル取得を {capture.done}サイクルで終了します")
+        self._write(capture)
+
+    def _poll_loop(self):
+        while not self.stop_event.wait(CONTROL_POLL_INTERVAL):
+            self.poll_control_file()
+            self.expire_idle()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._poll_loop, name="profile-control", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    # ------------------------------------------
+    # 計測
+    # ------------------------------------------
+    def _attach(self):
+        """現在のスレッドの計測を始める (ロック取得済みで呼ぶこと)。戻り値は _detach に渡すトークン (計測できない場合は None)"""
+        if SAMPLE_STACKS:
+            ident = threading.get_ident()
+            self.sampled_threads[ident] += 1
+            self.active += 1
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+                self.sampler.start()
+            return ident
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            logger.warning(f"プロファイラを有効化できないため計測せずに続けます: {e}")
+            return None
+        return profile
+
+    def _detach(self, token):
+        """_attach の戻り値を渡して現在のスレッドの計測を終える (ロック取得済みで呼ぶこと)"""
+        if SAMPLE_STACKS:
+            self.active -= 1
+            self.sampled_threads[token] -= 1
+            if self.sampled_threads[token] <= 0:
+                del self.sampled_threads[token]
+            return
+        token.disable()
+        if self.capture is not None:
+            self._merge(self.capture, token)
+
+    def _sample_loop(self):
+        """計測中のスレッドのスタックだけを一定間隔で採取する。計測中のスレッドが無くなったら終了する"""
+        while True:
+            time.sleep(SAMPLE_INTERVAL)
+            frames = sys._current_frames()
+            with self.lock:
+                if not self.sampled_threads:
+                    self.sampler = None
+                    return
+                if self.capture is None:
+                    continue
+                for ident in self.sampled_threads:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self.capture.samples[_stack_of(frame)] += 1
+
+    def begin_cycle(self, source_prefix):
+        """サイクル開始時に呼ぶ。計測対象であれば end_cycle に渡すトークンを返す (対象外は None)"""
+        with self.lock:
+            if self.capture is None or not self.capture.remaining.get(source_prefix):
+                return None
+            profile = self._attach()
+            if profile is None:
+                return None
+        return profile, time.perf_counter()
+
+    def end_cycle(self, source_prefix, token):
+        """begin_cycle の戻り値を渡してサイクルの計測を終える。全ソースが指定サイクル数に達したら書き出して終了する"""
+        if token is None:
+            return
+        profile, started = token
+        with self.lock:
+            capture = self.capture
+            self._detach(profile)
+            if capture is None:
+                return
+            capture.last_progress = time.monotonic()
+            capture.elapsed += time.perf_counter() - started
+            capture.done += 1
+            capture.remaining[source_prefix] = max(capture.remaining[source_prefix] - 1, 0)
+            if not capture.complete or self.active:
+                return
+            self.capture = None
+        self._write(capture)
+
+    @contextlib.contextmanager
+    def thread_profile(self, source_prefix):
+        """取得中であれば、with ブロック内の現在のスレッドの処理も同じ取得結果に含める"""
+        with self.lock:
+            capture = self.capture
+            profile = self._attach() if capture is not None and capture.remaining.get(source_prefix) else None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                with self.lock:
+                    self._detach(profile)
+
+    @staticmethod
+    def _merge(capture, profile):
+        profile.create_stats()
+        if not profile.stats:
+            return
+        if capture.stats is None:
+            capture.stats = pstats.Stats(profile)
+        else:
+            capture.stats.add(profile)
+
+    def _write(self, capture):
+        if SAMPLE_STACKS:
+            self._write_samples(capture)
+            return
+        if capture.stats is None:
+            logger.warning(f"[{capture.label}] プロファイルに記録がありませんでした")
+            return
+        base = os.path.join(self.output_dir, f"profile_{capture.label}_{capture.started_at}")
+        try:
+            capture.stats.dump_stats(base + ".pstats")
+            text = io.StringIO()
+            capture.stats.stream = text
+            text.write(f"{capture.label}: {capture.done}サイクル / 計測区間 {capture.elapsed:.2f}秒\n")
+            capture.stats.sort_stats("cumulative").print_stats(SUMMARY_LINES)
+            capture.stats.sort_stats("tottime").print_stats(SUMMARY_LINES)
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(text.getvalue())
+            logger.info(f"[{capture.label}] 📈 プロファイルを保存しました ({capture.done}サイクル / {capture.elapsed:.2f}秒): {base}.pstats")
+        except OSError as e:
+            logger.error(f"[{capture.label}] プロファイルの保存に失敗しました: {e}")
+
+    def _write_samples(self, capture):
+        if not capture.samples:
+            logger.warning(f"[{capture.label}] プロファイルに記録がありませんでした")
+            return
+        base = os.path.join(self.output_dir, f"profile_{capture.label}_{capture.started_at}")
+        total = sum(capture.samples.values())
+        own = collections.Counter()
+        inclusive = collections.Counter()
+        for stack, count in capture.samples.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                inclusive[name] += count
+        try:
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                for stack, count in capture.samples.most_common():
+                    f.write(";".join(stack) + f" {count}\n")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(f"{capture.label}: {capture.done}サイクル / 計測区間 {capture.elapsed:.2f}秒 / "
+                        f"{total}サンプル ({SAMPLE_INTERVAL * 1000:.0f}ms間隔)\n")
+                for title, counter in (("inclusive (呼び出し先を含む)", inclusive), ("self (関数自身)", own)):
+                    f.write(f"\n--- {title} ---\n")
+                    for name, count in counter.most_common(SUMMARY_LINES):
+                        f.write(f"{count:8d} {count / total:6.1%}  {name}\n")
+            logger.info(f"[{capture.label}] 📈 プロファイルを保存しました ({capture.done}サイクル / {capture.elapsed:.2f}秒): {base}.collapsed")
+        except OSError as e:
+            logger.error(f"[{capture.label}] プロファイルの保存に失敗しました: {e}")
+
+def _stack_of(frame):
+    """フレームから呼び出し元 → 呼び出し先の順の (関数名 (ファイル名:行)) のタプルを作る"""
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
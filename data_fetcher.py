@@ -1,8 +1,7 @@
 import os
-import time
-import datetime
 import logging
 import threading
+import multiprocessing
 import warnings
 import queue
 import tkinter as tk
@@ -10,7 +9,6 @@ from tkinter import scrolledtext
 from PIL import Image, ImageDraw
 import pystray
 from pystray import MenuItem as item
-import pythoncom
 
 # 32bit環境によるcryptographyのUserWarningを抑制
 warnings.filterwarnings("ignore", category=UserWarning, module="cryptography")
@@ -18,16 +16,17 @@ warnings.filterwarnings("ignore", category=UserWarning, module="cryptography")
 from record_parser import JRAVanParser
 from race_info_parser import RaceInfoParser
 from gcs_uploader import GCSUploader
+from upload_service import UploadService
 
 from fetchers import JRAVanFetcher, UmaConnFetcher
-from processor import UploadCache, process_and_upload, extract_race_schedule, get_base_dir
+from processor import UploadCache, get_base_dir
+from metrics import METRICS, MetricsExporter
+from cycle_profiler import CycleProfiler
+from fetch_worker import fetch_worker_loop, stop_event, log_queue
 
 # ==========================================
-# ロガー設定 & スレッド間通信用キュー
+# ロガー設定
 # ==========================================
-stop_event = threading.Event()
-log_queue = queue.Queue()
-
 class QueueLogHandler(logging.Handler):
     def emit(self, record):
         log_queue.put(self.format(record))
@@ -47,94 +46,12 @@ logger.handlers.clear()
 logger.addHandler(file_handler)
 logger.addHandler(queue_handler)
 
-# ==========================================
-# 並行ワーカー関数 (JRA/NAR独立)
-# ==========================================
-def fetch_worker_loop(source_name, fetcher_class, odds_parser, info_parser, uploader, upload_cache):
-    pythoncom.CoInitialize()
-    fetcher = None
-    
-    try:
-        fetcher = fetcher_class()
-        
-        if not fetcher.init_link():
-            logging.error(f"[{source_name}] 通信初期化に失敗しました。スレッドを終了します。")
-            return
-
-        schedule = {}
-        last_full_sync = 0
-        FULL_SYNC_INTERVAL = 300  # 5分 (全体同期および閑散期の基本待機)
-        SHORT_SYNC_INTERVAL = 60  # 60秒 (対象レース検知時の待機)
-        
-        full_specs = ["0B12", "0B15", "0B11", "0B41", "0B42", "0B31", "0B32"]
-        odds_specs = ["0B41", "0B42", "0B31", "0B32"]
-        
-        logging.info(f"[{source_name}] --- ワーカー稼働開始 ---")
-
-        while not stop_event.is_set():
-            current_time = time.time()
-            today_str = datetime.datetime.now().strftime("%Y%m%d")
-            
-            # --- 1. 全体同期サイクル (前回同期から5分以上経過時のみ) ---
-            if current_time - last_full_sync >= FULL_SYNC_INTERVAL:
-                logging.info(f"[{source_name}] 🔄 --- 全体同期サイクル開始 ---")
-                if source_name == "JRA-VAN":
-                    places = fetcher.get_today_places(today_str, stop_event)
-                    if places:
-                        raw_data = fetcher.fetch_rt_loop(full_specs, today_str, places, source_name, stop_event)
-                    else:
-                        raw_data = []
-                else:
-                    raw_data = fetcher.fetch_rt_loop_uma(full_specs, today_str, source_name, stop_event)
-                    
-                res = process_and_upload(raw_data, odds_parser, info_parser, uploader, "jra" if source_name=="JRA-VAN" else "nar", upload_cache)
-                schedule.update(extract_race_schedule(res))
-                
-                # 同期が完了したら時刻を更新
-                last_full_sync = time.time()
-                logging.info(f"[{source_name}] 🔄 --- 全体同期完了 ---")
-
-            # --- 2. ピンポイント同期サイクル & インターバル判定 ---
-            now_dt = datetime.datetime.now()
-            imminent_keys = []
-            
-            for key, start_dt in schedule.items():
-                diff_sec = (start_dt - now_dt).total_seconds()
-                # 発送15分前(900秒) 〜 発送後10分(-600秒) までを対象とする
-                if -600 <= diff_sec <= 900: 
-                    imminent_keys.append(key)
-                    
-            if imminent_keys and not stop_event.is_set():
-                logging.info(f"[{source_name}] 🎯 発送直前レース検知 ({len(imminent_keys)}件): {imminent_keys}")
-                raw_data = fetcher.fetch_specific_races(odds_specs, imminent_keys, source_name, stop_event)
-                process_and_upload(raw_data, odds_parser, info_parser, uploader, "jra" if source_name=="JRA-VAN" else "nar", upload_cache)
-                
-                # 直前レースがある場合は待機時間を1分(60秒)に短縮
-                current_interval = SHORT_SYNC_INTERVAL
-            else:
-                # 直前レースがない（または非開催）場合は待機時間を5分(300秒)に設定
-                current_interval = FULL_SYNC_INTERVAL
-
-            # --- 3. 次のチェックまで待機 ---
-            logging.info(f"[{source_name}] 次のサイクルまで {current_interval}秒 待機します...")
-            for _ in range(current_interval):
-                if stop_event.is_set(): break
-                time.sleep(1)
-
-    except Exception as e:
-        logging.error(f"[{source_name}] ループ内エラー: {e}", exc_info=True)
-
-    finally:
-        logging.info(f"[{source_name}] 🛑 COMオブジェクトのメモリ解放処理を実行中...")
-        if fetcher:
-            fetcher.cleanup()
-        pythoncom.CoUninitialize()
-        logging.info(f"[{source_name}] 🛑 ワーカーが安全に停止しました。")
-
-
 # ==========================================
 # GUI & タスクトレイ UI処理
 # ==========================================
+# ログ画面に残す最大行数 (常駐中にウィジェットのメモリが増え続けないよう、古い行から削除する)
+LOG_WIDGET_MAX_LINES = 5000
+
 class FetcherGUI:
     def __init__(self):
         self.root = tk.Tk()
@@ -163,6 +80,9 @@ class FetcherGUI:
                 break
         
         if has_new_logs:
+            line_count = int(self.text_area.index('end-1c').split('.')[0])
+            if line_count > LOG_WIDGET_MAX_LINES:
+                self.text_area.delete('1.0', f'{line_count - LOG_WIDGET_MAX_LINES + 1}.0')
             self.text_area.see(tk.END)
             self.text_area.config(state='disabled')
             
@@ -185,7 +105,7 @@ def create_image():
     dc.rectangle((16, 16, 48, 48), fill=(255, 255, 255))
     return image
 
-def start_tray_icon(app_instance):
+def start_tray_icon(app_instance, profiler):
     def on_quit(icon, item):
         logging.info("ユーザー操作により終了処理を開始します...")
         stop_event.set()
@@ -195,9 +115,17 @@ def start_tray_icon(app_instance):
     def on_show(icon, item):
         app_instance.root.after(0, app_instance.show_window)
 
+    def on_profile(source_prefix):
+        return lambda icon, item: profiler.request(source_prefix)
+
     image = create_image()
     menu = pystray.Menu(
         item('ログを表示', on_show, default=True),
+        item('プロファイル取得', pystray.Menu(
+            item('JRA-VAN', on_profile("jra")),
+            item('UmaConn', on_profile("nar")),
+            item('両方', on_profile("all")),
+        )),
         item('終了 (Quit)', on_quit)
     )
     
@@ -213,24 +141,52 @@ def main():
     uploader = GCSUploader()
     upload_cache = UploadCache()
 
+    # GCSへの送信は常駐サービスに任せ、COM受信ループはGCSの応答を待たない
+    upload_service = UploadService(uploader, upload_cache)
+    upload_service.start()
+
+    # 送信キューの長さ・同時アップロード数などは取得時点の値を keiba_upload_* として出力する
+    METRICS.add_collector(lambda: [
+        (f"upload_{name}", {}, value) for name, value in upload_service.stats().items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ])
+    # METRICS_PORT のローカルHTTP (/metrics) と、fetcher.log と同じ場所の metrics.jsonl へ出力する
+    metrics_exporter = MetricsExporter(get_base_dir())
+    metrics_exporter.start()
+    # タスクトレイか制御ファイル (profile_request.txt) で要求すると、次の数サイクルのプロファイルを fetcher.log と同じ場所に保存する
+    profiler = CycleProfiler(get_base_dir())
+    profiler.start()
+
     jra_thread = threading.Thread(
         target=fetch_worker_loop, 
-        args=("JRA-VAN", JRAVanFetcher, odds_parser, info_parser, uploader, upload_cache), 
+        args=("JRA-VAN", JRAVanFetcher, odds_parser, info_parser, upload_service, upload_cache, profiler), 
         daemon=False
     )
     uma_thread = threading.Thread(
         target=fetch_worker_loop, 
-        args=("UmaConn", UmaConnFetcher, odds_parser, info_parser, uploader, upload_cache), 
+        args=("UmaConn", UmaConnFetcher, odds_parser, info_parser, upload_service, upload_cache, profiler), 
         daemon=False
     )
     
     jra_thread.start()
     uma_thread.start()
 
-    tray_thread = threading.Thread(target=start_tray_icon, args=(app,), daemon=True)
+    tray_thread = threading.Thread(target=start_tray_icon, args=(app, profiler), daemon=True)
     tray_thread.start()
 
     app.root.mainloop()
 
+    # ワーカーの停止を待ってから送信サービス・キャッシュを閉じる (未送信分は送信箱に残り、次回起動時に再開される)
+    stop_event.set()
+    jra_thread.join()
+    uma_thread.join()
+    profiler.stop()
+    upload_service.stop()
+    upload_cache.close()
+    metrics_exporter.stop()
+    logging.info("=== 統合データフェッチャー 終了 ===")
+
 if __name__ == "__main__":
+    # exe化した場合にリンクワーカープロセス (spawn) が main() を再実行しないようにする
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import time
+import datetime
+from synthetic_records import race_id_for, ra_record, o1_record, o2_record
+
+# データ種別 → 個別キー (YYYYMMDDJJRR) で返すレコード
+ODDS_SPEC_RECORDS = {
+    "0B31": o1_record, "0B41": o1_record,
+    "0B32": o2_record, "0B42": o2_record,
+}
+
+class FakeLink:
+    """
+    JV-Link / NV-Link の擬似実装（Windows以外での動作確認・ベンチマーク用）。
+    日付キーの 0B12/0B15 でRAレコードを、レースキーのオッズ系データ種別でO1/O2レコードを返す。
+    open_latency / read_latency 秒の待ちを入れて、COM呼び出しの所要時間を模擬する。
+    JVRTOpen/NVRTOpen などJV/NV両方のメソッド名で呼び出せる。
+    """
+    def __init__(self, date_str=None, places=(5, 6, 8), races_per_place=12,
+                 open_latency=0.05, read_latency=0.002, first_start="1000"):
+        self.date_str = date_str or datetime.datetime.now().strftime("%Y%m%d")
+        self.open_latency = open_latency
+        self.read_latency = read_latency
+        start_min = int(first_start[:2]) * 60 + int(first_start[2:])
+        self.races = {}  # rt_key -> (race_id, 発走時刻)
+        for place in places:
+            for race_num in range(1, races_per_place + 1):
+                minutes = start_min + (race_num - 1) * 30 + place
+                self.races[f"{self.date_str}{place:02d}{race_num:02d}"] = (
+                    race_id_for(self.date_str, place, race_num), f"{minutes // 60:02d}{minutes % 60:02d}"
+                )
+        self.buffer = []
+        self.open_count = 0
+
+    def _init(self, sid):
+        return 0
+
+    def _rt_open(self, spec, key):
+        time.sleep(self.open_latency)
+        self.open_count += 1
+        self.buffer = []
+        if key == self.date_str and spec in ("0B12", "0B15"):
+            self.buffer = [ra_record(race_id, start, seed=i) for i, (race_id, start) in enumerate(self.races.values())]
+            return 0
+        race = self.races.get(key)
+        record_func = ODDS_SPEC_RECORDS.get(spec)
+        if race is None or record_func is None:
+            return -1
+        happyo_time = datetime.datetime.now().strftime("%m%d%H%M")
+        self.buffer = [self._odds_record(record_func, race[0], happyo_time)]
+        return 0
+
+    def _odds_record(self, record_func, race_id, happyo_time):
+        return record_func(race_id, happyo_time, seed=self.open_count)
+
+    def _gets(self, buff, size, filename):
+        time.sleep(self.read_latency)
+        if not self.buffer:
+            return (0, b"", 0, "")
+        record = self.buffer.pop(0)
+        return (len(record), record, len(record), "")
+
+    def _read(self, buff, size, filename):
+        code, record, length, name = self._gets(buff, size, filename)
+        return (code, record.decode("shift_jis"), length, name)
+
+    def _close(self):
+        self.buffer = []
+        return 0
+
+    JVInit = NVInit = _init
+    JVRTOpen = NVRTOpen = _rt_open
+    JVRead = NVRead = _read
+    JVGets = NVGets = _gets
+    JVClose = NVClose = _close
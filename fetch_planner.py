@@ -0,0 +1,72 @@
+import os
+import time
+import logging
+import threading
+
+# 全体同期で、直前に受信済みの (データ種別, キー) を開き直さない秒数
+FULL_SYNC_FRESHNESS = int(os.environ.get("FETCH_FRESHNESS_SEC", "60"))
+# ピンポイント受信で同じ扱いとする秒数 (レース毎のポーリング間隔より短くすること)
+PINPOINT_FRESHNESS = 5
+
+class FetchPlanner:
+    """
+    全体同期とピンポイント受信で共有する受信履歴。
+    (データ種別, キー) 毎に最後に開いた時刻・応答コード・レコード数を覚えておき、
+    まだ新しいデータを同じサイクル内で再度 Open しないようにする。
+    日付キーでの一括受信は、その日の全レースキーを受信したものとして扱う。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.history = {}  # (spec, key) -> (受信時刻, 応答コード, レコード数)
+        self.fresh_skips = 0
+        self.records = 0
+        self.last_counts = (0, 0)
+
+    def is_fresh(self, spec, key, max_age=FULL_SYNC_FRESHNESS):
+        """max_age 秒以内に、データ有りの応答で受信済みかどうか"""
+        now = time.time()
+        with self.lock:
+            for history_key in ((spec, key), (spec, key[:8])):
+                entry = self.history.get(history_key)
+                if entry is not None and entry[1] >= 0 and now - entry[0] < max_age:
+                    self.fresh_skips += 1
+                    return True
+        return False
+
+    def record(self, spec, key, status, records=0):
+        with self.lock:
+            self.history[(spec, key)] = (time.time(), status, records)
+            self.records += records
+
+    def plan(self, specs, keys, max_age=PINPOINT_FRESHNESS):
+        """
+        ピンポイント受信の (キー, [データ種別...]) の並びを作る。
+        重複したキーを除き、鮮度内のデータ種別は省く (キーの順序は維持する)。
+        """
+        plan = []
+        for key in dict.fromkeys(keys):
+            key_specs = [spec for spec in specs if not self.is_fresh(spec, key, max_age)]
+            plan.append((key, key_specs))
+        return plan
+
+    def last_result(self, spec, key):
+        """(受信時刻, 応答コード, レコード数)。未受信の場合は None"""
+        with self.lock:
+            return self.history.get((spec, key))
+
+    def log_cycle(self, source_name, fetcher, label):
+        """前回の log_cycle 以降の Open/Read 回数・受信レコード数・鮮度によるスキップ数をログに出す"""
+        opens, reads = getattr(fetcher, "open_count", 0), getattr(fetcher, "read_count", 0)
+        with self.lock:
+            last_opens, last_reads = self.last_counts
+            self.last_counts = (opens, reads)
+            records, fresh_skips = self.records, self.fresh_skips
+            self.records = self.fresh_skips = 0
+            # 日付が変わったものや十分古い履歴は破棄する
+            expire = time.time() - 86400
+            for history_key in [k for k, entry in self.history.items() if entry[0] < expire]:
+                del self.history[history_key]
+        logging.info(
+            f"[{source_name}] 受信統計({label}): Open {opens - last_opens}回 / Read {reads - last_reads}回 / "
+            f"{records}レコード / 鮮度によるOpen省略 {fresh_skips}件"
+        )
@@ -0,0 +1,160 @@
+import time
+import datetime
+import logging
+import threading
+import queue
+
+try:
+    import pythoncom
+except ImportError:
+    # Windows 以外 (擬似リンクでの soak_test など) ではCOMの初期化を行わない
+    pythoncom = None
+
+from bundle_writer import CycleBundler, BUNDLE_MODE
+from odds_delta import OddsDeltaEncoder, ODDS_ENCODING
+from parse_memo import ParseMemo
+from race_key_index import RaceKeyIndex
+from processor import process_and_upload_stream
+from race_schedule import RaceScheduleIndex
+from poll_scheduler import RacePollScheduler
+from fetch_planner import FetchPlanner
+from link_pool import LinkWorkerPool, LINK_WORKERS
+from link_replay import link_factory_for, close_link
+from metrics import METRICS
+
+# ==========================================
+# スレッド間通信 (停止要求 & ログ画面向けのキュー)
+# ==========================================
+stop_event = threading.Event()
+log_queue = queue.Queue()
+
+# ==========================================
+# 並行ワーカー関数 (JRA/NAR独立)
+# ==========================================
+def fetch_worker_loop(source_name, fetcher_class, odds_parser, info_parser, uploader, upload_cache, profiler=None):
+    if pythoncom:
+        pythoncom.CoInitialize()
+    fetcher = None
+    link = None
+    link_pool = None
+    profile_token = None
+    source_prefix = "jra" if source_name == "JRA-VAN" else "nar"
+    
+    try:
+        # レースキー索引は日付単位で永続化し、再起動後もデータ種別・サイクルを跨いで共有する
+        # LINK_BACKEND=record/replay の場合はリンクの記録・再生を行う (com の場合は None で通常のCOM)
+        link_factory = link_factory_for(source_prefix, fetcher_class.LINK_PROG_ID)
+        link = link_factory() if link_factory else None
+        fetcher = fetcher_class(race_key_index=RaceKeyIndex(f"race_key_index_{source_prefix}.json"), planner=FetchPlanner(), link=link)
+        # GCS_BUNDLE_MODE=ndjson の場合はサイクル毎のスナップショットを1つのパートファイルにまとめる
+        bundler = CycleBundler(source_prefix) if BUNDLE_MODE == "ndjson" else None
+        # GCS_ODDS_ENCODING=delta の場合は発表時刻毎のオッズを前回からの差分で送る
+        delta_encoder = OddsDeltaEncoder() if ODDS_ENCODING == "delta" else None
+        # 終日変わらないRA/SEなどは、前回と同じ内容なら解析を省略する
+        parse_memo = ParseMemo()
+        # 発走時刻の索引はRAレコードの受信毎に更新し、再起動後もすぐに使えるよう永続化する
+        schedule_index = RaceScheduleIndex(f"race_schedule_{source_prefix}.json")
+        # 直前レースはレース毎に発走までの時間・オッズの変動に応じた間隔で受信する
+        poll_scheduler = RacePollScheduler(schedule_index)
+        
+        if not fetcher.init_link():
+            logging.error(f"[{source_name}] 通信初期化に失敗しました。スレッドを終了します。")
+            return
+
+        # LINK_WORKERS=N (2以上) の場合、ピンポイント受信は開催場単位でN個のリンクプロセスに分散する (全体同期はこのリンクで行う)
+        if LINK_WORKERS > 1:
+            link_pool = LinkWorkerPool(fetcher, LINK_WORKERS, link_factory)
+            if not link_pool.start(stop_event):
+                logging.warning(f"[{source_name}] リンクワーカーを起動できませんでした。単一リンクで受信します。")
+                link_pool.stop()
+                link_pool = None
+
+        last_full_sync = 0
+        FULL_SYNC_INTERVAL = 300  # 5分 (全体同期および閑散期の基本待機)
+        
+        full_specs = ["0B12", "0B15", "0B11", "0B41", "0B42", "0B31", "0B32"]
+        odds_specs = ["0B41", "0B42", "0B31", "0B32"]
+        
+        logging.info(f"[{source_name}] --- ワーカー稼働開始 ---")
+
+        while not stop_event.is_set():
+            # プロファイル取得が要求されていれば、このサイクルの受信・処理 (待機を除く) を計測する
+            profile_token = profiler.begin_cycle(source_prefix) if profiler else None
+            current_time = time.time()
+            today_str = datetime.datetime.now().strftime("%Y%m%d")
+            
+            # --- 1. 全体同期サイクル (前回同期から5分以上経過時のみ) ---
+            if current_time - last_full_sync >= FULL_SYNC_INTERVAL:
+                logging.info(f"[{source_name}] 🔄 --- 全体同期サイクル開始 ---")
+                cycle_started = time.perf_counter()
+                if source_name == "JRA-VAN":
+                    places = fetcher.get_today_places(today_str, stop_event)
+                    if places:
+                        chunks = fetcher.iter_rt_loop(full_specs, today_str, places, source_name, stop_event)
+                    else:
+                        chunks = iter(())
+                else:
+                    chunks = fetcher.iter_rt_loop_uma(full_specs, today_str, source_name, stop_event)
+                    
+                # 受信と並行して解析・アップロードを進める
+                res = process_and_upload_stream(chunks, full_specs, odds_parser, info_parser, uploader, source_prefix, upload_cache, bundler=bundler, delta_encoder=delta_encoder, parse_memo=parse_memo, schedule_index=schedule_index, profiler=profiler)
+                schedule_index.save()
+                fetcher.planner.log_cycle(source_name, fetcher, "全体同期")
+                # 全体同期でオッズも受信済みのため、直前レースの次回予定はここから数える
+                poll_scheduler.observe(res)
+                now_dt = datetime.datetime.now()
+                poll_scheduler.mark_polled(schedule_index.window(now_dt, 600, 900), now_dt)
+                
+                # 同期が完了したら時刻を更新
+                last_full_sync = time.time()
+                METRICS.observe("cycle_seconds", time.perf_counter() - cycle_started, source=source_prefix, kind="full")
+                logging.info(f"[{source_name}] 🔄 --- 全体同期完了 ---")
+
+            # --- 2. ピンポイント同期サイクル & インターバル判定 ---
+            # 発送15分前(900秒) 〜 発送後10分(-600秒) のレースのうち、受信予定時刻を過ぎたものを発走が近い順に受信する
+            now_dt = datetime.datetime.now()
+            next_full_sync = last_full_sync + FULL_SYNC_INTERVAL
+            imminent_keys = poll_scheduler.due_races(now_dt)
+                    
+            if imminent_keys and not stop_event.is_set():
+                logging.info(f"[{source_name}] 🎯 発送直前レース検知 ({len(imminent_keys)}件): {imminent_keys}")
+                polled_keys = []
+                cycle_started = time.perf_counter()
+                deadline = poll_scheduler.fetch_deadline(time.time(), next_full_sync)
+                chunks = (link_pool or fetcher).iter_specific_races(odds_specs, imminent_keys, source_name, stop_event, deadline, polled_keys)
+                res = process_and_upload_stream(chunks, odds_specs, odds_parser, info_parser, uploader, source_prefix, upload_cache, bundler=bundler, delta_encoder=delta_encoder, parse_memo=parse_memo, profiler=profiler)
+                poll_scheduler.observe(res)
+                poll_scheduler.mark_polled(polled_keys, datetime.datetime.now())
+                fetcher.planner.log_cycle(source_name, fetcher, "ピンポイント")
+                METRICS.observe("cycle_seconds", time.perf_counter() - cycle_started, source=source_prefix, kind="pinpoint")
+
+            if profile_token:
+                profiler.end_cycle(source_prefix, profile_token)
+                profile_token = None
+
+            # --- 3. 次のチェックまで待機 ---
+            # 次の全体同期か、次に受信予定のレースのどちらか早い方まで待つ
+            now_dt = datetime.datetime.now()
+            until_full_sync = max(next_full_sync - time.time(), 0)
+            current_interval = int(poll_scheduler.seconds_until_next(now_dt, until_full_sync)) + 1
+            logging.info(f"[{source_name}] 次のサイクルまで {current_interval}秒 待機します...")
+            for _ in range(current_interval):
+                if stop_event.is_set(): break
+                time.sleep(1)
+
+    except Exception as e:
+        logging.error(f"[{source_name}] ループ内エラー: {e}", exc_info=True)
+
+    finally:
+        if profile_token:
+            profiler.end_cycle(source_prefix, profile_token)
+        logging.info(f"[{source_name}] 🛑 COMオブジェクトのメモリ解放処理を実行中...")
+        if link_pool:
+            link_pool.stop()
+        if fetcher:
+            fetcher.cleanup()
+        # LINK_BACKEND=record の場合、記録ファイルを閉じて書き込みを確定させる
+        close_link(link)
+        if pythoncom:
+            pythoncom.CoUninitialize()
+        logging.info(f"[{source_name}] 🛑 ワーカーが安全に停止しました。")
@@ -1,24 +1,97 @@
-import win32com.client
+import os
+import time
 import logging
 import threading
+from record_parser import ascii_field
+from race_key_index import RaceKeyIndex
+from fetch_planner import PINPOINT_FRESHNESS
+from metrics import observe_link_open, observe_link_read
+
+try:
+    import win32com.client
+except ImportError:
+    # Windows以外では link に擬似リンク (fake_link.FakeLink など) を渡して使う
+    win32com = None
+
+# "bytes" を指定すると JVGets/NVGets でShift-JISのバイト列のまま受信する
+DEFAULT_READ_MODE = os.environ.get("FETCHER_READ_MODE", "str")
+
+# ストリーミング受信時に1チャンクへまとめるレコード数
+STREAM_CHUNK_SIZE = 1000
+
+def _iter_read_chunks(fetcher, spec, key, stop_event: threading.Event, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Open済みのストリームを読み切り、chunk_size 件毎に (spec, key, lines) を返す。
+    読み込み完了時のクローズは呼び出し元で行う。
+    """
+    b, s, f = "", 200000, ""
+    lines = []
+    while not stop_event.is_set():
+        c, d = fetcher.read_records(b, s, f)
+        if c > 0 and d:
+            lines.extend(d.splitlines())
+            if len(lines) >= chunk_size:
+                yield spec, key, lines
+                lines = []
+        elif c <= 0: break
+    if lines:
+        yield spec, key, lines
+
+def collect_records(chunks):
+    """ストリーミング受信の (spec, key, lines) を1つのレコードリストにまとめる"""
+    data = []
+    for _, _, lines in chunks:
+        data.extend(lines)
+    return data
 
 class JRAVanFetcher:
-    def __init__(self):
-        try: self.jv = win32com.client.Dispatch("JVDTLab.JVLink")
-        except: self.jv = None
+    LINK_PROG_ID = "JVDTLab.JVLink"
+
+    def __init__(self, read_mode=None, race_key_index=None, planner=None, link=None):
+        self.read_mode = read_mode or DEFAULT_READ_MODE
+        self.race_keys = race_key_index or RaceKeyIndex()
+        # 全体同期とピンポイント受信で受信履歴を共有し、鮮度内の (データ種別, キー) は開き直さない
+        self.planner = planner
+        self.open_count = 0
+        self.read_count = 0
+        self.current_spec = ""
+        if link is not None:
+            self.jv = link
+        else:
+            try: self.jv = win32com.client.Dispatch(self.LINK_PROG_ID)
+            except: self.jv = None
         
     def init_link(self): 
         return self.jv is not None and self.jv.JVInit("UNKNOWN") == 0
 
     def open_rt(self, spec, key):
+        self.open_count += 1
+        self.current_spec = spec
+        started = time.perf_counter()
         res = self.jv.JVRTOpen(spec, key)
-        return int(res[0] if isinstance(res, tuple) else res) if str(res[0] if isinstance(res, tuple) else res).strip() else -1
+        code = int(res[0] if isinstance(res, tuple) else res) if str(res[0] if isinstance(res, tuple) else res).strip() else -1
+        observe_link_open("jv", spec, key, code, time.perf_counter() - started)
+        return code
     
     def read_rt(self, b, s, f):
         r = self.jv.JVRead(b, s, f)
         c, d = (r[0], r[1]) if isinstance(r, tuple) else (r, "")
         try: return int(c), d
         except: return -1, ""
+
+    def read_rt_bytes(self, b, s, f):
+        r = self.jv.JVGets(b, s, f)
+        c, d = (r[0], r[1]) if isinstance(r, tuple) else (r, b"")
+        try: return int(c), bytes(d) if d else b""
+        except: return -1, b""
+
+    def read_records(self, b, s, f):
+        """読み込みモードに応じて JVGets(バイト列) または JVRead(文字列) で受信する"""
+        self.read_count += 1
+        started = time.perf_counter()
+        code, data = self.read_rt_bytes(b, s, f) if self.read_mode == "bytes" else self.read_rt(b, s, f)
+        observe_link_read("jv", self.current_spec, code, len(data), time.perf_counter() - started)
+        return code, data
         
     def close_rt(self): 
         self.jv.JVClose()
@@ -43,11 +116,11 @@ class JRAVanFetcher:
 
         b, s, f = "", 200000, ""
         while not stop_event.is_set():
-            c, d = self.read_rt(b, s, f)
+            c, d = self.read_records(b, s, f)
             if c > 0 and d:
                 for line in d.splitlines():
-                    if len(line) >= 21 and line.startswith("RA"):
-                        place_code = line[19:21]
+                    if len(line) >= 21 and ascii_field(line[0:2]) == "RA":
+                        place_code = ascii_field(line[19:21])
                         if place_code.isdigit():
                             places.add(int(place_code))
             elif c <= 0: break
@@ -58,88 +131,151 @@ class JRAVanFetcher:
         return places_list
 
     def fetch_rt_loop(self, specs, today_str, places, source_name, stop_event: threading.Event):
-        data = []
+        return collect_records(self.iter_rt_loop(specs, today_str, places, source_name, stop_event))
+
+    def iter_rt_loop(self, specs, today_str, places, source_name, stop_event: threading.Event):
+        """fetch_rt_loop のストリーミング版。受信したレコードを (spec, key, lines) 単位で逐次返す"""
         for spec in specs:
             if stop_event.is_set(): break
             
+            if self.planner and self.planner.is_fresh(spec, today_str):
+                logging.info(f"[{source_name}] >> {spec} は直前に日付一括受信済みのためスキップします")
+                continue
             logging.info(f"[{source_name}] >> {spec} の速報データを取得中...")
             res = self.open_rt(spec, today_str)
             if res >= 0:
-                b, s, f = "", 200000, ""
                 read_count = 0
-                while not stop_event.is_set():
-                    c, d = self.read_rt(b, s, f)
-                    if c > 0 and d:
-                        lines = d.splitlines()
-                        data.extend(lines)
-                        read_count += len(lines)
-                    elif c <= 0: break
+                for chunk in _iter_read_chunks(self, spec, today_str, stop_event):
+                    read_count += len(chunk[2])
+                    self.race_keys.add_from_records(chunk[2], today_str)
+                    yield chunk
                 self.close_rt()
+                self.race_keys.save()
+                if self.planner: self.planner.record(spec, today_str, res, read_count)
                 logging.info(f"[{source_name}] << {spec} 日付一括受信完了 ({read_count}レコード分)")
                 continue 
             
+            # 索引済みのレースキーがあればそれだけを開き、無ければ開催場×レース番号を総当たりする
+            candidate_keys = self.race_keys.keys_for(today_str)
+            if not candidate_keys:
+                candidate_keys = [f"{today_str}{jj:02d}{rr:02d}" for jj in places for rr in range(1, 13)]
+
             spec_found = 0
-            for jj in places:
+            skipped = 0
+            for key in candidate_keys:
                 if stop_event.is_set(): break
-                for rr in range(1, 13):
-                    if stop_event.is_set(): break
-                    key = f"{today_str}{jj:02d}{rr:02d}"
-                    try:
-                        res = self.open_rt(spec, key)
-                        if res < 0: continue
-                        b, s, f = "", 200000, ""
-                        while not stop_event.is_set():
-                            c, d = self.read_rt(b, s, f)
-                            if c > 0 and d:
-                                data.extend(d.splitlines())
-                            elif c <= 0: break
-                        self.close_rt()
-                        spec_found += 1
-                    except:
-                        try: self.close_rt()
-                        except: pass
-            if spec_found > 0:
-                logging.info(f"[{source_name}] << {spec} 個別キー受信完了 ({spec_found}レース分)")
-        return data
-
-    def fetch_specific_races(self, specs, keys, source_name, stop_event: threading.Event):
-        data = []
-        for spec in specs:
+                if self.race_keys.is_negative(spec, key):
+                    skipped += 1
+                    continue
+                if self.planner and self.planner.is_fresh(spec, key):
+                    continue
+                try:
+                    res = self.open_rt(spec, key)
+                    if res < 0:
+                        self.race_keys.mark_negative(spec, key)
+                        if self.planner: self.planner.record(spec, key, res)
+                        continue
+                    read_count = 0
+                    for chunk in _iter_read_chunks(self, spec, key, stop_event):
+                        read_count += len(chunk[2])
+                        self.race_keys.add_from_records(chunk[2], today_str)
+                        yield chunk
+                    self.close_rt()
+                    if self.planner: self.planner.record(spec, key, res, read_count)
+                    spec_found += 1
+                except Exception:
+                    try: self.close_rt()
+                    except Exception: pass
+            self.race_keys.save()
+            if spec_found > 0 or skipped > 0:
+                logging.info(f"[{source_name}] << {spec} 個別キー受信完了 ({spec_found}レース分 / データ無しキャッシュによるスキップ {skipped}件)")
+
+    def fetch_specific_races(self, specs, keys, source_name, stop_event: threading.Event, deadline=None, polled_keys=None):
+        return collect_records(self.iter_specific_races(specs, keys, source_name, stop_event, deadline, polled_keys))
+
+    def iter_specific_races(self, specs, keys, source_name, stop_event: threading.Event, deadline=None, polled_keys=None):
+        """
+        fetch_specific_races のストリーミング版。
+        keys の順 (優先度順) にレース単位で全データ種別を受信し、deadline (time.time()) を過ぎたら残りのレースは次回に回す。
+        polled_keys (リスト) を渡した場合、受信を終えたレースキーを追加する。
+        planner がある場合、重複したキーと直前に受信済みの (データ種別, キー) は開かない。
+        """
+        if self.planner:
+            plan = self.planner.plan(specs, keys, PINPOINT_FRESHNESS)
+        else:
+            plan = [(key, specs) for key in dict.fromkeys(keys)]
+        spec_found = {spec: 0 for spec in specs}
+        for i, (key, key_specs) in enumerate(plan):
             if stop_event.is_set(): break
-            spec_found = 0
-            for key in keys:
+            if deadline is not None and time.time() >= deadline:
+                logging.info(f"[{source_name}] ⏱ 受信時間の上限に達したため {len(plan) - i}レースを次回に回します")
+                break
+            for spec in key_specs:
                 if stop_event.is_set(): break
                 res = self.open_rt(spec, key)
+                if self.planner and res < 0: self.planner.record(spec, key, res)
                 if res < 0: continue
-                b, s, f = "", 200000, ""
-                while not stop_event.is_set():
-                    c, d = self.read_rt(b, s, f)
-                    if c > 0 and d:
-                        data.extend(d.splitlines())
-                    elif c <= 0: break
+                read_count = 0
+                for chunk in _iter_read_chunks(self, spec, key, stop_event):
+                    read_count += len(chunk[2])
+                    yield chunk
                 self.close_rt()
-                spec_found += 1
-            if spec_found > 0:
-                logging.info(f"[{source_name}] 🎯 << {spec} ピンポイント受信完了 ({spec_found}レース分)")
-        return data
+                if self.planner: self.planner.record(spec, key, res, read_count)
+                spec_found[spec] += 1
+            if polled_keys is not None and not stop_event.is_set():
+                polled_keys.append(key)
+        for spec, found in spec_found.items():
+            if found > 0:
+                logging.info(f"[{source_name}] 🎯 << {spec} ピンポイント受信完了 ({found}レース分)")
 
 class UmaConnFetcher:
-    def __init__(self):
-        try: self.nv = win32com.client.Dispatch("NVDTLabLib.NVLink")
-        except: self.nv = None
+    LINK_PROG_ID = "NVDTLabLib.NVLink"
+
+    def __init__(self, read_mode=None, race_key_index=None, planner=None, link=None):
+        self.read_mode = read_mode or DEFAULT_READ_MODE
+        self.race_keys = race_key_index or RaceKeyIndex()
+        # 全体同期とピンポイント受信で受信履歴を共有し、鮮度内の (データ種別, キー) は開き直さない
+        self.planner = planner
+        self.open_count = 0
+        self.read_count = 0
+        self.current_spec = ""
+        if link is not None:
+            self.nv = link
+        else:
+            try: self.nv = win32com.client.Dispatch(self.LINK_PROG_ID)
+            except: self.nv = None
         
     def init_link(self): 
         return self.nv is not None and self.nv.NVInit("UNKNOWN") == 0
 
     def open_rt(self, spec, key):
+        self.open_count += 1
+        self.current_spec = spec
+        started = time.perf_counter()
         res = self.nv.NVRTOpen(spec, key)
-        return int(res[0] if isinstance(res, tuple) else res) if str(res[0] if isinstance(res, tuple) else res).strip() else -1
+        code = int(res[0] if isinstance(res, tuple) else res) if str(res[0] if isinstance(res, tuple) else res).strip() else -1
+        observe_link_open("nv", spec, key, code, time.perf_counter() - started)
+        return code
 
     def read_rt(self, b, s, f):
         r = self.nv.NVRead(b, s, f)
         c, d = (r[0], r[1]) if isinstance(r, tuple) else (r, "")
         try: return int(c), d
         except: return -1, ""
+
+    def read_rt_bytes(self, b, s, f):
+        r = self.nv.NVGets(b, s, f)
+        c, d = (r[0], r[1]) if isinstance(r, tuple) else (r, b"")
+        try: return int(c), bytes(d) if d else b""
+        except: return -1, b""
+
+    def read_records(self, b, s, f):
+        """読み込みモードに応じて NVGets(バイト列) または NVRead(文字列) で受信する"""
+        self.read_count += 1
+        started = time.perf_counter()
+        code, data = self.read_rt_bytes(b, s, f) if self.read_mode == "bytes" else self.read_rt(b, s, f)
+        observe_link_read("nv", self.current_spec, code, len(data), time.perf_counter() - started)
+        return code, data
         
     def close_rt(self): 
         self.nv.NVClose()
@@ -152,77 +288,98 @@ class UmaConnFetcher:
         self.nv = None
 
     def fetch_rt_loop_uma(self, specs, today_str, source_name, stop_event: threading.Event):
-        data = []
-        valid_odds_keys = set()
-        
+        return collect_records(self.iter_rt_loop_uma(specs, today_str, source_name, stop_event))
+
+    def iter_rt_loop_uma(self, specs, today_str, source_name, stop_event: threading.Event):
+        """fetch_rt_loop_uma のストリーミング版。受信したレコードを (spec, key, lines) 単位で逐次返す"""
         for spec in specs:
             if stop_event.is_set(): break
             
+            if self.planner and self.planner.is_fresh(spec, today_str):
+                logging.info(f"[{source_name}] >> {spec} は直前に日付一括受信済みのためスキップします")
+                continue
             logging.info(f"[{source_name}] >> {spec} の速報データを取得中...")
             res = self.open_rt(spec, today_str)
             if res >= 0:
-                b, s, f = "", 200000, ""
                 read_count = 0
-                while not stop_event.is_set():
-                    c, d = self.read_rt(b, s, f)
-                    if c > 0 and d:
-                        lines = d.splitlines()
-                        data.extend(lines)
-                        read_count += len(lines)
-                        
-                        if spec == "0B12":
-                            for line in lines:
-                                if len(line) >= 27 and line.startswith("RA"):
-                                    r_id = line[11:27]
-                                    rt_key = r_id[0:8] + r_id[8:10] + r_id[14:16]
-                                    if len(rt_key) == 12 and rt_key.isdigit():
-                                        valid_odds_keys.add(rt_key)
-                    elif c <= 0: break
+                for chunk in _iter_read_chunks(self, spec, today_str, stop_event):
+                    read_count += len(chunk[2])
+                    self.race_keys.add_from_records(chunk[2], today_str)
+                    yield chunk
                 self.close_rt()
+                self.race_keys.save()
+                if self.planner: self.planner.record(spec, today_str, res, read_count)
                 logging.info(f"[{source_name}] << {spec} 日付一括受信完了 ({read_count}レコード分)")
                 continue
 
+            valid_odds_keys = self.race_keys.keys_for(today_str)
             if not valid_odds_keys:
                 continue
                 
             spec_found = 0
-            for key in sorted(list(valid_odds_keys)):
+            skipped = 0
+            for key in valid_odds_keys:
                 if stop_event.is_set(): break
+                if self.race_keys.is_negative(spec, key):
+                    skipped += 1
+                    continue
+                if self.planner and self.planner.is_fresh(spec, key):
+                    continue
                 try:
                     res = self.open_rt(spec, key)
-                    if res < 0: continue
-                    b, s, f = "", 200000, ""
-                    while not stop_event.is_set():
-                        c, d = self.read_rt(b, s, f)
-                        if c > 0 and d:
-                            data.extend(d.splitlines())
-                        elif c <= 0: break
+                    if res < 0:
+                        self.race_keys.mark_negative(spec, key)
+                        if self.planner: self.planner.record(spec, key, res)
+                        continue
+                    read_count = 0
+                    for chunk in _iter_read_chunks(self, spec, key, stop_event):
+                        read_count += len(chunk[2])
+                        self.race_keys.add_from_records(chunk[2], today_str)
+                        yield chunk
                     self.close_rt()
+                    if self.planner: self.planner.record(spec, key, res, read_count)
                     spec_found += 1
-                except:
+                except Exception:
                     try: self.close_rt()
-                    except: pass
-            if spec_found > 0:
-                logging.info(f"[{source_name}] << {spec} 個別キー受信完了 ({spec_found}レース分)")
-        return data
+                    except Exception: pass
+            self.race_keys.save()
+            if spec_found > 0 or skipped > 0:
+                logging.info(f"[{source_name}] << {spec} 個別キー受信完了 ({spec_found}レース分 / データ無しキャッシュによるスキップ {skipped}件)")
 
-    def fetch_specific_races(self, specs, keys, source_name, stop_event: threading.Event):
-        data = []
-        for spec in specs:
+    def fetch_specific_races(self, specs, keys, source_name, stop_event: threading.Event, deadline=None, polled_keys=None):
+        return collect_records(self.iter_specific_races(specs, keys, source_name, stop_event, deadline, polled_keys))
+
+    def iter_specific_races(self, specs, keys, source_name, stop_event: threading.Event, deadline=None, polled_keys=None):
+        """
+        fetch_specific_races のストリーミング版。
+        keys の順 (優先度順) にレース単位で全データ種別を受信し、deadline (time.time()) を過ぎたら残りのレースは次回に回す。
+        polled_keys (リスト) を渡した場合、受信を終えたレースキーを追加する。
+        planner がある場合、重複したキーと直前に受信済みの (データ種別, キー) は開かない。
+        """
+        if self.planner:
+            plan = self.planner.plan(specs, keys, PINPOINT_FRESHNESS)
+        else:
+            plan = [(key, specs) for key in dict.fromkeys(keys)]
+        spec_found = {spec: 0 for spec in specs}
+        for i, (key, key_specs) in enumerate(plan):
             if stop_event.is_set(): break
-            spec_found = 0
-            for key in keys:
+            if deadline is not None and time.time() >= deadline:
+                logging.info(f"[{source_name}] ⏱ 受信時間の上限に達したため {len(plan) - i}レースを次回に回します")
+                break
+            for spec in key_specs:
                 if stop_event.is_set(): break
                 res = self.open_rt(spec, key)
+                if self.planner and res < 0: self.planner.record(spec, key, res)
                 if res < 0: continue
-                b, s, f = "", 200000, ""
-                while not stop_event.is_set():
-                    c, d = self.read_rt(b, s, f)
-                    if c > 0 and d:
-                        data.extend(d.splitlines())
-                    elif c <= 0: break
+                read_count = 0
+                for chunk in _iter_read_chunks(self, spec, key, stop_event):
+                    read_count += len(chunk[2])
+                    yield chunk
                 self.close_rt()
-                spec_found += 1
-            if spec_found > 0:
-                logging.info(f"[{source_name}] 🎯 << {spec} ピンポイント受信完了 ({spec_found}レース分)")
-        return data
\ No newline at end of file
+                if self.planner: self.planner.record(spec, key, res, read_count)
+                spec_found[spec] += 1
+            if polled_keys is not None and not stop_event.is_set():
+                polled_keys.append(key)
+        for spec, found in spec_found.items():
+            if found > 0:
+                logging.info(f"[{source_name}] 🎯 << {spec} ピンポイント受信完了 ({found}レース分)")
@@ -1,41 +1,226 @@
 import os
+import gzip
 import json
+import time
 import logging
+import threading
 from google.cloud import storage
 import concurrent.futures
+from record_parser import to_json_compatible
+from metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
+# 環境変数 GCS_COMPRESSION=gzip でアップロード時に圧縮する (既定は無圧縮)
+DEFAULT_COMPRESSION = os.environ.get("GCS_COMPRESSION", "none")
+GZIP_LEVEL = 6
+
+# 同時アップロード数の下限/上限 (環境変数で上書き可能)
+DEFAULT_MIN_WORKERS = int(os.environ.get("GCS_MIN_WORKERS", "2"))
+DEFAULT_MAX_WORKERS = int(os.environ.get("GCS_MAX_WORKERS", "10"))
+# 同時数を減らす判定の閾値: 1件あたりのレイテンシp90 (秒) とエラー率 (環境変数で上書き可能)
+DEFAULT_TARGET_P90 = float(os.environ.get("GCS_TARGET_P90", "5.0"))
+DEFAULT_MAX_ERROR_RATE = float(os.environ.get("GCS_MAX_ERROR_RATE", "0.05"))
+
+# アップロード結果の分類
+UPLOAD_OK = "ok"
+UPLOAD_THROTTLED = "throttled"  # 429 / 503 (帯域・レート制限)
+UPLOAD_FAILED = "failed"
+THROTTLE_STATUS_CODES = (429, 503)
+
+class Payload:
+    """シリアライズ（および圧縮）済みのアップロード本体"""
+    __slots__ = ("data", "raw_size", "content_type", "content_encoding")
+
+    def __init__(self, data, raw_size, content_type="application/json", content_encoding=None):
+        self.data = data
+        self.raw_size = raw_size
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+
+def build_payload(data_dict, compression="none", level=None):
+    """辞書を一度だけJSONにシリアライズし、必要に応じてgzip圧縮したPayloadを返す"""
+    # 日本語が文字化けしないよう ensure_ascii=False を指定
+    raw = json.dumps(data_dict, ensure_ascii=False, default=to_json_compatible).encode("utf-8")
+    if compression == "gzip":
+        compressed = gzip.compress(raw, compresslevel=level or GZIP_LEVEL, mtime=0)
+        return Payload(compressed, len(raw), content_encoding="gzip")
+    return Payload(raw, len(raw))
+
+class AdaptiveConcurrency:
+    """
+    AIMD (加算増加・乗算減少) による同時アップロード数の自動調整。
+    window 件の完了毎に評価し、429/503 を検知するか、エラー率・レイテンシp90が閾値を超えた場合は
+    同時数を decrease_factor 倍に減らし、問題がなく同時数の上限まで使われていれば1ずつ増やす。
+    """
+    def __init__(self, min_limit, max_limit, initial=None, window=20, target_p90=DEFAULT_TARGET_P90,
+                 max_error_rate=DEFAULT_MAX_ERROR_RATE, decrease_factor=0.5):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial or self.min_limit, self.min_limit), self.max_limit)
+        self.window = window
+        self.target_p90 = target_p90
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+
+        self.cond = threading.Condition()
+        self.active = 0
+        # 同時数を変更する毎に進める世代番号。変更前に開始した送信の結果は評価に使わない
+        self.epoch = 0
+        self._reset_window()
+        self.last_stats = {"p50": None, "p90": None, "error_rate": 0.0, "uploads_per_sec": 0.0, "bytes_per_sec": 0.0}
+        self.total_uploads = 0
+        self.total_bytes = 0
+
+    def _reset_window(self):
+        self.samples = []
+        self.window_bytes = 0
+        self.window_peak = 0
+        self.window_start = time.monotonic()
+
+    def acquire(self):
+        """送信枠を1つ確保する。戻り値: release に渡す世代番号"""
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+            self.window_peak = max(self.window_peak, self.active)
+            return self.epoch
+
+    def release(self, epoch, latency, status, nbytes=0):
+        with self.cond:
+            self.active -= 1
+            if status == UPLOAD_OK:
+                self.total_uploads += 1
+                self.total_bytes += nbytes
+            if epoch == self.epoch:
+                self.samples.append((latency, status))
+                if status == UPLOAD_OK:
+                    self.window_bytes += nbytes
+                if len(self.samples) >= self.window or status == UPLOAD_THROTTLED:
+                    self._adjust()
+            self.cond.notify_all()
+
+    def _adjust(self):
+        """評価窓の統計から同時数を更新する（cond 取得済みで呼ぶこと）"""
+        latencies = sorted(latency for latency, _ in self.samples)
+        n = len(latencies)
+        elapsed = max(time.monotonic() - self.window_start, 1e-6)
+        errors = sum(1 for _, status in self.samples if status != UPLOAD_OK)
+        throttled = any(status == UPLOAD_THROTTLED for _, status in self.samples)
+        ok_count = n - errors
+
+        self.last_stats = {
+            "p50": latencies[n // 2],
+            "p90": latencies[min(n - 1, int(n * 0.9))],
+            "error_rate": errors / n,
+            "uploads_per_sec": ok_count / elapsed,
+            "bytes_per_sec": self.window_bytes / elapsed,
+        }
+
+        old_limit = self.limit
+        if throttled or self.last_stats["error_rate"] > self.max_error_rate or self.last_stats["p90"] > self.target_p90:
+            self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+        elif self.window_peak >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+        if self.limit != old_limit:
+            self.epoch += 1
+            logger.info(
+                f"同時アップロード数を調整: {old_limit} → {self.limit} "
+                f"(p90 {self.last_stats['p90']:.2f}秒 / エラー率 {self.last_stats['error_rate']:.0%}"
+                f"{' / 帯域制限検知' if throttled else ''})"
+            )
+        self._reset_window()
+
+    def stats(self):
+        with self.cond:
+            return dict(self.last_stats, limit=self.limit, active=self.active,
+                        min_limit=self.min_limit, max_limit=self.max_limit,
+                        total_uploads=self.total_uploads, total_bytes=self.total_bytes)
+
 class GCSUploader:
     """
     パース済みのデータをGoogle Cloud StorageにJSONとして直接アップロードするクラス。
     """
-    def __init__(self, bucket_name="keiba-analysis-keiba-data", max_workers=10):
+    def __init__(self, bucket_name="keiba-analysis-keiba-data", max_workers=None, compression=None, min_workers=None,
+                 target_p90=None, max_error_rate=None):
         self.bucket_name = os.environ.get("GCS_BUCKET_NAME", bucket_name)
-        self.max_workers = max_workers
+        # max_workers はスレッド数の上限。実際の同時アップロード数は AIMD で min_workers〜max_workers に調整する
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.concurrency = AdaptiveConcurrency(
+            min_workers or DEFAULT_MIN_WORKERS, self.max_workers,
+            target_p90=target_p90 or DEFAULT_TARGET_P90,
+            max_error_rate=DEFAULT_MAX_ERROR_RATE if max_error_rate is None else max_error_rate,
+        )
+        self.compression = compression or DEFAULT_COMPRESSION
         try:
             self.client = storage.Client()
             self.bucket = self.client.bucket(self.bucket_name)
-            logger.info(f"GCSクライアント初期化成功: ターゲットバケット [{self.bucket_name}] (最大並列数: {self.max_workers})")
+            self._configure_connection_pool()
+            logger.info(f"GCSクライアント初期化成功: ターゲットバケット [{self.bucket_name}] (並列数: {self.concurrency.min_limit}〜{self.max_workers} 自動調整)")
         except Exception as e:
             logger.error(f"GCSクライアント初期化エラー (認証情報の確認が必要です): {e}")
             self.client = None
             self.bucket = None
 
-    def _upload_single(self, destination_blob_name, data_dict):
-        """内部用の単一ファイルアップロード処理"""
+        # アップロード用のスレッドプールは常駐させ、呼び出し毎に作り直さない
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="gcs-upload")
+
+    def _configure_connection_pool(self):
+        """並列数に合わせてHTTP接続プールを拡張し、ワーカー間で接続を使い回す"""
+        try:
+            from requests.adapters import HTTPAdapter
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+            self.client._http.mount("https://", adapter)
+        except Exception as e:
+            logger.warning(f"HTTP接続プールの設定に失敗しました (既定の設定で継続します): {e}")
+
+    def build_payload(self, data_dict):
+        """このアップローダーの圧縮設定でPayloadを作成する"""
+        return build_payload(data_dict, self.compression)
+
+    def _upload_single(self, destination_blob_name, payload):
+        """内部用の単一ファイルアップロード処理 (payload は Payload または辞書)"""
+        status = self._upload_with_status(destination_blob_name, payload)
+        return status == UPLOAD_OK, destination_blob_name
+
+    def _upload_with_status(self, destination_blob_name, payload):
+        """同時数の制御下で1件アップロードし、結果 (UPLOAD_OK/UPLOAD_THROTTLED/UPLOAD_FAILED) を返す"""
         if not self.bucket:
-            return False, destination_blob_name
-            
+            return UPLOAD_FAILED
+
+        if not isinstance(payload, Payload):
+            payload = self.build_payload(payload)
+
+        epoch = self.concurrency.acquire()
+        started = time.monotonic()
+        status = UPLOAD_FAILED
         try:
             blob = self.bucket.blob(destination_blob_name)
-            # 日本語が文字化けしないよう ensure_ascii=False を指定
-            json_data = json.dumps(data_dict, ensure_ascii=False)
-            blob.upload_from_string(json_data, content_type='application/json')
-            return True, destination_blob_name
+            blob.content_encoding = payload.content_encoding
+            blob.upload_from_string(payload.data, content_type=payload.content_type)
+            status = UPLOAD_OK
         except Exception as e:
+            if getattr(e, "code", None) in THROTTLE_STATUS_CODES:
+                status = UPLOAD_THROTTLED
             logger.error(f"GCSアップロード失敗 ({destination_blob_name}): {e}")
-            return False, destination_blob_name
+        finally:
+            latency = time.monotonic() - started
+            self.concurrency.release(epoch, latency, status, len(payload.data))
+            METRICS.observe("upload_seconds", latency, status=status)
+            if status == UPLOAD_OK:
+                METRICS.inc("upload_bytes_total", len(payload.data))
+        return status
+
+    def upload_payload(self, destination_blob_name, payload):
+        """作成済みのPayloadを1件アップロードする（同期版）。戻り値: 成功したかどうか"""
+        success, _ = self._upload_single(destination_blob_name, payload)
+        return success
+
+    def stats(self):
+        """監視用: 現在の同時アップロード数・レイテンシ・スループット"""
+        return self.concurrency.stats()
 
     def upload_json(self, destination_blob_name, data_dict):
         """
@@ -49,25 +234,24 @@ class GCSUploader:
     def upload_jsons_parallel(self, upload_tasks):
         """
         複数のJSONをスレッドプールを用いて並列アップロードする。
-        upload_tasks: [(destination_blob_name, data_dict), ...]
+        upload_tasks: [(destination_blob_name, Payload または data_dict), ...]
         戻り値: アップロードに成功した destination_blob_name のリスト
         """
         if not self.bucket or not upload_tasks:
             return []
 
         successful_blobs = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # タスクをスレッドプールに投入
-            future_to_blob = {
-                executor.submit(self._upload_single, blob_name, data): blob_name
-                for blob_name, data in upload_tasks
-            }
-            
-            # 完了したものから結果を回収
-            for future in concurrent.futures.as_completed(future_to_blob):
-                success, blob_name = future.result()
-                if success:
-                    successful_blobs.append(blob_name)
+        # タスクを常駐スレッドプールに投入
+        future_to_blob = {
+            self.executor.submit(self._upload_single, blob_name, data): blob_name
+            for blob_name, data in upload_tasks
+        }
+        
+        # 完了したものから結果を回収
+        for future in concurrent.futures.as_completed(future_to_blob):
+            success, blob_name = future.result()
+            if success:
+                successful_blobs.append(blob_name)
                     
         if successful_blobs:
             logger.info(f"GCS並列保存完了: 一括で {len(successful_blobs)} 件のファイルをアップロードしました")
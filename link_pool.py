@@ -0,0 +1,219 @@
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from fetchers import _iter_read_chunks
+from fetch_planner import PINPOINT_FRESHNESS
+from link_replay import close_link
+
+# 環境変数 LINK_WORKERS=N (2以上) で、ピンポイント受信をN個のリンクワーカープロセスに分散する
+LINK_WORKERS = int(os.environ.get("LINK_WORKERS", "0"))
+
+# ワーカーからの応答を待つ間隔 (秒)。この間に停止要求・ワーカーの異常終了を確認する
+RESULT_POLL_INTERVAL = 1.0
+# ワーカーのリンク初期化を待つ上限 (秒)。超えたワーカーは使わない
+STARTUP_TIMEOUT = int(os.environ.get("LINK_WORKER_STARTUP_TIMEOUT", "120"))
+
+def _link_worker_main(worker_id, fetcher_class, link_factory, read_mode, task_queue, result_queue, cancel_event):
+    """
+    リンクワーカープロセスの本体。自前の JV-Link/NV-Link を CoInitialize した上で生成し、
+    割り当てられた (キー, [データ種別...]) を順に受信して、レコードを結果キューへ送る。
+    """
+    try:
+        import pythoncom
+        pythoncom.CoInitialize()
+    except ImportError:
+        pythoncom = None
+
+    link = None
+    try:
+        link = link_factory() if link_factory else None
+        fetcher = fetcher_class(read_mode=read_mode, link=link)
+    except Exception as e:
+        logging.error(f"[link-worker-{worker_id}] リンクを生成できませんでした: {e}")
+        result_queue.put((worker_id, None, "ready", False))
+        if pythoncom:
+            pythoncom.CoUninitialize()
+        return
+    ok = fetcher.init_link()
+    result_queue.put((worker_id, None, "ready", ok))
+    try:
+        while ok:
+            task = task_queue.get()
+            if task is None:
+                break
+            task_id, plan, deadline = task
+            opens, reads = fetcher.open_count, fetcher.read_count
+            for key, specs in plan:
+                if cancel_event.is_set() or (deadline is not None and time.time() >= deadline):
+                    break
+                for spec in specs:
+                    if cancel_event.is_set():
+                        break
+                    try:
+                        res = fetcher.open_rt(spec, key)
+                        if res < 0:
+                            result_queue.put((worker_id, task_id, "result", (spec, key, res, 0)))
+                            continue
+                        read_count = 0
+                        for chunk in _iter_read_chunks(fetcher, spec, key, cancel_event):
+                            read_count += len(chunk[2])
+                            result_queue.put((worker_id, task_id, "chunk", chunk))
+                        fetcher.close_rt()
+                        result_queue.put((worker_id, task_id, "result", (spec, key, res, read_count)))
+                    except Exception as e:
+                        logging.error(f"[link-worker-{worker_id}] 受信エラー ({spec}, {key}): {e}")
+                        try: fetcher.close_rt()
+                        except Exception: pass
+                result_queue.put((worker_id, task_id, "polled", key))
+            result_queue.put((worker_id, task_id, "done", (fetcher.open_count - opens, fetcher.read_count - reads)))
+    finally:
+        fetcher.cleanup()
+        close_link(link)
+        if pythoncom:
+            pythoncom.CoUninitialize()
+
+class LinkWorkerPool:
+    """
+    1ソースあたりN個のリンクワーカープロセス。各プロセスが独立したリンクを持ち、
+    ピンポイント受信のレースキーを開催場単位でワーカーに振り分けて並列に受信する。
+    受信レコードはパイプ (multiprocessing.Queue) でメインプロセスへ戻し、
+    fetcher.iter_specific_races と同じ (spec, key, lines) のストリームとして返す。
+    link_factory には擬似リンクを生成する関数（pickle可能なもの）を指定できる。
+    """
+    def __init__(self, fetcher, num_workers, link_factory=None):
+        self.fetcher = fetcher
+        self.num_workers = num_workers
+        self.link_factory = link_factory
+        self.context = multiprocessing.get_context("spawn")
+        self.result_queue = self.context.Queue()
+        self.cancel_event = self.context.Event()
+        self.task_queues = []
+        self.processes = []
+        self.ready = []
+        self.next_task_id = 0
+
+    def start(self, stop_event=None, timeout=STARTUP_TIMEOUT):
+        """
+        ワーカープロセスを起動し、リンクの初期化を待つ。
+        初期化前に異常終了したワーカー・timeout 秒以内に応答しないワーカーは使わない。
+        戻り値: 1つでも使えるワーカーがあれば True
+        """
+        for worker_id in range(self.num_workers):
+            task_queue = self.context.Queue()
+            process = self.context.Process(
+                target=_link_worker_main,
+                args=(worker_id, type(self.fetcher), self.link_factory, self.fetcher.read_mode,
+                      task_queue, self.result_queue, self.cancel_event),
+                name=f"link-worker-{worker_id}", daemon=True,
+            )
+            process.start()
+            self.task_queues.append(task_queue)
+            self.processes.append(process)
+
+        # 全ワーカーのリンク初期化を待つ
+        self.ready = [False] * self.num_workers
+        waiting = set(range(self.num_workers))
+        deadline = time.time() + timeout
+        while waiting:
+            if stop_event is not None and stop_event.is_set():
+                break
+            try:
+                worker_id, _, kind, ok = self.result_queue.get(timeout=RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                for worker_id in sorted(waiting):
+                    if not self.processes[worker_id].is_alive():
+                        logging.error(f"リンクワーカー{worker_id}が初期化前に異常終了しました (終了コード {self.processes[worker_id].exitcode})")
+                        waiting.discard(worker_id)
+                if waiting and time.time() >= deadline:
+                    logging.error(f"リンクワーカーの初期化が {timeout}秒以内に完了しませんでした: {sorted(waiting)}")
+                    break
+                continue
+            if kind == "ready" and worker_id in waiting:
+                self.ready[worker_id] = ok
+                waiting.discard(worker_id)
+        logging.info(f"リンクワーカー起動: {sum(self.ready)}/{self.num_workers}プロセス")
+        return any(self.ready)
+
+    def stop(self, timeout=5):
+        self.cancel_event.set()
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def _shard(self, plan):
+        """開催場 (キーの9〜10桁目) 単位で、受信件数が均等になるようワーカーへ割り当てる。各ワーカー内の順序は優先度順を維持する"""
+        by_place = {}
+        for key, specs in plan:
+            by_place.setdefault(key[8:10], []).append((key, specs))
+        workers = [i for i, ok in enumerate(self.ready) if ok]
+        shards = {i: [] for i in workers}
+        for entries in sorted(by_place.values(), key=len, reverse=True):
+            target = min(workers, key=lambda i: len(shards[i]))
+            shards[target].extend(entries)
+        # 開催場を跨いだ優先度順を保つため、各シャード内を元の並びに戻す
+        order = {key: i for i, (key, _) in enumerate(plan)}
+        for entries in shards.values():
+            entries.sort(key=lambda entry: order[entry[0]])
+        return shards
+
+    def iter_specific_races(self, specs, keys, source_name, stop_event: threading.Event, deadline=None, polled_keys=None):
+        """fetcher.iter_specific_races の並列版。受信したワーカーから順に (spec, key, lines) を返す"""
+        planner = self.fetcher.planner
+        if planner:
+            plan = planner.plan(specs, keys, PINPOINT_FRESHNESS)
+        else:
+            plan = [(key, specs) for key in dict.fromkeys(keys)]
+
+        task_id = self.next_task_id
+        self.next_task_id += 1
+        pending = set()
+        for worker_id, shard in self._shard(plan).items():
+            if shard:
+                self.task_queues[worker_id].put((task_id, shard, deadline))
+                pending.add(worker_id)
+
+        spec_found = {spec: 0 for spec in specs}
+        polled_count = 0
+        while pending:
+            if stop_event.is_set():
+                self.cancel_event.set()
+            try:
+                worker_id, msg_task_id, kind, payload = self.result_queue.get(timeout=RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                for worker_id in list(pending):
+                    if not self.processes[worker_id].is_alive():
+                        logging.error(f"[{source_name}] リンクワーカー{worker_id}が異常終了しました")
+                        self.ready[worker_id] = False
+                        pending.discard(worker_id)
+                continue
+            if msg_task_id != task_id:
+                continue  # 中断した過去のタスクの残り
+            if kind == "chunk":
+                yield payload
+            elif kind == "result":
+                spec, key, res, read_count = payload
+                if planner: planner.record(spec, key, res, read_count)
+                if res >= 0: spec_found[spec] += 1
+            elif kind == "polled":
+                polled_count += 1
+                if polled_keys is not None:
+                    polled_keys.append(payload)
+            elif kind == "done":
+                self.fetcher.open_count += payload[0]
+                self.fetcher.read_count += payload[1]
+                pending.discard(worker_id)
+
+        if stop_event.is_set():
+            return
+        self.cancel_event.clear()
+        if polled_count < len(plan) and deadline is not None and time.time() >= deadline:
+            logging.info(f"[{source_name}] ⏱ 受信時間の上限に達したため {len(plan) - polled_count}レースを次回に回します")
+        for spec, found in spec_found.items():
+            if found > 0:
+                logging.info(f"[{source_name}] 🎯 << {spec} ピンポイント受信完了 ({found}レース分 / {len(self.processes)}プロセス)")
@@ -0,0 +1,44 @@
+import sys
+import time
+import datetime
+import functools
+import threading
+from fake_link import FakeLink
+from fetchers import JRAVanFetcher, collect_records
+from link_pool import LinkWorkerPool
+
+def run_benchmark(worker_counts, places=(5, 6, 8), races_per_place=12, open_latency=0.05):
+    """
+    擬似リンク (FakeLink) で、全レースのオッズ (0B31/0B32) を1サイクル分ピンポイント受信する時間を
+    単一リンクとワーカープロセス数毎に計測する。
+    """
+    date_str = datetime.datetime.now().strftime("%Y%m%d")
+    link_factory = functools.partial(FakeLink, date_str, places, races_per_place, open_latency)
+    keys = list(link_factory().races)
+    specs = ["0B31", "0B32"]
+    stop_event = threading.Event()
+
+    results = []
+    fetcher = JRAVanFetcher(link=link_factory())
+    fetcher.init_link()
+    start = time.perf_counter()
+    records = collect_records(fetcher.iter_specific_races(specs, keys, "BENCH", stop_event))
+    results.append({"workers": 0, "races": len(keys), "records": len(records), "sec": round(time.perf_counter() - start, 3)})
+
+    for num_workers in worker_counts:
+        pool = LinkWorkerPool(JRAVanFetcher(link=link_factory()), num_workers, link_factory)
+        pool.start()
+        try:
+            start = time.perf_counter()
+            records = collect_records(pool.iter_specific_races(specs, keys, "BENCH", stop_event))
+            results.append({"workers": num_workers, "races": len(keys), "records": len(records), "sec": round(time.perf_counter() - start, 3)})
+        finally:
+            pool.stop()
+    return results
+
+if __name__ == "__main__":
+    worker_counts = [int(n) for n in sys.argv[1:]] or [1, 2, 4]
+    print("=== リンクワーカーベンチマーク (擬似リンク / 0B31・0B32) ===")
+    for result in run_benchmark(worker_counts):
+        label = "単一リンク" if result["workers"] == 0 else f"{result['workers']}プロセス"
+        print(f"{label:>8}: {result['races']}レース / {result['records']}レコード / {result['sec']:7.3f}秒")
@@ -0,0 +1,343 @@
+import os
+import glob
+import gzip
+import json
+import time
+import logging
+import argparse
+import datetime
+import tempfile
+import functools
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 環境変数 LINK_BACKEND でリンクの実装を切り替える
+#   com    : JV-Link / NV-Link をそのまま使う (既定)
+#   record : JV-Link / NV-Link の呼び出しと応答を LINK_RECORDING_DIR に記録しながら使う
+#   replay : LINK_RECORDING_DIR の最新の記録を再生する (COM不要)
+LINK_BACKEND = os.environ.get("LINK_BACKEND", "com")
+LINK_RECORDING_DIR = os.environ.get("LINK_RECORDING_DIR", "")
+# 再生速度。1 で記録時と同じ所要時間、N でN倍速、0 で待ち時間なし
+LINK_REPLAY_SPEED = float(os.environ.get("LINK_REPLAY_SPEED", "1"))
+
+RECORDING_VERSION = 1
+
+def recording_dir():
+    if LINK_RECORDING_DIR:
+        return LINK_RECORDING_DIR
+    from processor import get_base_dir
+    return os.path.join(get_base_dir(), "link_recordings")
+
+def _to_text(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data).decode("latin-1"), True
+    return data or "", False
+
+def _first(res):
+    return res[0] if isinstance(res, tuple) else res
+
+class RecordingLink:
+    """
+    JV-Link / NV-Link をラップし、Init/RTOpen/Read/Gets/Close の引数・応答・所要時間を
+    gzip圧縮したJSON Lines に記録する。JV/NVどちらのメソッド名でも呼び出せ、それ以外の属性は元のリンクへ委譲する。
+    記録は Close 毎にフラッシュするため、異常終了しても直前のストリームまでは再生できる。
+    """
+    def __init__(self, inner, path, prog_id=""):
+        self.inner = inner
+        self.prefix = "NV" if prog_id.startswith("NV") else "JV"
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({
+            "recording": RECORDING_VERSION, "prog_id": prog_id,
+            "date": datetime.datetime.now().strftime("%Y%m%d"), "started_at": time.time(),
+        })
+        logger.info(f"リンクの記録を開始: {path}")
+
+    def _write(self, event, flush=False):
+        with self.lock:
+            self.file.write(json.dumps(event, ensure_ascii=False) + "\n")
+            if flush:
+                self.file.flush()
+
+    def _call(self, method, *args):
+        start = time.perf_counter()
+        res = getattr(self.inner, self.prefix + method)(*args)
+        return res, round((time.perf_counter() - start) * 1000, 3)
+
+    def _init(self, sid):
+        res, ms = self._call("Init", sid)
+        self._write({"op": "init", "at": time.time(), "res": _first(res), "ms": ms})
+        return res
+
+    def _rt_open(self, spec, key):
+        res, ms = self._call("RTOpen", spec, key)
+        self._write({"op": "open", "at": time.time(), "spec": spec, "key": key, "res": _first(res), "ms": ms})
+        return res
+
+    def _read_with(self, method, buff, size, filename):
+        res, ms = self._call(method, buff, size, filename)
+        code, data = (res[0], res[1]) if isinstance(res, tuple) else (res, "")
+        text, is_bytes = _to_text(data)
+        self._write({"op": "read", "at": time.time(), "code": code, "data": text, "bytes": is_bytes, "ms": ms})
+        return res
+
+    def _read(self, buff, size, filename):
+        return self._read_with("Read", buff, size, filename)
+
+    def _gets(self, buff, size, filename):
+        return self._read_with("Gets", buff, size, filename)
+
+    def _close(self):
+        res, ms = self._call("Close")
+        self._write({"op": "close", "at": time.time(), "ms": ms}, flush=True)
+        return res
+
+    def close_recording(self):
+        with self.lock:
+            self.file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    JVInit = NVInit = _init
+    JVRTOpen = NVRTOpen = _rt_open
+    JVRead = NVRead = _read
+    JVGets = NVGets = _gets
+    JVClose = NVClose = _close
+
+def load_recording(path):
+    """記録ファイルを (ヘッダー, [イベント...]) として読み込む。末尾が途切れている場合はそこまでを返す"""
+    header, events = {}, []
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "recording" in event:
+                    header = event
+                else:
+                    events.append(event)
+    except (EOFError, OSError, ValueError) as e:
+        logger.warning(f"記録ファイルの末尾が不完全なため、読み込めた分までを使います ({path}: {e})")
+    return header, events
+
+class ReplayLink:
+    """
+    RecordingLink の記録を再生する擬似リンク。(データ種別, キー) 毎に記録されたストリームを記録順に返し、
+    記録を使い切った後は最後のストリームを返し続ける (オッズが更新されない状態)。記録の無いキーは -1 (該当データなし)。
+    応答コードは -1 や -1未満 (エラー) も含めて記録のまま返し、speed に応じて記録時の所要時間だけ待つ。
+    date_str を指定すると、その日付のキーを記録日のキーとして扱う (別の日に記録を再生するため)。
+    """
+    def __init__(self, paths, speed=1.0, date_str=None):
+        if isinstance(paths, str):
+            paths = [paths]
+        self.speed = speed
+        self.date_str = date_str or datetime.datetime.now().strftime("%Y%m%d")
+        self.recorded_date = None
+        self.init_result = (0, 0)
+        self.streams = {}  # (spec, 正規化したキー) -> [(応答コード, 所要ミリ秒, [(code, data, bytes, ms)...])...]
+        self.positions = {}
+        self.reads = []
+        self._load(paths)
+
+    def _load(self, paths):
+        opens = []
+        for path in paths:
+            header, events = load_recording(path)
+            self.recorded_date = self.recorded_date or header.get("date")
+            current = None
+            for event in events:
+                op = event["op"]
+                if op == "init":
+                    self.init_result = (event["res"], event["ms"])
+                elif op == "open":
+                    current = (event["at"], event["spec"], event["key"], event["res"], event["ms"], [])
+                    opens.append(current)
+                elif op == "read" and current is not None:
+                    current[5].append((event["code"], event["data"], event["bytes"], event["ms"]))
+                elif op == "close":
+                    current = None
+        # 複数プロセスの記録は、Open した時刻の順に並べる
+        opens.sort(key=lambda entry: entry[0])
+        for _, spec, key, res, ms, reads in opens:
+            self.streams.setdefault((spec, self._normalize(key)), []).append((res, ms, reads))
+        logger.info(f"リンクの記録を読み込み: {len(opens)}ストリーム / {len(self.streams)}キー (記録日 {self.recorded_date})")
+
+    def _normalize(self, key):
+        if key[:8] in (self.recorded_date, self.date_str):
+            return "*" + key[8:]
+        return key
+
+    def _wait(self, ms):
+        if self.speed > 0 and ms:
+            time.sleep(ms / 1000 / self.speed)
+
+    def _init(self, sid):
+        res, ms = self.init_result
+        self._wait(ms)
+        return res
+
+    def _rt_open(self, spec, key):
+        stream_key = (spec, self._normalize(key))
+        streams = self.streams.get(stream_key)
+        self.reads = []
+        if not streams:
+            return -1
+        position = self.positions.get(stream_key, 0)
+        res, ms, reads = streams[min(position, len(streams) - 1)]
+        self.positions[stream_key] = position + 1
+        self._wait(ms)
+        self.reads = list(reads)
+        return res
+
+    def _next_read(self):
+        if not self.reads:
+            return 0, "", False, 0
+        return self.reads.pop(0)
+
+    def _read(self, buff, size, filename):
+        code, data, is_bytes, ms = self._next_read()
+        self._wait(ms)
+        if is_bytes:
+            data = data.encode("latin-1").decode("cp932", errors="replace")
+        return (code, data, len(data), "")
+
+    def _gets(self, buff, size, filename):
+        code, data, is_bytes, ms = self._next_read()
+        self._wait(ms)
+        raw = data.encode("latin-1") if is_bytes else data.encode("cp932", errors="replace")
+        return (code, raw, len(raw), "")
+
+    def _close(self):
+        self.reads = []
+        return 0
+
+    JVInit = NVInit = _init
+    JVRTOpen = NVRTOpen = _rt_open
+    JVRead = NVRead = _read
+    JVGets = NVGets = _gets
+    JVClose = NVClose = _close
+
+def find_recordings(source_prefix, directory=None):
+    """最新の記録セッション (メイン・リンクワーカー各プロセスの記録) のファイル一覧"""
+    paths = sorted(glob.glob(os.path.join(directory or recording_dir(), f"{source_prefix}_*.jsonl.gz")))
+    if not paths:
+        return []
+    session = os.path.basename(paths[-1]).split("_")[1:3]
+    return [path for path in paths if os.path.basename(path).split("_")[1:3] == session]
+
+def _create_recording_link(source_prefix, prog_id, session):
+    import win32com.client
+    path = os.path.join(recording_dir(), f"{source_prefix}_{session}_{os.getpid()}.jsonl.gz")
+    return RecordingLink(win32com.client.Dispatch(prog_id), path, prog_id)
+
+def _create_replay_link(source_prefix, speed):
+    paths = find_recordings(source_prefix)
+    if not paths:
+        # None を返すと fetcher が実際のCOMリンクを生成してしまうため、再生時は必ずエラーにする
+        raise FileNotFoundError(f"[{source_prefix}] 再生するリンクの記録がありません ({recording_dir()})")
+    return ReplayLink(paths, speed)
+
+def close_link(link):
+    """記録中のリンクであれば記録ファイルを閉じる (ワーカー終了時に呼ぶ。それ以外のリンクは何もしない)"""
+    if isinstance(link, RecordingLink):
+        link.close_recording()
+
+def link_factory_for(source_prefix, prog_id):
+    """
+    LINK_BACKEND に応じたリンクの生成関数 (リンクワーカーへ渡せるよう pickle可能)。
+    com の場合は None を返し、fetcher が既定どおりCOMオブジェクトを生成する。
+    """
+    if LINK_BACKEND == "record":
+        session = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        return functools.partial(_create_recording_link, source_prefix, prog_id, session)
+    if LINK_BACKEND == "replay":
+        return functools.partial(_create_replay_link, source_prefix, LINK_REPLAY_SPEED)
+    return None
+
+def summarize(paths):
+    """記録の概要 (Open数・応答コード別の件数・レコード数・COM呼び出しの合計時間)"""
+    summary = {"opens": 0, "reads": 0, "records": 0, "com_ms": 0.0, "open_codes": {}}
+    for path in paths:
+        _, events = load_recording(path)
+        for event in events:
+            summary["com_ms"] += event.get("ms", 0)
+            if event["op"] == "open":
+                summary["opens"] += 1
+                code = str(event["res"])
+                summary["open_codes"][code] = summary["open_codes"].get(code, 0) + 1
+            elif event["op"] == "read":
+                summary["reads"] += 1
+                if event["code"] > 0:
+                    summary["records"] += len(event["data"].splitlines())
+    summary["com_ms"] = round(summary["com_ms"], 1)
+    return summary
+
+class _CountingUploader:
+    """再生時のアップロード先。ペイロードを作るだけで送信はしない"""
+    def __init__(self):
+        from gcs_uploader import build_payload
+        self.build = build_payload
+        self.objects = 0
+        self.bytes = 0
+
+    def build_payload(self, data_dict):
+        return self.build(data_dict)
+
+    def upload_jsons_parallel(self, tasks):
+        for _, payload in tasks:
+            self.objects += 1
+            self.bytes += len(payload.data) if hasattr(payload, "data") else 0
+        return [task[0] for task in tasks]
+
+def replay_full_sync(paths, speed, read_mode=None):
+    """記録を使って全体同期を1回実行し、受信〜解析〜ペイロード作成までの所要時間を計測する"""
+    from fetchers import JRAVanFetcher, UmaConnFetcher
+    from record_parser import JRAVanParser
+    from race_info_parser import RaceInfoParser
+    from processor import UploadCache, process_and_upload_stream
+
+    header, _ = load_recording(paths[0])
+    date_str = header.get("date") or datetime.datetime.now().strftime("%Y%m%d")
+    is_jra = not header.get("prog_id", "").startswith("NV")
+    fetcher_class = JRAVanFetcher if is_jra else UmaConnFetcher
+    source_name, source_prefix = ("JRA-VAN", "jra") if is_jra else ("UmaConn", "nar")
+    full_specs = ["0B12", "0B15", "0B11", "0B41", "0B42", "0B31", "0B32"]
+
+    fetcher = fetcher_class(read_mode=read_mode, link=ReplayLink(paths, speed, date_str))
+    fetcher.init_link()
+    uploader = _CountingUploader()
+    stop_event = threading.Event()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        upload_cache = UploadCache(os.path.join(tmp_dir, "replay_cache.db"), os.path.join(tmp_dir, "replay_cache.json"))
+        start = time.perf_counter()
+        if is_jra:
+            places = fetcher.get_today_places(date_str, stop_event)
+            chunks = fetcher.iter_rt_loop(full_specs, date_str, places, source_name, stop_event) if places else iter(())
+        else:
+            chunks = fetcher.iter_rt_loop_uma(full_specs, date_str, source_name, stop_event)
+        merged = process_and_upload_stream(chunks, full_specs, JRAVanParser(), RaceInfoParser(), uploader, source_prefix, upload_cache)
+        elapsed = time.perf_counter() - start
+        upload_cache.conn.close()
+    return {
+        "source": source_prefix, "date": date_str, "speed": speed, "sec": round(elapsed, 3),
+        "opens": fetcher.open_count, "reads": fetcher.read_count,
+        "races": len(merged), "objects": uploader.objects, "wire_bytes": uploader.bytes,
+    }
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="リンクの記録の概要表示・全体同期の再生")
+    arg_parser.add_argument("recordings", nargs="+", help="記録ファイル (*.jsonl.gz、同じセッションの複数ファイル可)")
+    arg_parser.add_argument("--speed", type=float, default=0, help="再生速度 (1=等速、N=N倍速、0=待ち時間なし)")
+    arg_parser.add_argument("--read-mode", default=None, choices=["str", "bytes"], help="受信モード (既定は FETCHER_READ_MODE)")
+    arg_parser.add_argument("--summary-only", action="store_true", help="概要のみ表示して再生しない")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    print(json.dumps(summarize(args.recordings), ensure_ascii=False))
+    if not args.summary_only:
+        print(json.dumps(replay_full_sync(args.recordings, args.speed, args.read_mode), ensure_ascii=False))
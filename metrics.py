@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Prometheus形式のテキストを返すローカルのポート (127.0.0.1 のみで待ち受け、0 で無効)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+# メトリクスファイル (metrics.jsonl) への書き出し間隔 (秒、0 で無効)
+METRICS_FILE_INTERVAL = int(os.environ.get("METRICS_FILE_INTERVAL", "60"))
+METRICS_FILE_MAX_BYTES = 10 * 1024 * 1024
+METRICS_FILE_BACKUPS = 5
+
+# レイテンシのヒストグラムの境界 (秒)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "keiba_"
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = ",".join(f'{k}="{v}"'.replace("\n", " ") for k, v in pairs)
+    return "{" + escaped + "}"
+
+class MetricsRegistry:
+    """
+    プロセス内のカウンター・ゲージ・ヒストグラム。
+    記録は辞書の更新だけで済ませ (1回あたり数マイクロ秒)、集計・整形は取得時に行う。
+    add_collector で登録した関数は取得時に呼ばれ、キューの長さなどその時点の値をゲージとして返す。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> 値
+        self.gauges = {}      # (name, labels) -> 値
+        self.histograms = {}  # (name, labels) -> _Histogram
+        self.collectors = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """with ブロックの所要時間を name のヒストグラムに記録する"""
+        return _Timer(self, name, labels)
+
+    def add_collector(self, func):
+        """func() -> [(name, {labels}, 値), ...] を取得時に呼び、ゲージとして出力する"""
+        with self.lock:
+            self.collectors.append(func)
+
+    def _collected_gauges(self):
+        gauges = {}
+        with self.lock:
+            gauges.update(self.gauges)
+            collectors = list(self.collectors)
+        for func in collectors:
+            try:
+                for name, labels, value in func():
+                    gauges[(name, _label_key(labels))] = value
+            except Exception as e:
+                logger.warning(f"メトリクスの収集に失敗しました: {e}")
+        return gauges
+
+    def render(self):
+        """Prometheus のテキスト形式 (version 0.0.4)"""
+        gauges = self._collected_gauges()
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (h.bounds, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+
+        lines = []
+        for kind, table in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in table}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+                for (metric, labels), value in sorted(table.items()):
+                    if metric == name:
+                        lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+            for (metric, labels), (bounds, counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(bounds) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """メトリクスファイル用の辞書。ヒストグラムは件数・合計と境界毎の件数"""
+        gauges = self._collected_gauges()
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (h.bounds, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+
+        def series_name(name, labels):
+            return name + _format_labels(labels)
+
+        return {
+            "counters": {series_name(*key): value for key, value in sorted(counters.items())},
+            "gauges": {series_name(*key): value for key, value in sorted(gauges.items())},
+            "histograms": {
+                series_name(*key): {"count": count, "sum": round(total, 6), "buckets": dict(zip([str(b) for b in bounds] + ["+Inf"], counts))}
+                for key, (bounds, counts, total, count) in sorted(histograms.items())
+            },
+        }
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "started")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+METRICS = MetricsRegistry()
+
+# ==========================================
+# 計測ポイント用のヘルパー
+# ==========================================
+def observe_link_open(link, spec, key, code, seconds):
+    """JVRTOpen/NVRTOpen の所要時間と応答 (データ有り/該当なし/エラー)"""
+    key_kind = "date" if len(key) == 8 else "race"
+    result = "ok" if code >= 0 else ("nodata" if code == -1 else "error")
+    METRICS.observe("link_open_seconds", seconds, link=link, spec=spec, key_kind=key_kind)
+    METRICS.inc("link_open_total", link=link, spec=spec, result=result)
+
+def observe_link_read(link, spec, code, size, seconds):
+    """JVRead/JVGets 1回の所要時間と受信バイト数"""
+    METRICS.observe("link_read_seconds", seconds, link=link, spec=spec)
+    if code > 0:
+        METRICS.inc("link_read_bytes_total", size, link=link, spec=spec)
+
+def observe_parse(source, parse_times):
+    """parse_into_merged の、レコード種別毎の {種別: (秒, 件数)}"""
+    for record_type, (seconds, count) in parse_times.items():
+        METRICS.inc("parse_seconds_total", seconds, source=source, record_type=record_type)
+        METRICS.inc("parse_records_total", count, source=source, record_type=record_type)
+
+# ==========================================
+# 出力 (HTTPエンドポイント / メトリクスファイル)
+# ==========================================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsExporter:
+    """
+    METRICS を http://127.0.0.1:{port}/metrics で公開し、interval 秒毎に metrics.jsonl (サイズでローテーション) へ追記する。
+    """
+    def __init__(self, base_dir, port=METRICS_PORT, interval=METRICS_FILE_INTERVAL, filename="metrics.jsonl"):
+        self.port = port
+        self.interval = interval
+        self.path = os.path.join(base_dir, filename)
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        if self.port:
+            try:
+                self.server = ThreadingHTTPServer(("127.0.0.1", self.port), _MetricsHandler)
+                self.server.daemon_threads = True
+                t = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+                t.start()
+                self.threads.append(t)
+                logger.info(f"メトリクス公開: http://127.0.0.1:{self.port}/metrics")
+            except OSError as e:
+                logger.warning(f"メトリクスのポート {self.port} を開けませんでした (ファイル出力のみ継続します): {e}")
+                self.server = None
+        if self.interval:
+            t = threading.Thread(target=self._file_loop, name="metrics-file", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def _file_loop(self):
+        file_logger = logging.getLogger("keiba.metrics_file")
+        file_logger.propagate = False
+        file_logger.setLevel(logging.INFO)
+        handler = RotatingFileHandler(self.path, maxBytes=METRICS_FILE_MAX_BYTES, backupCount=METRICS_FILE_BACKUPS, encoding="utf-8")
+        file_logger.addHandler(handler)
+        try:
+            while not self.stop_event.wait(self.interval):
+                self.write_snapshot(file_logger)
+            self.write_snapshot(file_logger)
+        finally:
+            file_logger.removeHandler(handler)
+            handler.close()
+
+    def write_snapshot(self, file_logger):
+        try:
+            entry = {"at": time.strftime("%Y-%m-%dT%H:%M:%S"), **METRICS.snapshot()}
+            file_logger.info(json.dumps(entry, ensure_ascii=False))
+        except Exception as e:
+            logger.warning(f"メトリクスファイルの書き出しに失敗しました: {e}")
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        for t in self.threads:
+            t.join(timeout=timeout)
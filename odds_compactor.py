@@ -0,0 +1,378 @@
+import os
+import io
+import sys
+import gzip
+import json
+import logging
+import argparse
+import datetime
+import threading
+import concurrent.futures
+from record_parser import MAX_HORSES, BRACKET_COMBOS
+from odds_delta import DeltaResolver
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ROOT = "odds_history"
+COMPACTED_ROOT = "odds_compacted"
+STATE_FILENAME = "_compaction_state.json"
+FORMAT_EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+# 組番を持つ券種: JSONのキー → 列名の接頭辞
+COMBO_COLUMNS = {
+    "quinella_odds": "quinella",
+    "wide_odds": "wide",
+    "exacta_odds": "exacta",
+    "trio_odds": "trio",
+    "trifecta_odds": "trifecta",
+}
+
+# ==========================================
+# ストレージ (ローカルディレクトリ / GCS)
+# ==========================================
+class LocalStore:
+    """GCSと同じblob名の階層をローカルディレクトリ上に再現したストレージ (検証用)"""
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def list(self, prefix):
+        base = self._path(prefix.rstrip("/"))
+        names = []
+        for root, _, files in os.walk(base):
+            for file_name in files:
+                rel = os.path.relpath(os.path.join(root, file_name), self.root)
+                names.append(rel.replace(os.sep, "/"))
+        return sorted(names)
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def read(self, name):
+        with open(self._path(name), "rb") as f:
+            return f.read()
+
+    def write(self, name, data, content_type="application/octet-stream"):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+class GCSStore:
+    """
+    GCSバケット。環境変数 STORAGE_EMULATOR_HOST を設定すればエミュレーターに接続する。
+    """
+    def __init__(self, bucket_name):
+        from google.cloud import storage
+        self.client = storage.Client()
+        self.bucket = self.client.bucket(bucket_name)
+
+    def list(self, prefix):
+        return sorted(blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix))
+
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    def read(self, name):
+        return self.bucket.blob(name).download_as_bytes()
+
+    def write(self, name, data, content_type="application/octet-stream"):
+        self.bucket.blob(name).upload_from_string(data, content_type=content_type)
+
+def _maybe_gunzip(data):
+    # Content-Encoding: gzip で保存されたオブジェクトはローカルでは圧縮されたまま読まれる
+    if data[:2] == b"\x1f\x8b":
+        return gzip.decompress(data)
+    return data
+
+# ==========================================
+# スナップショットの列挙と読み込み
+# ==========================================
+def list_snapshots(store, source_prefix, date_str):
+    """
+    1日分のオッズスナップショットを列挙する。
+    戻り値: {race_id: {happyo_time: 読み込み元}}
+      読み込み元は blob名、またはNDJSONバンドルの場合 (パート名, オフセット, 長さ)
+    """
+    prefix = f"{SNAPSHOT_ROOT}/{source_prefix}/{date_str}/"
+    snapshots = {}
+
+    def add(blob_name, locator):
+        parts = blob_name[len(prefix):].split("/")
+        if len(parts) != 2 or not parts[1].endswith(".json"):
+            return
+        race_id, happyo_time = parts[0], parts[1][:-len(".json")]
+        # "latest" は時系列ではないため対象外
+        if happyo_time.isdigit():
+            snapshots.setdefault(race_id, {})[happyo_time] = locator
+
+    names = store.list(prefix)
+    for blob_name in names:
+        add(blob_name, blob_name)
+
+    # GCS_BUNDLE_MODE=ndjson で書き込まれた分はマニフェスト (パート毎の manifests/*.json、旧形式は日毎の manifest.json) から辿る
+    # 送信箱経由ではマニフェストがパートより先に届くことがあるため、まだ存在しないパートの分は読み飛ばす
+    existing = set(names)
+    manifest_names = [name for name in names if name.startswith(prefix + "manifests/")]
+    if prefix + "manifest.json" in existing:
+        manifest_names.insert(0, prefix + "manifest.json")
+    for manifest_name in manifest_names:
+        try:
+            manifest = json.loads(_maybe_gunzip(store.read(manifest_name)))
+            for blob_name, (part_name, offset, length) in manifest.get("entries", {}).items():
+                if part_name in existing:
+                    add(blob_name, (part_name, offset, length))
+        except Exception as e:
+            logger.warning(f"バンドルマニフェストの読み込みに失敗しました ({manifest_name}): {e}")
+    return snapshots
+
+class SnapshotReader:
+    """スナップショットを読み込む。NDJSONパートファイルは一度だけ取得して使い回す"""
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.parts = {}
+
+    def _part(self, part_name):
+        with self.lock:
+            data = self.parts.get(part_name)
+        if data is None:
+            data = self.store.read(part_name)
+            with self.lock:
+                self.parts[part_name] = data
+        return data
+
+    def read(self, locator):
+        if isinstance(locator, str):
+            return json.loads(_maybe_gunzip(self.store.read(locator)))
+        part_name, offset, length = locator
+        return json.loads(gzip.decompress(self._part(part_name)[offset:offset + length]))
+
+# ==========================================
+# スナップショット → 列
+# ==========================================
+def _odds10(value):
+    return int(round(value * 10))
+
+def _kumi_to_int(combo):
+    """"1-9" / "010203" などの組番を整数化する (例: "1-9" -> 109)"""
+    if "-" in combo:
+        return int("".join(f"{int(n):02d}" for n in combo.split("-")))
+    return int(combo)
+
+def snapshot_to_row(snapshot):
+    """
+    1スナップショット (1発表時刻分) を1行分の列の辞書に変換する。
+    単勝/複勝は馬番順、枠連は組番順の固定長配列 (発売なしは0)、
+    馬連〜3連単は発売のある組番だけを kumi/odds10/ninki の配列で持つ。オッズは10倍値の整数。
+    """
+    row = {"happyo_time": snapshot.get("happyo_time"), "fetched_at": snapshot.get("fetched_at")}
+    records = snapshot.get("records", {})
+
+    for o1 in records.get("O1", [])[-1:]:
+        win_odds10 = [0] * MAX_HORSES
+        win_ninki = [0] * MAX_HORSES
+        for umaban, value in o1.get("win_odds", {}).items():
+            if 1 <= int(umaban) <= MAX_HORSES:
+                win_odds10[int(umaban) - 1] = _odds10(value["odds"])
+                win_ninki[int(umaban) - 1] = value["ninki"]
+        show_min10 = [0] * MAX_HORSES
+        show_max10 = [0] * MAX_HORSES
+        show_ninki = [0] * MAX_HORSES
+        for umaban, value in o1.get("show_odds", {}).items():
+            if 1 <= int(umaban) <= MAX_HORSES:
+                show_min10[int(umaban) - 1] = _odds10(value["odds_min"])
+                show_max10[int(umaban) - 1] = _odds10(value["odds_max"])
+                show_ninki[int(umaban) - 1] = value["ninki"]
+        bracket = o1.get("bracket_odds", {})
+        row.update({
+            "win_odds10": win_odds10, "win_ninki": win_ninki,
+            "show_min10": show_min10, "show_max10": show_max10, "show_ninki": show_ninki,
+            "bracket_odds10": [_odds10(bracket[c]["odds"]) if c in bracket else 0 for c in BRACKET_COMBOS],
+            "bracket_ninki": [bracket[c]["ninki"] if c in bracket else 0 for c in BRACKET_COMBOS],
+        })
+
+    for record_list in records.values():
+        for record in record_list:
+            for key, name in COMBO_COLUMNS.items():
+                value = record.get(key)
+                if value is None:
+                    continue
+                if "kumi" in value:
+                    # ComboOdds.to_dict の列形式
+                    row[f"{name}_kumi"] = value["kumi"]
+                    row[f"{name}_odds10"] = value["odds10"]
+                    if "odds_max10" in value:
+                        row[f"{name}_odds_max10"] = value["odds_max10"]
+                    row[f"{name}_ninki"] = value["ninki"]
+                else:
+                    # QuinellaOdds.to_dict の {"u1-u2": {"odds", "ninki"}} 形式
+                    row[f"{name}_kumi"] = [_kumi_to_int(c) for c in value]
+                    row[f"{name}_odds10"] = [_odds10(v["odds"]) for v in value.values()]
+                    row[f"{name}_ninki"] = [v["ninki"] for v in value.values()]
+    return row
+
+def build_schema():
+    """全レース共通の列定義"""
+    int32_list = pa.list_(pa.int32())
+    int16_list = pa.list_(pa.int16())
+    fields = [
+        pa.field("happyo_time", pa.string()),
+        pa.field("fetched_at", pa.string()),
+        pa.field("win_odds10", int32_list), pa.field("win_ninki", int16_list),
+        pa.field("show_min10", int32_list), pa.field("show_max10", int32_list), pa.field("show_ninki", int16_list),
+        pa.field("bracket_odds10", int32_list), pa.field("bracket_ninki", int16_list),
+    ]
+    for name in COMBO_COLUMNS.values():
+        fields.append(pa.field(f"{name}_kumi", int32_list))
+        fields.append(pa.field(f"{name}_odds10", int32_list))
+        if name == "wide":
+            fields.append(pa.field(f"{name}_odds_max10", int32_list))
+        fields.append(pa.field(f"{name}_ninki", int16_list))
+    return pa.schema(fields)
+
+def rows_to_table(rows, schema):
+    return pa.table({field.name: pa.array([row.get(field.name) for row in rows], type=field.type) for field in schema}, schema=schema)
+
+def _serialize_table(table, fmt):
+    sink = io.BytesIO()
+    if fmt == "arrow":
+        with pa_ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink, compression="zstd")
+    return sink.getvalue()
+
+def _deserialize_table(data, fmt):
+    if fmt == "arrow":
+        return pa_ipc.open_file(pa.BufferReader(data)).read_all()
+    return pq.read_table(pa.BufferReader(data))
+
+# ==========================================
+# 圧縮処理本体
+# ==========================================
+class OddsCompactor:
+    """
+    1日分のオッズスナップショット (odds_history/{source}/{date}/{race_id}/{happyo_time}.json) を、
+    レース毎に1つの列指向ファイル (odds_compacted/{source}/{date}/{race_id}.parquet) へまとめる。
+    発表時刻が行、券種毎のオッズが列となる。処理済みの発表時刻は状態ファイルに記録し、
+    再実行時は新しいスナップショットのあるレースだけを読み直して追記する。
+    """
+    def __init__(self, store, fmt="parquet", max_workers=8):
+        if pa is None:
+            raise RuntimeError("pyarrow がインストールされていません (pip install pyarrow)")
+        if fmt not in FORMAT_EXTENSIONS:
+            raise ValueError(f"未対応の出力形式です: {fmt}")
+        self.store = store
+        self.fmt = fmt
+        self.max_workers = max_workers
+        self.schema = build_schema()
+
+    def _output_prefix(self, source_prefix, date_str):
+        return f"{COMPACTED_ROOT}/{source_prefix}/{date_str}"
+
+    def _load_state(self, state_name):
+        if not self.store.exists(state_name):
+            return {}
+        try:
+            return json.loads(self.store.read(state_name)).get("races", {})
+        except Exception as e:
+            logger.warning(f"圧縮状態ファイルの読み込みに失敗しました。全件処理します: {e}")
+            return {}
+
+    def _compact_race(self, reader, output_name, snapshots, done_times):
+        """1レース分: 新しい発表時刻だけを読み込み、既存ファイルに追記して書き出す。戻り値: 処理済みの発表時刻"""
+        done = set(done_times)
+        new_times = sorted(t for t in snapshots if t not in done)
+        # 差分形式 (GCS_ODDS_ENCODING=delta) のスナップショットは基準の発表時刻から全量に復元する
+        resolver = DeltaResolver(lambda happyo_time: reader.read(snapshots[happyo_time]))
+        rows = [snapshot_to_row(resolver.resolve(t)) for t in new_times]
+        table = rows_to_table(rows, self.schema)
+
+        if done_times and self.store.exists(output_name):
+            existing = _deserialize_table(self.store.read(output_name), self.fmt)
+            table = pa.concat_tables([existing.cast(self.schema), table])
+            table = table.sort_by("happyo_time")
+
+        self.store.write(output_name, _serialize_table(table, self.fmt))
+        return sorted(done | set(new_times))
+
+    def compact_day(self, source_prefix, date_str):
+        """
+        指定日のスナップショットを圧縮する。
+        戻り値: {"races": 対象レース数, "updated": 更新したレース数, "snapshots": 新規に取り込んだスナップショット数}
+        """
+        output_prefix = self._output_prefix(source_prefix, date_str)
+        state_name = f"{output_prefix}/{STATE_FILENAME}"
+        state = self._load_state(state_name)
+        snapshots = list_snapshots(self.store, source_prefix, date_str)
+        reader = SnapshotReader(self.store)
+
+        targets = {
+            race_id: times for race_id, times in snapshots.items()
+            if any(t not in set(state.get(race_id, [])) for t in times)
+        }
+        result = {"races": len(snapshots), "updated": 0, "snapshots": 0}
+        if not targets:
+            logger.info(f"[{source_prefix}] {date_str}: 新しいスナップショットはありません ({len(snapshots)}レース)")
+            return result
+
+        ext = FORMAT_EXTENSIONS[self.fmt]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_race = {
+                executor.submit(
+                    self._compact_race, reader, f"{output_prefix}/{race_id}.{ext}", times, state.get(race_id, [])
+                ): race_id
+                for race_id, times in targets.items()
+            }
+            for future in concurrent.futures.as_completed(future_to_race):
+                race_id = future_to_race[future]
+                try:
+                    done_times = future.result()
+                except Exception as e:
+                    logger.error(f"[{source_prefix}] {race_id} の圧縮に失敗しました: {e}")
+                    continue
+                result["snapshots"] += len(done_times) - len(state.get(race_id, []))
+                result["updated"] += 1
+                state[race_id] = done_times
+
+        # 全レースの書き出し後に状態を保存する (途中で失敗したレースは次回再処理される)
+        self.store.write(state_name, json.dumps({"date": date_str, "format": self.fmt, "races": state}).encode("utf-8"),
+                         content_type="application/json")
+        logger.info(
+            f"[{source_prefix}] {date_str}: {result['updated']}/{result['races']}レースを更新 "
+            f"(新規スナップショット {result['snapshots']}件)"
+        )
+        return result
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    arg_parser = argparse.ArgumentParser(description="1日分のオッズスナップショットをレース毎の列指向ファイルにまとめる")
+    target = arg_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--local", help="GCSと同じ階層を持つローカルディレクトリ")
+    target.add_argument("--bucket", help="GCSバケット名 (STORAGE_EMULATOR_HOST でエミュレーターも可)")
+    arg_parser.add_argument("--date", default=datetime.datetime.now().strftime("%Y%m%d"), help="対象日 (YYYYMMDD、既定は本日)")
+    arg_parser.add_argument("--source", nargs="+", default=["jra", "nar"], help="対象ソース (jra / nar)")
+    arg_parser.add_argument("--format", default="parquet", choices=sorted(FORMAT_EXTENSIONS), help="出力形式")
+    arg_parser.add_argument("--workers", type=int, default=8, help="並列に処理するレース数")
+    args = arg_parser.parse_args()
+
+    if pa is None:
+        print("pyarrow がインストールされていません (pip install pyarrow)")
+        sys.exit(1)
+
+    store = LocalStore(args.local) if args.local else GCSStore(args.bucket)
+    compactor = OddsCompactor(store, fmt=args.format, max_workers=args.workers)
+    for source_prefix in args.source:
+        compactor.compact_day(source_prefix, args.date)
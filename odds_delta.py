@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import logging
+import threading
+from record_parser import COMBO_ODDS_LAYOUTS
+
+logger = logging.getLogger(__name__)
+
+# 環境変数 GCS_ODDS_ENCODING=delta で、発表時刻毎のオッズを前回との差分としてアップロードする
+ODDS_ENCODING = os.environ.get("GCS_ODDS_ENCODING", "full")
+# 差分が続いた場合に全量 (キーフレーム) を挟む間隔
+DEFAULT_KEYFRAME_INTERVAL = int(os.environ.get("GCS_ODDS_KEYFRAME_INTERVAL", "12"))
+# 変更された組番がこの割合を超える場合は差分にせず全量を送る
+MAX_DELTA_RATIO = 0.5
+
+DELTA_RECORD_TYPES = ("O1", "O2", "O3", "O4", "O5", "O6")
+ODDS_SECTIONS = ("win_odds", "show_odds", "bracket_odds", "quinella_odds") + tuple(
+    layout["key"] for layout in COMBO_ODDS_LAYOUTS.values()
+)
+
+def _section_map(value):
+    """
+    オッズ欄を 組番(文字列) -> 値 の辞書に揃える。
+    ComboOdds の列形式 ({"kumi": [...], "odds10": [...], ...}) は 組番 -> [odds10, (odds_max10), ninki] に変換する。
+    """
+    if hasattr(value, "to_dict"):
+        value = value.to_dict()
+    if "kumi" in value:
+        names = [name for name in value if name != "kumi"]
+        return {str(kumi): list(values) for kumi, *values in zip(value["kumi"], *(value[name] for name in names))}
+    return {str(key): item for key, item in value.items()}
+
+def _split_record(record):
+    """レコードを (オッズ欄の辞書, それ以外の欄) に分ける"""
+    sections = {}
+    fields = {}
+    for name, value in record.items():
+        if name in ODDS_SECTIONS:
+            sections[name] = _section_map(value)
+        else:
+            fields[name] = value
+    return sections, fields
+
+def _diff_sections(prev_sections, sections):
+    """前回との差分を返す。変更が多く差分の方が大きくなりそうな場合、オッズ欄の構成が変わった場合は None"""
+    if set(prev_sections) != set(sections):
+        return None
+    changed = {}
+    removed = {}
+    total = 0
+    changes = 0
+    for name, current in sections.items():
+        previous = prev_sections.get(name, {})
+        section_changed = {key: value for key, value in current.items() if previous.get(key) != value}
+        section_removed = [key for key in previous if key not in current]
+        if section_changed:
+            changed[name] = section_changed
+        if section_removed:
+            removed[name] = section_removed
+        total += len(current)
+        changes += len(section_changed) + len(section_removed)
+    if changes > total * MAX_DELTA_RATIO:
+        return None
+
+    delta = {}
+    if changed:
+        delta["changed"] = changed
+    if removed:
+        delta["removed"] = removed
+    return delta
+
+def apply_delta(base_record, delta_record):
+    """
+    全量のレコード (JSON形式) に差分レコードを適用して、全量のレコードを新たに作成する。
+    base_record は変更しない。基準に無いオッズ欄への差分は復元できないため ValueError とする。
+    """
+    record = dict(delta_record.get("fields", {}))
+    changed = delta_record.get("changed", {})
+    removed = delta_record.get("removed", {})
+    missing = [name for name in list(changed) + list(removed) if name not in base_record]
+    if missing:
+        raise ValueError(f"差分の基準 ({delta_record.get('delta_base')}) に無いオッズ欄です: {missing}")
+
+    for name in ODDS_SECTIONS:
+        if name not in base_record:
+            continue
+        base_value = base_record[name]
+        section = _section_map(base_value)
+        section.update(changed.get(name, {}))
+        for key in removed.get(name, []):
+            section.pop(key, None)
+
+        if "kumi" in base_value:
+            # 列形式に戻す (組番の昇順)
+            names = [column for column in base_value if column != "kumi"]
+            keys = sorted(section, key=int)
+            columns = {"kumi": [int(key) for key in keys]}
+            for i, column in enumerate(names):
+                columns[column] = [section[key][i] for key in keys]
+            record[name] = columns
+        else:
+            record[name] = section
+    return record
+
+class OddsDeltaEncoder:
+    """
+    レース・レコード種別毎に直前の発表時刻のオッズを保持し、次の発表時刻のオッズを変更された組番だけの差分に置き換える。
+    keyframe_interval 回毎、および前回より古い発表時刻・変更の多い場合は全量 (キーフレーム) のまま送る。
+    差分レコードは {"delta_base": 基準の発表時刻, "fields": {...}, "changed": {...}, "removed": {...}} の形式で、
+    DeltaResolver で全量に復元できる。
+    差分の基準はアップロードを確認した発表時刻 (confirm) に限り、送信に失敗したもの (discard) を基準にした差分は作らない。
+    """
+    def __init__(self, keyframe_interval=None):
+        self.keyframe_interval = keyframe_interval or DEFAULT_KEYFRAME_INTERVAL
+        self.lock = threading.Lock()
+        self.date = None
+        self.state = {}    # (race_id, record_type) -> (happyo_time, sections, キーフレームからの差分数) (アップロード確認済み)
+        self.pending = {}  # (race_id, happyo_time) -> {record_type: (sections, キーフレームからの差分数)} (送信結果待ち)
+        self.keyframes = 0
+        self.deltas = 0
+
+    def encode(self, today_str, race_id, happyo_time, data_dict):
+        """バンドル (data_dict) のオッズレコードを差分に置き換えたバンドルを返す。data_dict は変更しない"""
+        records = data_dict.get("records", {})
+        encoded_records = {}
+        with self.lock:
+            if self.date != today_str:
+                self.date = today_str
+                self.state = {}
+                self.pending = {}
+
+            for record_type, record_list in records.items():
+                if record_type not in DELTA_RECORD_TYPES or len(record_list) != 1 or "raw_payload" in record_list[0]:
+                    encoded_records[record_type] = record_list
+                    continue
+
+                record = record_list[0]
+                sections, fields = _split_record(record)
+                key = (race_id, record_type)
+                prev = self.state.get(key)
+                newer = prev is None or prev[0] < happyo_time
+
+                encoded = record
+                since_keyframe = 0
+                if prev is not None and newer and prev[2] + 1 < self.keyframe_interval:
+                    delta = _diff_sections(prev[1], sections)
+                    if delta is not None:
+                        encoded = dict({"delta_base": prev[0], "fields": fields}, **delta)
+                        since_keyframe = prev[2] + 1
+
+                if encoded is record:
+                    self.keyframes += 1
+                else:
+                    self.deltas += 1
+                if newer:
+                    self.pending.setdefault((race_id, happyo_time), {})[record_type] = (sections, since_keyframe)
+                encoded_records[record_type] = [encoded]
+
+        return dict(data_dict, records=encoded_records)
+
+    def confirm(self, race_id, happyo_time):
+        """encode したスナップショットのアップロードを確認した。以降はこの発表時刻を差分の基準にする"""
+        with self.lock:
+            for record_type, (sections, since_keyframe) in self.pending.pop((race_id, happyo_time), {}).items():
+                key = (race_id, record_type)
+                prev = self.state.get(key)
+                if prev is None or prev[0] < happyo_time:
+                    self.state[key] = (happyo_time, sections, since_keyframe)
+
+    def discard(self, race_id, happyo_time):
+        """encode したスナップショットの送信に失敗した。基準は直前の確認済みの発表時刻のまま変えない"""
+        with self.lock:
+            self.pending.pop((race_id, happyo_time), None)
+
+    def stats(self):
+        with self.lock:
+            return {"keyframes": self.keyframes, "deltas": self.deltas, "tracked": len(self.state), "pending": len(self.pending)}
+
+class DeltaResolver:
+    """
+    差分形式で保存されたスナップショットを全量に復元する。
+    load(happyo_time) は同じレースのスナップショット (JSON形式の辞書) を返す関数。
+    復元結果はキャッシュするため、同じレースの発表時刻を順に復元する場合は各スナップショットを一度だけ読み込む。
+    """
+    def __init__(self, load):
+        self.load = load
+        self.cache = {}
+
+    def resolve(self, happyo_time):
+        snapshot = self.cache.get(happyo_time)
+        if snapshot is not None:
+            return snapshot
+
+        snapshot = self.load(happyo_time)
+        records = {}
+        for record_type, record_list in snapshot.get("records", {}).items():
+            if len(record_list) == 1 and "delta_base" in record_list[0]:
+                delta_record = record_list[0]
+                base = self.resolve(delta_record["delta_base"])
+                base_record = base["records"][record_type][0]
+                records[record_type] = [apply_delta(base_record, delta_record)]
+            else:
+                records[record_type] = record_list
+        snapshot = dict(snapshot, records=records)
+        self.cache[happyo_time] = snapshot
+        return snapshot
+
+if __name__ == "__main__":
+    # 使い方: python odds_delta.py <ローカルディレクトリ または gs://バケット> <source> <日付> <race_id> <happyo_time>
+    if len(sys.argv) != 6:
+        print("使い方: python odds_delta.py <ローカルディレクトリ | gs://バケット> <jra|nar> <YYYYMMDD> <race_id> <happyo_time>")
+        sys.exit(1)
+
+    from odds_compactor import LocalStore, GCSStore, SnapshotReader, list_snapshots
+    target, source_prefix, date_str, race_id, happyo_time = sys.argv[1:]
+    store = GCSStore(target[len("gs://"):]) if target.startswith("gs://") else LocalStore(target)
+    snapshots = list_snapshots(store, source_prefix, date_str).get(race_id, {})
+    if happyo_time not in snapshots:
+        print(f"スナップショットが見つかりません: {race_id} {happyo_time}")
+        sys.exit(1)
+
+    reader = SnapshotReader(store)
+    resolver = DeltaResolver(lambda t: reader.read(snapshots[t]))
+    print(json.dumps(resolver.resolve(happyo_time), ensure_ascii=False, indent=2))
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import collections
+import numpy as np
+
+# 解析結果メモの上限 (件数 / 推定メモリ量)。PARSE_MEMO_MAX_ENTRIES=0 で無効化
+DEFAULT_MAX_ENTRIES = int(os.environ.get("PARSE_MEMO_MAX_ENTRIES", "50000"))
+DEFAULT_MAX_MB = int(os.environ.get("PARSE_MEMO_MAX_MB", "256"))
+
+def estimate_size(obj):
+    """解析結果のおおよそのメモリ使用量 (バイト)。NumPy配列は nbytes で数える"""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + 112
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(estimate_size(v) for v in obj)
+    if hasattr(obj, "__slots__"):
+        return sys.getsizeof(obj) + sum(estimate_size(getattr(obj, name, None)) for name in obj.__slots__)
+    return sys.getsizeof(obj)
+
+class ParseMemo:
+    """
+    生レコードのハッシュ (record_fingerprint) をキーとした、解析結果のLRUメモ。
+    同じ内容のレコードは解析を省略し、前回の解析結果を共有する（共有されるため呼び出し側で変更しないこと）。
+    日付が変わると全件破棄する。
+    """
+    def __init__(self, max_entries=None, max_mb=None):
+        self.max_entries = DEFAULT_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = (DEFAULT_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> (value, size)
+        self.date = None
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def roll(self, today_str):
+        """日付が変わっていれば前日の解析結果を破棄する"""
+        with self.lock:
+            if self.date != today_str:
+                self.date = today_str
+                self.entries.clear()
+                self.total_bytes = 0
+
+    def lookup(self, key):
+        """戻り値: (見つかったか, 解析結果)。解析結果が None (解析不能) の場合もメモされている"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def store(self, key, value):
+        if not self.enabled:
+            return
+        size = estimate_size(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def report(self):
+        """前回の report 以降のヒット率と、現在の件数・推定メモリ量を返し、カウンタをリセットする"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "lookups": lookups,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "mb": self.total_bytes / (1024 * 1024),
+                "evictions": self.evictions,
+            }
+            self.hits = self.misses = self.evictions = 0
+            return stats
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import time
+from gcs_uploader import build_payload
+
+def load_bundles(paths):
+    """指定されたJSONファイル（またはディレクトリ配下の *.json）をバンドルとして読み込む"""
+    bundles = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                bundles.extend(load_bundles([os.path.join(root, name) for name in sorted(files) if name.endswith(".json")]))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                bundles.append(json.load(f))
+    return bundles
+
+def run_benchmark(bundles, repeat=3):
+    """
+    圧縮方式毎に、1サイクル分 (全バンドル) のシリアライズ＋圧縮に掛かるCPU時間と転送バイト数を計測する。
+    """
+    results = []
+    for compression, level in [("none", None), ("gzip", 1), ("gzip", 6), ("gzip", 9)]:
+        best_cpu = None
+        for _ in range(repeat):
+            cpu_start = time.process_time()
+            payloads = [build_payload(bundle, compression, level) for bundle in bundles]
+            cpu = time.process_time() - cpu_start
+            best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+        results.append({
+            "compression": compression if level is None else f"{compression}-{level}",
+            "bundles": len(bundles),
+            "json_bytes": sum(p.raw_size for p in payloads),
+            "wire_bytes": sum(len(p.data) for p in payloads),
+            "cpu_ms_per_cycle": round(best_cpu * 1000, 2),
+        })
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("使い方: python payload_benchmark.py <スナップショットJSONのファイル/ディレクトリ> ...")
+        sys.exit(1)
+
+    bundles = load_bundles(sys.argv[1:])
+    print(f"=== ペイロードベンチマーク ({len(bundles)}バンドル/サイクル) ===")
+    for result in run_benchmark(bundles):
+        ratio = result["wire_bytes"] / max(result["json_bytes"], 1)
+        print(
+            f"{result['compression']:>7}: JSON {result['json_bytes'] / 1024:9.1f}KB → 転送 {result['wire_bytes'] / 1024:9.1f}KB "
+            f"({ratio:.0%}) / CPU {result['cpu_ms_per_cycle']:8.2f}ms"
+        )
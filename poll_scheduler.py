@@ -0,0 +1,160 @@
+import logging
+import threading
+from race_key_index import race_key_from_race_id
+
+# 発走までの秒数 → 基本のポーリング間隔 (秒)。上から順に判定し、None は対象外
+POLL_INTERVALS = [
+    (900, None),   # 発走15分より前: 全体同期に任せる
+    (300, 60),     # 発走15分前〜5分前
+    (120, 30),     # 発走5分前〜2分前
+    (0, 15),       # 発走2分前〜発走
+    (-600, 90),    # 発走後10分まで: 結果確定待ちのため間隔を緩める
+]
+MIN_POLL_INTERVAL = 10
+MAX_POLL_INTERVAL = 120
+
+# 直近の単勝オッズの平均変化率がこの値以上なら間隔を半分に、変化が無ければ1.5倍にする
+VOLATILE_CHANGE_RATE = 0.05
+
+# 1回のピンポイント受信に使える最大秒数
+DEFAULT_FETCH_BUDGET = 45
+
+class RacePollScheduler:
+    """
+    レース毎に次回の受信予定時刻を持つ、ピンポイント受信のスケジューラー。
+    発走が近いほど、また直近の単勝オッズの変動が大きいほど間隔を詰め、発走後は間隔を緩める。
+    受信予定のレースは発走が近い順に返し、1サイクルの受信時間には上限 (fetch budget) を設ける。
+    """
+    def __init__(self, schedule_index, fetch_budget=DEFAULT_FETCH_BUDGET):
+        self.schedule_index = schedule_index
+        self.fetch_budget = fetch_budget
+        self.lock = threading.Lock()
+        self.date = None
+        self.next_due = {}    # rt_key -> 次回受信予定 (time.time())
+        self.last_win = {}    # rt_key -> (happyo_time, {馬番: 単勝オッズ})
+        self.change_rate = {} # rt_key -> 直近の単勝オッズの平均変化率
+
+    def _roll(self, today_str):
+        """日付が変わっていれば前日以前のレースの予定・オッズ履歴を破棄する（ロック取得済みで呼ぶこと）"""
+        if self.date != today_str:
+            self.date = today_str
+            for table in (self.next_due, self.last_win, self.change_rate):
+                for rt_key in [k for k in table if not k.startswith(today_str)]:
+                    del table[rt_key]
+
+    def _seconds_to_post(self, rt_key, now_dt):
+        hhmm = self.schedule_index.start_time(rt_key)
+        if hhmm is None:
+            return None
+        start_dt = now_dt.replace(hour=int(hhmm[:2]), minute=int(hhmm[2:]), second=0, microsecond=0)
+        return (start_dt - now_dt).total_seconds()
+
+    def interval_for(self, rt_key, now_dt):
+        """レースの現在のポーリング間隔 (秒)。対象外の場合は None"""
+        to_post = self._seconds_to_post(rt_key, now_dt)
+        if to_post is None:
+            return None
+        interval = None
+        for threshold, base_interval in POLL_INTERVALS:
+            if to_post > threshold:
+                interval = base_interval
+                break
+        if interval is None:
+            return None
+
+        with self.lock:
+            rate = self.change_rate.get(rt_key)
+        if rate is not None and to_post > 0:
+            if rate >= VOLATILE_CHANGE_RATE:
+                interval *= 0.5
+            elif rate == 0:
+                interval *= 1.5
+        return min(max(interval, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+    def due_races(self, now_dt):
+        """
+        受信予定時刻を過ぎたレースキーを優先順に返す。
+        発走前のレースを発走が近い順に、続けて発走後のレースを返す。ただし予定から間隔以上遅れているものは先頭に回す。
+        """
+        now_ts = now_dt.timestamp()
+        with self.lock:
+            self._roll(now_dt.strftime("%Y%m%d"))
+        due = []
+        for rt_key in self.schedule_index.window(now_dt, 600, 900):
+            interval = self.interval_for(rt_key, now_dt)
+            if interval is None:
+                continue
+            with self.lock:
+                next_due = self.next_due.get(rt_key)
+            if next_due is not None and next_due > now_ts:
+                continue
+            to_post = self._seconds_to_post(rt_key, now_dt)
+            starved = next_due is not None and now_ts - next_due > interval
+            due.append((not starved, to_post < 0, abs(to_post), rt_key))
+        due.sort()
+        return [rt_key for *_, rt_key in due]
+
+    def fetch_deadline(self, now_ts, limit_ts=None):
+        """今回の受信を打ち切る時刻。fetch budget と、次の全体同期など呼び出し側の期限の早い方"""
+        deadline = now_ts + self.fetch_budget
+        if limit_ts is not None:
+            deadline = min(deadline, limit_ts)
+        return deadline
+
+    def mark_polled(self, rt_keys, now_dt):
+        """受信したレースの次回予定時刻を設定する"""
+        now_ts = now_dt.timestamp()
+        with self.lock:
+            self._roll(now_dt.strftime("%Y%m%d"))
+        for rt_key in rt_keys:
+            interval = self.interval_for(rt_key, now_dt)
+            with self.lock:
+                if interval is None:
+                    self.next_due.pop(rt_key, None)
+                else:
+                    self.next_due[rt_key] = now_ts + interval
+
+    def observe(self, merged_data):
+        """受信したO1から、レース毎に前回の発表時刻からの単勝オッズの平均変化率を更新する"""
+        for r_id, time_dict in merged_data.items():
+            rt_key = race_key_from_race_id(r_id)
+            happyo_times = sorted(t for t, bundle in time_dict.items() if t.isdigit() and "O1" in bundle["records"])
+            if not rt_key or not happyo_times:
+                continue
+            happyo_time = happyo_times[-1]
+            win_odds = {
+                umaban: value["odds"]
+                for o1 in time_dict[happyo_time]["records"]["O1"]
+                for umaban, value in o1.get("win_odds", {}).items()
+            }
+            with self.lock:
+                previous = self.last_win.get(rt_key)
+                if previous is not None and previous[0] >= happyo_time:
+                    continue
+                self.last_win[rt_key] = (happyo_time, win_odds)
+                if previous is None:
+                    continue
+                changes = [
+                    abs(odds - previous[1][umaban]) / previous[1][umaban]
+                    for umaban, odds in win_odds.items() if previous[1].get(umaban)
+                ]
+                rate = sum(changes) / len(changes) if changes else 0.0
+                self.change_rate[rt_key] = rate
+            if rate >= VOLATILE_CHANGE_RATE:
+                logging.info(f"オッズ変動大: {rt_key} (単勝平均変化率 {rate:.1%})")
+
+    def seconds_until_next(self, now_dt, limit_sec):
+        """次に受信予定のレースまでの秒数 (limit_sec を上限とする)"""
+        now_ts = now_dt.timestamp()
+        wait = limit_sec
+        for rt_key in self.schedule_index.window(now_dt, 600, 900):
+            if self.interval_for(rt_key, now_dt) is None:
+                continue
+            with self.lock:
+                next_due = self.next_due.get(rt_key, now_ts)
+            wait = min(wait, max(next_due - now_ts, 0))
+        # 新たに発走15分前に入るレース
+        entering = self.schedule_index.seconds_until_start(now_dt, 900)
+        if entering is not None:
+            wait = min(wait, max(entering - 900, 0))
+        return wait
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import platform
+import tempfile
+import tracemalloc
+from synthetic_records import day_records
+from record_parser import JRAVanParser
+from race_info_parser import RaceInfoParser
+from processor import UploadCache, parse_into_merged, process_and_upload, extract_race_schedule
+
+# 1日分の受信量のプロファイル (開催場・レース数・頭数・オッズの発表時刻数)
+DAY_PROFILES = {
+    "weekday": {"places": (30,), "races_per_place": 10, "horse_count": 12, "snapshots": 1},   # 地方1場のみの平日
+    "weekend": {"places": (5, 6), "races_per_place": 12, "horse_count": 16, "snapshots": 2},  # 中央2場
+    "g1": {"places": (5, 6, 8), "races_per_place": 12, "horse_count": 18, "snapshots": 4},    # 中央3場・G1当日
+}
+
+RESULT_VERSION = 1
+
+class _NullUploader:
+    """ペイロードを作るだけで送信しないアップロード先"""
+    def __init__(self):
+        from gcs_uploader import build_payload
+        self.build = build_payload
+
+    def build_payload(self, data_dict):
+        return self.build(data_dict)
+
+    def upload_jsons_parallel(self, tasks):
+        return [task[0] for task in tasks]
+
+def measure(func, record_count, repeat, setup=None):
+    """
+    func(state) の実行時間 (repeat 回中の最短) と、別途1回実行した際の tracemalloc による割り当て量を返す。
+    setup を指定した場合は毎回 setup() の戻り値を state として渡す (計測対象外)。
+    """
+    best = None
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        func(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    state = setup() if setup else None
+    tracemalloc.start()
+    func(state)
+    retained, peak = tracemalloc.get_traced_memory()
+    allocations = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+    return {
+        "records": record_count,
+        "sec": round(best, 6),
+        "records_per_sec": round(record_count / best, 1) if best else None,
+        "peak_kb": round(peak / 1024, 1),
+        "retained_kb": round(retained / 1024, 1),
+        "live_blocks": allocations,
+    }
+
+def run_suite(profile, repeat=3, read_mode="str", only=None):
+    """プロファイル1日分の合成レコードで、解析〜アップロード準備までの各段階を計測する"""
+    date_str = datetime.datetime.now().strftime("%Y%m%d")
+    records = day_records(date_str, **DAY_PROFILES[profile])
+    if read_mode == "str":
+        records = [record.decode("shift_jis") for record in records]
+    by_type = {}
+    for record in records:
+        by_type.setdefault(record[:2] if read_mode == "str" else record[:2].decode("ascii"), []).append(record)
+
+    odds_parser = JRAVanParser()
+    info_parser = RaceInfoParser()
+    info_records = [r for t in ("RA", "SE", "WE", "WH") for r in by_type.get(t, [])]
+    combo_records = [r for t in ("O3", "O4", "O5", "O6") for r in by_type.get(t, [])]
+    timestamp = datetime.datetime.now().isoformat()
+    merged = {}
+    parse_into_merged(records, odds_parser, info_parser, "jra", merged, timestamp)
+    cache_keys = [f"odds_history/jra/{date_str}/{r_id}/{h_time}.json" for r_id, times in merged.items() for h_time in times]
+    caches = []
+
+    with tempfile.TemporaryDirectory(prefix="processing_benchmark_") as tmp_dir:
+        def fresh_cache():
+            path = os.path.join(tmp_dir, f"cache_{time.perf_counter_ns()}.db")
+            cache = UploadCache(path, os.path.join(tmp_dir, "legacy.json"))
+            caches.append(cache)
+            return cache
+
+        def cache_round_trip(cache):
+            for key in cache_keys:
+                cache.is_uploaded(key)
+            cache.mark_many(cache_keys)
+            for key in cache_keys:
+                cache.is_uploaded(key)
+
+        benchmarks = {
+            "odds_parser.o1_batch": (lambda _: [odds_parser.o1_batch_to_dicts(batch) for batch in odds_parser.parse_o1_batch(by_type["O1"]).values()], len(by_type["O1"]), None),
+            "odds_parser.o2": (lambda _: [odds_parser.parse_o2_record(r) for r in by_type["O2"]], len(by_type["O2"]), None),
+            "odds_parser.combo_o3_o6": (lambda _: [odds_parser.parse_combo_odds_record(r) for r in combo_records], len(combo_records), None),
+            "race_info_parser.parse_records": (lambda _: info_parser.parse_records(info_records, source="jra"), len(info_records), None),
+            "processor.parse_into_merged": (lambda _: parse_into_merged(records, odds_parser, info_parser, "jra", {}, timestamp), len(records), None),
+            "processor.process_and_upload": (lambda cache: process_and_upload(records, odds_parser, info_parser, _NullUploader(), "jra", cache), len(records), fresh_cache),
+            "processor.extract_race_schedule": (lambda _: extract_race_schedule(merged), len(records), None),
+            "processor.upload_cache": (cache_round_trip, len(cache_keys) * 2, fresh_cache),
+        }
+
+        results = {}
+        try:
+            for name, (func, record_count, setup) in benchmarks.items():
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                results[name] = measure(func, record_count, repeat, setup)
+                logging.info(f"{name}: {results[name]['records_per_sec']} records/sec")
+        finally:
+            # 一時ディレクトリを削除できるよう、計測で作ったキャッシュ (SQLite) を閉じる
+            for cache in caches:
+                cache.close()
+
+    return {
+        "version": RESULT_VERSION,
+        "profile": profile,
+        "read_mode": read_mode,
+        "records": len(records),
+        "raw_bytes": sum(len(r) for r in records),
+        "python": platform.python_version(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+def compare(result, baseline, threshold):
+    """ベースラインより records/sec が threshold (割合) 以上落ちた計測項目を返す"""
+    regressions = []
+    for name, current in result["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("records_per_sec") or not current.get("records_per_sec"):
+            continue
+        ratio = current["records_per_sec"] / base["records_per_sec"]
+        if ratio < 1 - threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="合成レコードによるパーサー・processor のマイクロベンチマーク")
+    arg_parser.add_argument("--profile", default="weekend", choices=sorted(DAY_PROFILES), help="1日分の受信量のプロファイル")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数 (最短時間を採用)")
+    arg_parser.add_argument("--read-mode", default="str", choices=["str", "bytes"], help="レコードを文字列/バイト列のどちらで渡すか")
+    arg_parser.add_argument("--only", nargs="+", help="計測項目名の一部で絞り込む")
+    arg_parser.add_argument("--output", help="結果JSONの保存先 (省略時は標準出力)")
+    arg_parser.add_argument("--compare", help="比較するベースラインの結果JSON")
+    arg_parser.add_argument("--threshold", type=float, default=0.2, help="性能低下とみなす records/sec の低下率")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+    result = run_suite(args.profile, args.repeat, args.read_mode, args.only)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for name, ratio in regressions:
+            print(f"性能低下: {name} (ベースライン比 {ratio:.0%})", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
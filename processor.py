@@ -3,7 +3,22 @@ import sys
 import json
 import hashlib
 import datetime
+import time
 import logging
+import queue
+import sqlite3
+import threading
+from record_parser import ascii_field, to_json_compatible
+from metrics import METRICS, observe_parse
+
+# ストリーミング処理で受信側と解析側の間に保持する最大チャンク数
+STREAM_QUEUE_SIZE = 16
+
+# バンドル指紋 (レコード毎の128bitハッシュの和) のマスク
+FINGERPRINT_MASK = (1 << 128) - 1
+
+# O1〜O6レコードのみを返すオッズ系データ種別 (0B3x: 速報オッズ, 0B4x: 時系列オッズ)
+ODDS_SPEC_PREFIXES = ("0B3", "0B4")
 
 def get_base_dir():
     if getattr(sys, 'frozen', False):
@@ -12,134 +27,530 @@ def get_base_dir():
         return os.path.dirname(os.path.abspath(__file__))
 
 class UploadCache:
-    def __init__(self, cache_filename="upload_cache.json"):
+    """
+    アップロード済みキャッシュキーの永続ストア (SQLite)。
+    キーはblob名に含まれる日付単位で保持し、過去日の分は自動的に削除する。
+    書き込みは mark_many でバッチ単位にコミットし、JRA/NARの両ワーカーから共有できるようロックで保護する。
+    """
+    def __init__(self, cache_filename="upload_cache.db", legacy_filename="upload_cache.json"):
         self.cache_file = os.path.join(get_base_dir(), cache_filename)
-        self.cache = self._load()
+        self.lock = threading.Lock()
+        self.current_day = None
+        self.conn = self._connect()
+        self._migrate_legacy(os.path.join(get_base_dir(), legacy_filename))
 
-    def _load(self):
-        if os.path.exists(self.cache_file):
+    def _open(self, path):
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS uploaded (cache_key TEXT PRIMARY KEY, day TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS uploaded_day ON uploaded (day)")
+        return conn
+
+    def _connect(self):
+        try:
+            return self._open(self.cache_file)
+        except sqlite3.DatabaseError as e:
+            # 破損したDBは退避して作り直す
+            logging.warning(f"キャッシュDBが破損しています。退避して新規作成します: {e}")
             try:
-                with open(self.cache_file, "r", encoding="utf-8") as f:
-                    return set(json.load(f))
-            except Exception as e:
-                logging.warning(f"キャッシュの読み込みに失敗しました。新規作成します: {e}")
-                pass
-        return set()
+                os.replace(self.cache_file, self.cache_file + ".corrupt")
+                return self._open(self.cache_file)
+            except Exception as e2:
+                logging.error(f"キャッシュDBの再作成に失敗しました。メモリ上で継続します: {e2}")
+        except Exception as e:
+            logging.error(f"キャッシュDBを開けませんでした。メモリ上で継続します: {e}")
+        return self._open(":memory:")
+
+    def _migrate_legacy(self, legacy_file):
+        """旧形式 (upload_cache.json) のキャッシュを取り込み、取り込み済みとしてリネームする"""
+        if not os.path.exists(legacy_file):
+            return
+        try:
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                legacy_keys = json.load(f)
+            self.mark_many(legacy_keys)
+            os.replace(legacy_file, legacy_file + ".migrated")
+            logging.info(f"旧キャッシュを取り込みました ({len(legacy_keys)}件)")
+        except Exception as e:
+            logging.warning(f"旧キャッシュの取り込みに失敗しました: {e}")
+
+    @staticmethod
+    def _day_of(cache_key: str) -> str:
+        """キャッシュキー (odds_history/{source}/{YYYYMMDD}/...) から日付を取り出す"""
+        parts = cache_key.split("/")
+        if len(parts) >= 3 and len(parts[2]) == 8 and parts[2].isdigit():
+            return parts[2]
+        return datetime.datetime.now().strftime("%Y%m%d")
 
-    def _save(self):
+    def _evict_past_days(self):
+        """日付が変わっていれば、過去日のキーを削除する（ロック取得済みで呼ぶこと）"""
+        today = datetime.datetime.now().strftime("%Y%m%d")
+        if self.current_day == today:
+            return
         try:
-            with open(self.cache_file, "w", encoding="utf-8") as f:
-                json.dump(list(self.cache), f)
+            deleted = self.conn.execute("DELETE FROM uploaded WHERE day < ?", (today,)).rowcount
+            if deleted > 0:
+                logging.info(f"過去日のアップロードキャッシュを削除しました ({deleted}件)")
+            self.current_day = today
         except Exception as e:
-            logging.error(f"Upload cache save error: {e}")
+            logging.error(f"Upload cache eviction error: {e}")
 
     def is_uploaded(self, cache_key: str) -> bool:
-        return cache_key in self.cache
+        with self.lock:
+            self._evict_past_days()
+            try:
+                row = self.conn.execute("SELECT 1 FROM uploaded WHERE cache_key = ?", (cache_key,)).fetchone()
+                return row is not None
+            except Exception as e:
+                logging.error(f"Upload cache read error: {e}")
+                return False
+
+    def mark_many(self, cache_keys):
+        """複数のキーを1トランザクションでまとめて記録する"""
+        with self.lock:
+            self._evict_past_days()
+            # 過去日のキーは保持しない
+            rows = [(key, day) for key in cache_keys for day in (self._day_of(key),) if day >= (self.current_day or "")]
+            if not rows:
+                return
+            try:
+                self.conn.execute("BEGIN")
+                self.conn.executemany("INSERT OR IGNORE INTO uploaded (cache_key, day) VALUES (?, ?)", rows)
+                self.conn.execute("COMMIT")
+            except Exception as e:
+                logging.error(f"Upload cache save error: {e}")
+                try: self.conn.execute("ROLLBACK")
+                except Exception: pass
 
     def mark_as_uploaded(self, cache_key: str):
-        self.cache.add(cache_key)
-        self._save()
+        self.mark_many([cache_key])
 
-def process_and_upload(raw_data, odds_parser, info_parser, uploader, source_prefix, upload_cache):
-    if not raw_data:
-        return {}
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def record_fingerprint(record) -> int:
+    """生レコードの内容ハッシュ (128bit整数)"""
+    if isinstance(record, str):
+        record = record.encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(record, digest_size=16).digest(), 'big')
+
+def bundle_fingerprint(data_dict) -> str:
+    """
+    指紋を持たないバンドルの内容ハッシュ。取得時刻 (fetched_at) を除いた辞書をキー順を揃えてシリアライズしてハッシュする
+    """
+    content = {key: value for key, value in data_dict.items() if key != "fetched_at"}
+    canonical = json.dumps(content, ensure_ascii=False, sort_keys=True, default=to_json_compatible)
+    return hashlib.md5(canonical.encode("utf-8")).hexdigest()
+
+def parse_into_merged(raw_data, odds_parser, info_parser, source_prefix, merged_data, timestamp, fingerprints=None, memo=None):
+    """
+    生レコード群を解析し、merged_data (race_id -> happyo_time -> バンドル) へ追記する。
+    fingerprints を渡した場合、バンドル毎の指紋を生レコードから逐次計算して加算する。
+    指紋はレコード順に依存しない和で計算し、fetched_at など取得時刻には影響されない。
+    memo (ParseMemo) を渡した場合、前回と同じ内容のレコードは解析せずにメモの結果を使う。
+    戻り値: 追記のあったバンドルの (race_id, happyo_time) の集合
+    """
+    touched = set()
+    use_memo = memo is not None and memo.enabled
+    if use_memo:
+        memo.roll(datetime.datetime.now().strftime("%Y%m%d"))
+
+    def merge_parsed(parsed, record_type, happyo_time):
+        r_id = parsed["race_id"]
+        r_type = parsed.get("record_type", record_type)
+
+        if r_id not in merged_data:
+            merged_data[r_id] = {}
+        
+        if happyo_time not in merged_data[r_id]:
+            merged_data[r_id][happyo_time] = {
+                "race_id": r_id,
+                "fetched_at": timestamp,
+                "happyo_time": happyo_time,
+                "source": source_prefix,
+                "records": {}
+            }
+
+        if r_type not in merged_data[r_id][happyo_time]["records"]:
+            merged_data[r_id][happyo_time]["records"][r_type] = []
+
+        merged_data[r_id][happyo_time]["records"][r_type].append(parsed)
+        touched.add((r_id, happyo_time))
+
+    def raw_fallback(record_str, record_type):
+        r_id_raw = ascii_field(record_str[11:27])
+        if r_id_raw.isdigit():
+            if isinstance(record_str, bytes):
+                record_str = record_str.decode('shift_jis', errors='replace')
+            return {
+                "race_id": r_id_raw,
+                "record_type": record_type,
+                "raw_payload": record_str
+            }
+        return None
+
+    # O1およびRA/SE/WE/WHは同期サイクル分をまとめてバッチ解析する
+    # (メモにあるものは解析済みの結果を、無いものは後でまとめて解析した結果を入れる)
+    o1_entries = []    # [record_str, memo_key, (happyo_time, parsed) または None]
+    info_entries = []  # [record_str, memo_key, parsed, メモ済みか]
+    parse_times = {}   # レコード種別 -> [解析秒数, 解析件数] (メモのヒット分は含まない)
+
+    def add_parse_time(record_type, started, count=1):
+        entry = parse_times.setdefault(record_type, [0.0, 0])
+        entry[0] += time.perf_counter() - started
+        entry[1] += count
 
-    merged_data = {}
-    timestamp = datetime.datetime.now().isoformat()
-    today_str = datetime.datetime.now().strftime("%Y%m%d")
-    
     for record_str in raw_data:
         if len(record_str) < 35:
             continue
 
-        record_type = record_str[0:2].upper()
+        # JVGets/NVGets 受信時はShift-JISのバイト列のまま扱い、英数字欄だけを取り出す
+        record_type = ascii_field(record_str[0:2]).upper()
         
         if record_type in ["O1", "O2", "O3", "O4", "O5", "O6"]:
-            happyo_time = record_str[27:35]
+            happyo_time = ascii_field(record_str[27:35])
             if not happyo_time.isdigit():
                 happyo_time = "latest"
         else:
             happyo_time = "latest"
 
+        memo_key = None
+        if fingerprints is not None or use_memo:
+            fingerprint = record_fingerprint(record_str)
+            memo_key = (record_type, fingerprint)
+            if fingerprints is not None:
+                bundle_key = (ascii_field(record_str[11:27]), happyo_time)
+                fingerprints[bundle_key] = (fingerprints.get(bundle_key, 0) + fingerprint) & FINGERPRINT_MASK
+
+        found, cached = memo.lookup(memo_key) if use_memo else (False, None)
+
         parsed = None
         if record_type in ["RA", "SE", "WE", "WH"]:
-            parsed = info_parser.parse_record(record_str, source=source_prefix)
+            info_entries.append([record_str, memo_key, cached, found])
+            continue
         elif record_type in ["O1", "O2", "O3", "O4", "O5", "O6"]:
             if record_type == "O1":
-                parsed = odds_parser.parse_o1_record(record_str)
-            elif record_type == "O2":
-                parsed = odds_parser.parse_o2_record(record_str)
+                o1_entries.append([record_str, memo_key, cached if found else None])
+                continue
+            elif found:
+                parsed = cached
             else:
-                r_id_raw = record_str[11:27]
-                parsed = {"race_id": r_id_raw, "record_type": record_type, "raw_payload": record_str}
+                started = time.perf_counter()
+                if record_type == "O2":
+                    parsed = odds_parser.parse_o2_record(record_str)
+                else:
+                    parsed = odds_parser.parse_combo_odds_record(record_str)
+                add_parse_time(record_type, started)
+                if use_memo:
+                    memo.store(memo_key, parsed)
 
         if not parsed:
-            r_id_raw = record_str[11:27]
-            if r_id_raw.isdigit():
-                parsed = {
-                    "race_id": r_id_raw,
-                    "record_type": record_type,
-                    "raw_payload": record_str
-                }
+            parsed = raw_fallback(record_str, record_type)
 
         if parsed and "race_id" in parsed:
-            r_id = parsed["race_id"]
-            r_type = parsed.get("record_type", record_type)
+            merge_parsed(parsed, record_type, happyo_time)
 
-            if r_id not in merged_data:
-                merged_data[r_id] = {}
-            
-            if happyo_time not in merged_data[r_id]:
-                merged_data[r_id][happyo_time] = {
-                    "race_id": r_id,
-                    "fetched_at": timestamp,
-                    "happyo_time": happyo_time,
-                    "source": source_prefix,
-                    "records": {}
-                }
+    # 種別毎の解析時間を計るため、RA/SE/WE/WH は種別毎にまとめて解析する (レコード間の依存は無い)
+    info_missed_by_type = {}
+    for entry in info_entries:
+        if not entry[3]:
+            info_missed_by_type.setdefault(ascii_field(entry[0][0:2]).upper(), []).append(entry)
+    for record_type, info_missed in info_missed_by_type.items():
+        started = time.perf_counter()
+        parsed_list = info_parser.parse_records([entry[0] for entry in info_missed], source=source_prefix)
+        add_parse_time(record_type, started, len(info_missed))
+        for entry, parsed in zip(info_missed, parsed_list):
+            entry[2] = parsed
+            if use_memo:
+                memo.store(entry[1], parsed)
+
+    for record_str, _, parsed, _ in info_entries:
+        record_type = ascii_field(record_str[0:2]).upper()
+        if not parsed:
+            parsed = raw_fallback(record_str, record_type)
+        if parsed and "race_id" in parsed:
+            merge_parsed(parsed, record_type, "latest")
 
-            if r_type not in merged_data[r_id][happyo_time]["records"]:
-                merged_data[r_id][happyo_time]["records"][r_type] = []
+    o1_missed = [entry for entry in o1_entries if entry[2] is None]
+    if o1_missed:
+        # parse_o1_batch はレース毎に入力順で行をまとめるため、同じ並びで結果を対応付ける
+        missed_by_race = {}
+        for entry in o1_missed:
+            missed_by_race.setdefault(ascii_field(entry[0][11:27]), []).append(entry)
+        started = time.perf_counter()
+        for race_id, race_batch in odds_parser.parse_o1_batch([entry[0] for entry in o1_missed]).items():
+            for entry, result in zip(missed_by_race.get(race_id, []), odds_parser.o1_batch_to_dicts(race_batch)):
+                entry[2] = result
+                if use_memo:
+                    memo.store(entry[1], result)
+        add_parse_time("O1", started, len(o1_missed))
 
-            merged_data[r_id][happyo_time]["records"][r_type].append(parsed)
+    o1_by_race = {}
+    o1_unparsed = []
+    for entry in o1_entries:
+        if entry[2] is not None:
+            o1_by_race.setdefault(entry[2][1]["race_id"], []).append(entry[2])
+        else:
+            o1_unparsed.append(entry[0])
+    for results in o1_by_race.values():
+        for happyo_time, parsed in results:
+            merge_parsed(parsed, "O1", happyo_time if happyo_time.isdigit() else "latest")
 
+    # バッチ解析で読み飛ばされた行 (不正・短いレコード等) は、他の種別と同様に生データのまま残す
+    for record_str in o1_unparsed:
+        parsed = raw_fallback(record_str, "O1")
+        if parsed:
+            happyo_time = ascii_field(record_str[27:35])
+            merge_parsed(parsed, "O1", happyo_time if happyo_time.isdigit() else "latest")
+
+    observe_parse(source_prefix, parse_times)
+    return touched
+
+def upload_bundles(bundles, uploader, source_prefix, upload_cache, today_str, bundler=None, delta_encoder=None):
+    """
+    (race_id, happyo_time, data_dict, fingerprint) の並びを、キャッシュ判定の上でGCSへアップロードする。
+    "latest" はレコード内容の指紋で重複判定するため、内容が変わらないレースはシリアライズもしない。
+    bundler (CycleBundler) を指定した場合は、1件ずつではなくNDJSONパートファイルにまとめてアップロードする。
+    delta_encoder (OddsDeltaEncoder) を指定した場合は、発表時刻毎のオッズを前回からの差分としてアップロードする。
+    戻り値: (新規アップロード件数, 重複スキップ件数)
+    """
     upload_tasks = []
     skip_count = 0
+    raw_bytes = 0
+    wire_bytes = 0
+    cpu_start = time.thread_time()
+    # バックグラウンド送信 (UploadService) の場合は送信待ちのものも重複とみなす
+    is_pending = getattr(uploader, "is_pending", None)
+    delta_races = {}
+    if delta_encoder is not None:
+        # 差分は同じレースの直前の発表時刻を基準にするため、発表時刻順に処理する
+        bundles = sorted(bundles, key=lambda bundle: (bundle[0], bundle[1]))
     
-    for r_id, time_dict in merged_data.items():
-        for h_time, data_dict in time_dict.items():
-            blob_name = f"odds_history/{source_prefix}/{today_str}/{r_id}/{h_time}.json"
-            
-            if h_time != "latest":
-                cache_key = blob_name
-            else:
-                dict_str = json.dumps(data_dict, sort_keys=True)
-                content_hash = hashlib.md5(dict_str.encode('utf-8')).hexdigest()
-                cache_key = f"{blob_name}_{content_hash}"
+    for r_id, h_time, data_dict, fingerprint in bundles:
+        blob_name = f"odds_history/{source_prefix}/{today_str}/{r_id}/{h_time}.json"
+        
+        if h_time != "latest":
+            cache_key = blob_name
+        elif fingerprint is not None:
+            cache_key = f"{blob_name}_{fingerprint:032x}"
+        else:
+            # 指紋が無い場合は、取得時刻を除いた内容からハッシュを作る
+            cache_key = f"{blob_name}_{bundle_fingerprint(data_dict)}"
 
-            if upload_cache.is_uploaded(cache_key):
-                skip_count += 1
-                continue
+        if upload_cache.is_uploaded(cache_key) or (is_pending and is_pending(cache_key)):
+            skip_count += 1
+            continue
 
-            upload_tasks.append((blob_name, data_dict, cache_key))
+        if delta_encoder is not None and h_time != "latest":
+            data_dict = delta_encoder.encode(today_str, r_id, h_time, data_dict)
+            delta_races[blob_name] = (r_id, h_time)
+
+        # シリアライズ（と圧縮）はバンドル毎に一度だけ行い、そのままアップロードに使う
+        payload = uploader.build_payload(data_dict)
+        raw_bytes += payload.raw_size
+        wire_bytes += len(payload.data)
+        upload_tasks.append((blob_name, payload, cache_key))
 
-    upload_count = 0
     if upload_tasks:
+        cpu_ms = (time.thread_time() - cpu_start) * 1000
+        logging.info(
+            f"[{source_prefix}] ペイロード作成: {len(upload_tasks)}件 / JSON {raw_bytes / 1024:.1f}KB → "
+            f"転送 {wire_bytes / 1024:.1f}KB ({wire_bytes / max(raw_bytes, 1):.0%}) / CPU {cpu_ms:.1f}ms"
+        )
+
+    snapshot_count = len(upload_tasks)
+    if bundler is not None and upload_tasks:
+        upload_tasks = bundler.bundle(today_str, upload_tasks)
+
+    upload_count = 0
+    confirmed_blobs = set()
+    if upload_tasks and hasattr(uploader, "enqueue"):
+        # 送信箱へ投入して即座に戻る。キャッシュへの記録は送信成功時にサービス側で行う
+        upload_count = uploader.enqueue(upload_tasks)
+        if upload_count == len(upload_tasks):
+            # 送信箱に書き出したものは成功するまで再送されるため、差分の基準・マニフェストの参照先にしてよい
+            confirmed_blobs = set(delta_races)
+            if bundler is not None:
+                uploader.enqueue(bundler.manifest_tasks(today_str, [task[0] for task in upload_tasks]))
+        elif bundler is not None:
+            bundler.manifest_tasks(today_str, [])
+    elif upload_tasks:
         tasks_for_uploader = [(task[0], task[1]) for task in upload_tasks]
         successful_blobs = uploader.upload_jsons_parallel(tasks_for_uploader)
-        
-        upload_count = len(successful_blobs)
         success_set = set(successful_blobs)
+
+        if bundler is not None:
+            # マニフェストはパートのアップロード成功後に送り、両方揃ったパートだけを送信済みとする
+            # (マニフェストの送信に失敗したパートの中身は、次のサイクルで新しいパートとして送り直す)
+            manifest_tasks = bundler.manifest_tasks(today_str, [task[0] for task in upload_tasks if task[0] in success_set])
+            manifest_ok = set(uploader.upload_jsons_parallel([(task[0], task[1]) for task in manifest_tasks]))
+            success_set = {
+                part_name for part_name in success_set
+                if bundler.manifest_blob_name(today_str, part_name) in manifest_ok
+            }
+        upload_count = len(success_set)
         
+        success_keys = []
         for blob_name, _, cache_key in upload_tasks:
             if blob_name in success_set:
-                upload_cache.mark_as_uploaded(cache_key)
+                success_keys.extend(cache_key if isinstance(cache_key, list) else [cache_key])
+        upload_cache.mark_many(success_keys)
+
+        if bundler is not None:
+            confirmed_blobs = set(delta_races) if len(success_set) == len(upload_tasks) else set()
+        else:
+            confirmed_blobs = set(delta_races) & success_set
+
+    if delta_encoder is not None:
+        # アップロードを確認したスナップショットだけを以降の差分の基準にする
+        for blob_name, (r_id, h_time) in delta_races.items():
+            if blob_name in confirmed_blobs:
+                delta_encoder.confirm(r_id, h_time)
+            else:
+                delta_encoder.discard(r_id, h_time)
+
+    if bundler is not None and upload_count:
+        # パートファイル単位の件数ではなく、含まれるスナップショット件数を返す
+        upload_count = snapshot_count
+
+    return upload_count, skip_count
+
+def log_memo_stats(parse_memo, source_prefix):
+    """解析メモのヒット率とメモリ使用量をログに出す"""
+    if parse_memo is None or not parse_memo.enabled:
+        return
+    stats = parse_memo.report()
+    if stats["lookups"]:
+        logging.info(
+            f"[{source_prefix}] 解析メモ: ヒット率 {stats['hit_rate']:.0%} ({stats['hits']}/{stats['lookups']}件) / "
+            f"保持 {stats['entries']}件 約{stats['mb']:.1f}MB / 破棄 {stats['evictions']}件"
+        )
+
+def process_and_upload(raw_data, odds_parser, info_parser, uploader, source_prefix, upload_cache, bundler=None, delta_encoder=None, parse_memo=None, schedule_index=None):
+    if not raw_data:
+        return {}
+
+    merged_data = {}
+    timestamp = datetime.datetime.now().isoformat()
+    today_str = datetime.datetime.now().strftime("%Y%m%d")
+
+    fingerprints = {}
+    with METRICS.timer("stage_seconds", source=source_prefix, stage="parse"):
+        touched = parse_into_merged(raw_data, odds_parser, info_parser, source_prefix, merged_data, timestamp, fingerprints, parse_memo)
+    log_memo_stats(parse_memo, source_prefix)
+    if schedule_index is not None:
+        with METRICS.timer("stage_seconds", source=source_prefix, stage="schedule"):
+            schedule_index.add_from_bundles(merged_data, touched, today_str)
+
+    bundles = [
+        (r_id, h_time, data_dict, fingerprints.get((r_id, h_time)))
+        for r_id, time_dict in merged_data.items()
+        for h_time, data_dict in time_dict.items()
+    ]
+    with METRICS.timer("stage_seconds", source=source_prefix, stage="upload"):
+        upload_count, skip_count = upload_bundles(bundles, uploader, source_prefix, upload_cache, today_str, bundler, delta_encoder)
             
     if upload_count > 0 or skip_count > 0:
         logging.info(f"[{source_prefix}] GCS保存状況: 新規 {upload_count}件 / 重複スキップ {skip_count}件")
     
     return merged_data
 
+def is_odds_spec(spec: str) -> bool:
+    """オッズ系 (O1〜O6レコードのみを返す) データ種別かどうか"""
+    return spec.startswith(ODDS_SPEC_PREFIXES)
+
+def process_and_upload_stream(chunks, specs, odds_parser, info_parser, uploader, source_prefix, upload_cache, max_pending_chunks=STREAM_QUEUE_SIZE, bundler=None, delta_encoder=None, parse_memo=None, schedule_index=None, profiler=None):
+    """
+    process_and_upload のストリーミング版。
+    フェッチャーの iter_* が返す (spec, key, lines) を有界キュー経由で別スレッドに渡し、
+    COM受信と並行して解析・アップロードを行う。呼び出し元スレッドは受信（COM呼び出し）のみを担当する。
+    "latest" バンドルは、残りの受信予定がオッズ系データ種別だけになった時点で先行してアップロードする。
+    schedule_index (RaceScheduleIndex) を指定した場合は、RAレコードの受信毎に発走時刻の索引を更新する。
+    profiler (CycleProfiler) を指定した場合は、プロファイル取得中であれば処理スレッドも計測する。
+    """
+    chunk_queue = queue.Queue(maxsize=max_pending_chunks)
+    merged_data = {}
+    pending = set()
+    fingerprints = {}
+    counts = {"upload": 0, "skip": 0, "drained": False}
+    timestamp = datetime.datetime.now().isoformat()
+    today_str = datetime.datetime.now().strftime("%Y%m%d")
+
+    def flush(latest_only):
+        keys = [k for k in pending if k[1] == "latest" or not latest_only]
+        if not keys:
+            return
+        bundles = [(r_id, h_time, merged_data[r_id][h_time], fingerprints.get((r_id, h_time))) for r_id, h_time in keys]
+        with METRICS.timer("stage_seconds", source=source_prefix, stage="upload"):
+            upload_count, skip_count = upload_bundles(bundles, uploader, source_prefix, upload_cache, today_str, bundler, delta_encoder)
+        counts["upload"] += upload_count
+        counts["skip"] += skip_count
+        pending.difference_update(keys)
+
+    def consume():
+        current_spec = None
+        failed = False
+        while True:
+            item = chunk_queue.get()
+            if item is None:
+                counts["drained"] = True
+                break
+            if failed:
+                continue  # 受信側を止めないよう、エラー後もキューは読み捨てる
+            spec, _, lines = item
+            try:
+                if spec != current_spec:
+                    current_spec = spec
+                    # 以降の受信で更新され得ない "latest" バンドルを確定させて先行アップロード
+                    remaining = specs[specs.index(spec):] if spec in specs else specs
+                    if all(is_odds_spec(s) for s in remaining):
+                        flush(latest_only=True)
+                with METRICS.timer("stage_seconds", source=source_prefix, stage="parse"):
+                    touched = parse_into_merged(lines, odds_parser, info_parser, source_prefix, merged_data, timestamp, fingerprints, parse_memo)
+                pending.update(touched)
+                if schedule_index is not None:
+                    with METRICS.timer("stage_seconds", source=source_prefix, stage="schedule"):
+                        schedule_index.add_from_bundles(merged_data, touched, today_str)
+            except Exception as e:
+                logging.error(f"[{source_prefix}] ストリーミング処理エラー: {e}", exc_info=True)
+                failed = True
+        if not failed:
+            try:
+                flush(latest_only=False)
+            except Exception as e:
+                logging.error(f"[{source_prefix}] ストリーミング処理エラー: {e}", exc_info=True)
+
+    def run_consumer():
+        try:
+            if profiler is None:
+                consume()
+            else:
+                with profiler.thread_profile(source_prefix):
+                    consume()
+        finally:
+            # consume が途中で抜けた場合も、受信側が put で止まらないよう終端までキューを読み捨てる
+            while not counts["drained"]:
+                counts["drained"] = chunk_queue.get() is None
+
+    consumer = threading.Thread(target=run_consumer, name=f"{source_prefix}-pipeline", daemon=True)
+    consumer.start()
+    try:
+        for chunk in chunks:
+            chunk_queue.put(chunk)
+            METRICS.set_gauge("stream_queue_depth", chunk_queue.qsize(), source=source_prefix)
+    finally:
+        chunk_queue.put(None)
+        consumer.join()
+        METRICS.set_gauge("stream_queue_depth", 0, source=source_prefix)
+
+    if counts["upload"] > 0 or counts["skip"] > 0:
+        logging.info(f"[{source_prefix}] GCS保存状況: 新規 {counts['upload']}件 / 重複スキップ {counts['skip']}件")
+    log_memo_stats(parse_memo, source_prefix)
+
+    return merged_data
+
 def extract_race_schedule(merged_data: dict) -> dict:
     """パースされたデータから各レースの「専用キー(YYYYMMDDJJRR)」と「発走時刻」を抽出し辞書化する"""
     schedule = {}
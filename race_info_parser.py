@@ -1,7 +1,162 @@
+import struct
 import logging
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# 馬体重 (WH) レコードの馬毎ブロック (開始位置, ストライド, 最大頭数) とブロック内レイアウト
+WH_HORSE_BLOCK = (35, 45, 18)
+WH_HORSE_LAYOUT = {
+    "umaban": (0, 2, "int"),
+    "horse_name": (2, 38, "str"),
+    "weight": (38, 41, "int"),
+    "weight_sign": (41, 42, "str"),
+    "weight_diff": (42, 45, "str"),
+}
+
+FULLWIDTH_SPACE_SJIS = "　".encode("shift_jis")
+
+
+def _is_blank(raw: bytes) -> bool:
+    """半角/全角スペースのみ（または空）の欄かどうかをデコードせずに判定する"""
+    return not raw.replace(FULLWIDTH_SPACE_SJIS, b"").strip()
+
+
+def _convert_field(raw: bytes, data_type: str):
+    """切り出したバイト列を型変換する。空欄は欠損値(None)として扱う"""
+    if _is_blank(raw):
+        return None
+
+    if data_type in ("int", "float"):
+        # 数値欄はデコードせずバイト列から直接変換する
+        try:
+            return int(raw) if data_type == "int" else float(raw)
+        except ValueError:
+            raw_val = raw.decode('shift_jis', errors='replace').strip()
+            logger.debug(f"型変換エラー: '{raw_val}' を {data_type} に変換できませんでした。文字列として保持します。")
+            return raw_val
+
+    return raw.decode('shift_jis', errors='replace').strip()
+
+
+def _decode_int_column(column):
+    """
+    (件数, 桁数) のバイト配列の整数欄を一括で変換する。
+    前後の空白のみを許し、数字が連続している欄だけを有効 (valid=True) とする (int() と同じ結果になる欄)。
+    """
+    digits = column.astype(np.int16) - 48
+    is_digit = (digits >= 0) & (digits <= 9)
+    width = column.shape[1]
+    first = np.argmax(is_digit, axis=1)
+    last = width - 1 - np.argmax(is_digit[:, ::-1], axis=1)
+    valid = (
+        np.all(is_digit | (column == 32), axis=1)
+        & np.any(is_digit, axis=1)
+        & (is_digit.sum(axis=1) == last - first + 1)
+    )
+
+    values = np.zeros(column.shape[0], dtype=np.int64)
+    for k in range(width):
+        values = np.where(is_digit[:, k], values * 10 + digits[:, k], values)
+    return values, valid
+
+
+class ExtractionPlan:
+    """
+    レコード種別毎のレイアウトを事前コンパイルした切り出し表。
+    全フィールドを struct で一度に切り出し、レイアウト定義順の辞書項目として返す。
+    """
+    def __init__(self, layout: dict):
+        fields = sorted(
+            (start, end, name, dtype) for name, (start, end, dtype) in layout.items()
+            if start is not None and end is not None
+        )
+
+        fmt, pos = ["<"], 0
+        for start, end, name, _ in fields:
+            if start < pos:
+                raise ValueError(f"レイアウトのフィールドが重複しています: {name}")
+            if start > pos:
+                fmt.append(f"{start - pos}x")
+            fmt.append(f"{end - start}s")
+            pos = end
+
+        self.struct = struct.Struct("".join(fmt))
+        self.length = pos
+        self.slices = [(start, end) for start, end, _, _ in fields]
+        self.converters = [(name, dtype) for _, _, name, dtype in fields]
+
+        # 出力する辞書のキー順はレイアウト定義順に揃える
+        position = {name: i for i, (_, _, name, _) in enumerate(fields)}
+        self.output_order = [position[name] for name in layout if name in position]
+
+    def extract(self, record_bytes: bytes) -> dict:
+        if len(record_bytes) >= self.length:
+            raw_values = self.struct.unpack_from(record_bytes)
+        else:
+            # レコード長が足りない場合、範囲外のフィールドは欠損値とする
+            raw_values = [
+                record_bytes[start:end] if len(record_bytes) >= end else None
+                for start, end in self.slices
+            ]
+
+        extracted = {}
+        for i in self.output_order:
+            raw = raw_values[i]
+            if raw is None:
+                continue
+            name, dtype = self.converters[i]
+            val = _convert_field(raw, dtype)
+            if val is not None:
+                extracted[name] = val
+        return extracted
+
+    def extract_many(self, records: list) -> list:
+        """
+        extract のバッチ版。整数欄はレコードを跨いで NumPy で一括変換し、
+        それ以外の欄 (および一括変換できない欄) は extract と同じ規則で1件ずつ変換する。
+        """
+        results = [None] * len(records)
+        full_rows = []
+        for i, record_bytes in enumerate(records):
+            if len(record_bytes) >= self.length:
+                full_rows.append(i)
+            else:
+                results[i] = self.extract(record_bytes)
+        if not full_rows:
+            return results
+
+        raw_rows = [self.struct.unpack_from(records[i]) for i in full_rows]
+        columns = []
+        for j, (name, dtype) in enumerate(self.converters):
+            if dtype == "float":
+                columns.append([_convert_field(raw[j], dtype) for raw in raw_rows])
+                continue
+            if dtype != "int":
+                # 文字列欄はデコード後に空白を除き、空になった欄だけ _convert_field と同じ空欄判定をする
+                texts = [raw[j].decode('shift_jis', errors='replace').strip() for raw in raw_rows]
+                columns.append([
+                    text if text else _convert_field(raw[j], dtype)
+                    for text, raw in zip(texts, raw_rows)
+                ])
+                continue
+            width = self.slices[j][1] - self.slices[j][0]
+            matrix = np.frombuffer(b"".join(raw[j] for raw in raw_rows), dtype=np.uint8).reshape(len(raw_rows), width)
+            values, valid = _decode_int_column(matrix)
+            columns.append([
+                value if ok else _convert_field(raw[j], dtype)
+                for value, ok, raw in zip(values.tolist(), valid.tolist(), raw_rows)
+            ])
+
+        for k, i in enumerate(full_rows):
+            extracted = {}
+            for j in self.output_order:
+                val = columns[j][k]
+                if val is not None:
+                    extracted[self.converters[j][0]] = val
+            results[i] = extracted
+        return results
+
 class RaceInfoParser:
     """
     JRA-VAN / UmaConn の生データをパースし、構造化された辞書に変換するクラス。
@@ -48,35 +203,17 @@ class RaceInfoParser:
             "NAR": self.JRA_LAYOUT
         }
 
-    def _extract_value(self, record_bytes: bytes, start: int, end: int, data_type: str):
-        """バイト配列から指定範囲を切り出し、Shift-JISデコードと型変換を行う"""
-        if start is None or end is None or len(record_bytes) < end:
-            return None
-        
-        try:
-            # Shift-JISでデコードし、前後の空白を除去
-            raw_val = record_bytes[start:end].decode('shift_jis', errors='replace').strip()
-        except Exception:
-            return None
-
-        # 全角スペースや完全な空白のみの場合は欠損値(None)として扱う
-        if not raw_val or raw_val.isspace() or raw_val.replace('　', '').strip() == '':
-            return None
-            
-        try:
-            if data_type == "int":
-                return int(raw_val)
-            elif data_type == "float":
-                return float(raw_val)
-            else:
-                return raw_val
-        except ValueError:
-            logger.debug(f"型変換エラー: '{raw_val}' を {data_type} に変換できませんでした。文字列として保持します。")
-            return raw_val 
+        # レイアウトは初期化時に一度だけ切り出し表へコンパイルする
+        self._plans = {
+            source_key: {record_type: ExtractionPlan(layout) for record_type, layout in config.items()}
+            for source_key, config in self.BYTE_LAYOUT_CONFIG.items()
+        }
+        self._wh_race_id_plan = ExtractionPlan({"race_id": (11, 27, "str")})
+        self._wh_horse_plan = ExtractionPlan(WH_HORSE_LAYOUT)
 
     def _parse_wh_record(self, record_bytes: bytes, source_key: str) -> dict:
         """馬体重 (WH) レコードの特殊パース処理（バイトベース対応版）"""
-        race_id = self._extract_value(record_bytes, 11, 27, "str")
+        race_id = self._wh_race_id_plan.extract(record_bytes).get("race_id")
         if not race_id:
             return None
             
@@ -87,67 +224,97 @@ class RaceInfoParser:
             "horse_weights": []
         }
         
-        base_offset = 35 
-        stride = 45      
-        max_horses = 18
+        base_offset, stride, max_horses = WH_HORSE_BLOCK
         
         for i in range(max_horses):
             offset = base_offset + (i * stride)
             if len(record_bytes) < offset + stride:
                 break
                 
-            horse_data_bytes = record_bytes[offset:offset+stride]
-            
-            umaban = self._extract_value(horse_data_bytes, 0, 2, "int") 
+            values = self._wh_horse_plan.extract(record_bytes[offset:offset+stride])
+            umaban = values.get("umaban")
             if not umaban:
                 continue 
                 
             weight_data = {
                 "umaban": umaban,
-                "horse_name": self._extract_value(horse_data_bytes, 2, 38, "str"),    
-                "weight": self._extract_value(horse_data_bytes, 38, 41, "int"),       
-                "weight_sign": self._extract_value(horse_data_bytes, 41, 42, "str"),  
-                "weight_diff": self._extract_value(horse_data_bytes, 42, 45, "str"),  
+                "horse_name": values.get("horse_name"),    
+                "weight": values.get("weight"),       
+                "weight_sign": values.get("weight_sign"),  
+                "weight_diff": values.get("weight_diff"),  
             }
             parsed_data["horse_weights"].append(weight_data)
             
         return parsed_data
 
-    def parse_record(self, record_str: str, source: str = "JRA") -> dict:
+    @staticmethod
+    def _prepare(record_str):
+        """(レコード種別, Shift-JISのバイト列) を返す。対象外のレコードは (None, None)"""
         if not record_str or len(record_str) < 27:
-            return None
+            return None, None
             
-        record_type = record_str[0:2].upper()
+        record_type = record_str[0:2]
+        if isinstance(record_type, bytes):
+            record_type = record_type.decode('ascii', errors='replace')
+        record_type = record_type.upper()
         if record_type not in ["RA", "SE", "WE", "WH"]:
-            return None
+            return None, None
 
-        source_key = "JRA" if source.lower() == "jra" else "NAR"
-        
         # Pythonの文字列を一度Shift-JISのバイト配列に変換する（文字数とバイト数のズレを防止）
-        try:
-            record_bytes = record_str.encode('shift_jis', errors='replace')
-        except Exception as e:
-            logger.error(f"エンコードエラー: {e}")
+        if isinstance(record_str, str):
+            try:
+                return record_type, record_str.encode('shift_jis', errors='replace')
+            except Exception as e:
+                logger.error(f"エンコードエラー: {e}")
+                return None, None
+        return record_type, bytes(record_str)
+
+    def parse_record(self, record_str, source: str = "JRA") -> dict:
+        record_type, record_bytes = self._prepare(record_str)
+        if record_type is None:
             return None
+
+        source_key = "JRA" if source.lower() == "jra" else "NAR"
         
         if record_type == "WH":
             return self._parse_wh_record(record_bytes, source_key)
         
-        source_config = self.BYTE_LAYOUT_CONFIG.get(source_key, {})
-        layout = source_config.get(record_type, {})
+        plan = self._plans.get(source_key, {}).get(record_type)
         
         parsed_data = {
             "record_type": record_type,
             "source": source_key,
         }
-
-        for field_name, (start, end, dtype) in layout.items():
-            if start is not None and end is not None:
-                val = self._extract_value(record_bytes, start, end, dtype)
-                if val is not None:
-                    parsed_data[field_name] = val
+        if plan is not None:
+            parsed_data.update(plan.extract(record_bytes))
 
         if "race_id" not in parsed_data:
             return None
 
-        return parsed_data
\ No newline at end of file
+        return parsed_data
+
+    def parse_records(self, records, source: str = "JRA") -> list:
+        """
+        RA/SE/WE/WH レコード群を一括で解析する（バッチ版）
+        RA/SE/WE はレコード種別毎にまとめ、整数欄をレコードを跨いで一括変換する (結果は parse_record と同じ)。
+        戻り値: 入力と同じ並びの解析結果リスト（解析できないレコードは None）
+        """
+        source_key = "JRA" if source.lower() == "jra" else "NAR"
+        results = [None] * len(records)
+        groups = {}  # レコード種別 -> ([入力位置], [バイト列])
+        for i, record_str in enumerate(records):
+            record_type, record_bytes = self._prepare(record_str)
+            if record_type == "WH":
+                results[i] = self._parse_wh_record(record_bytes, source_key)
+            elif record_type is not None:
+                positions, group = groups.setdefault(record_type, ([], []))
+                positions.append(i)
+                group.append(record_bytes)
+
+        for record_type, (positions, group) in groups.items():
+            plan = self._plans.get(source_key, {}).get(record_type)
+            extracted_list = plan.extract_many(group) if plan is not None else [{}] * len(group)
+            for i, extracted in zip(positions, extracted_list):
+                if "race_id" in extracted:
+                    results[i] = dict({"record_type": record_type, "source": source_key}, **extracted)
+        return results
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import logging
+import threading
+from processor import get_base_dir
+from record_parser import ascii_field
+
+# データ無し(<0)応答を再試行せずにスキップする秒数
+NEGATIVE_TTL = 1800
+
+def race_key_from_race_id(race_id: str):
+    """16桁のrace_id (YYYYMMDDJJKKNNRR) から、JVRTOpen用の12桁キー (YYYYMMDDJJRR) を生成する"""
+    if len(race_id) != 16:
+        return None
+    rt_key = race_id[0:8] + race_id[8:10] + race_id[14:16]
+    return rt_key if rt_key.isdigit() else None
+
+class RaceKeyIndex:
+    """
+    本日のレースキー (YYYYMMDDJJRR) の索引と、データ無し応答の負キャッシュ。
+    RAレコードから索引を作り、データ種別・同期サイクルを跨いで共有する。
+    索引は日付単位でファイルに永続化し、日付が変わると破棄する。
+    """
+    def __init__(self, cache_filename=None, negative_ttl=NEGATIVE_TTL):
+        self.cache_file = os.path.join(get_base_dir(), cache_filename) if cache_filename else None
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.date = None
+        self.keys = set()
+        self.negative = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.date = saved.get("date")
+            self.keys = set(saved.get("keys", []))
+        except Exception as e:
+            logging.warning(f"レースキー索引の読み込みに失敗しました。新規作成します: {e}")
+
+    def save(self):
+        with self.lock:
+            if not self.cache_file or not self._dirty:
+                return
+            snapshot = {"date": self.date, "keys": sorted(self.keys)}
+            self._dirty = False
+        try:
+            tmp_file = self.cache_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logging.error(f"Race key index save error: {e}")
+
+    def _roll(self, today_str):
+        """日付が変わっていれば前日の索引と負キャッシュを破棄する"""
+        if self.date != today_str:
+            self.date = today_str
+            self.keys = set()
+            self.negative = {}
+            self._dirty = True
+
+    def add_from_records(self, lines, today_str):
+        """受信したレコード群のうちRAレコードからレースキーを索引に追加する。戻り値: 新規追加数"""
+        added = 0
+        with self.lock:
+            self._roll(today_str)
+            for line in lines:
+                if len(line) >= 27 and ascii_field(line[0:2]) == "RA":
+                    rt_key = race_key_from_race_id(ascii_field(line[11:27]))
+                    if rt_key and rt_key.startswith(today_str) and rt_key not in self.keys:
+                        self.keys.add(rt_key)
+                        added += 1
+            if added:
+                self._dirty = True
+        return added
+
+    def keys_for(self, today_str):
+        """本日分の既知レースキーを昇順で返す"""
+        with self.lock:
+            self._roll(today_str)
+            return sorted(self.keys)
+
+    def is_negative(self, spec, key):
+        with self.lock:
+            expires = self.negative.get((spec, key))
+            if expires is None:
+                return False
+            if expires <= time.time():
+                del self.negative[(spec, key)]
+                return False
+            return True
+
+    def mark_negative(self, spec, key):
+        with self.lock:
+            self.negative[(spec, key)] = time.time() + self.negative_ttl
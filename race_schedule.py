@@ -0,0 +1,137 @@
+import os
+import json
+import bisect
+import logging
+import threading
+from processor import get_base_dir
+from race_key_index import race_key_from_race_id
+
+def _hhmm_to_seconds(hhmm):
+    return int(hhmm[:2]) * 3600 + int(hhmm[2:]) * 60
+
+class RaceScheduleIndex:
+    """
+    本日の発走時刻の索引。受信したRAレコードの解析結果から逐次更新し、発走時刻順に保持する。
+    「発走15分前〜発走後10分」のような時間帯の検索は二分探索で行う。
+    索引は日付単位でファイルに永続化し、再起動直後から本日のスケジュールを利用できる。
+    """
+    def __init__(self, cache_filename=None):
+        self.cache_file = os.path.join(get_base_dir(), cache_filename) if cache_filename else None
+        self.lock = threading.Lock()
+        self.date = None
+        self.start_times = {}  # rt_key (YYYYMMDDJJRR) -> 発走時刻 "HHMM"
+        self.ordered = []      # (発走時刻の秒, rt_key) の昇順リスト
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.date = saved.get("date")
+            for rt_key, hhmm in saved.get("start_times", {}).items():
+                self._set(rt_key, hhmm)
+        except Exception as e:
+            logging.warning(f"発走時刻索引の読み込みに失敗しました。新規作成します: {e}")
+
+    def save(self):
+        with self.lock:
+            if not self.cache_file or not self._dirty:
+                return
+            snapshot = {"date": self.date, "start_times": dict(self.start_times)}
+            self._dirty = False
+        try:
+            tmp_file = self.cache_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logging.error(f"Race schedule index save error: {e}")
+
+    def _roll(self, today_str):
+        """日付が変わっていれば前日の索引を破棄する"""
+        if self.date != today_str:
+            self.date = today_str
+            self.start_times = {}
+            self.ordered = []
+            self._dirty = True
+
+    def _set(self, rt_key, hhmm):
+        """発走時刻を登録・変更する（lock 取得済みで呼ぶこと）。戻り値: 変更前の発走時刻"""
+        old = self.start_times.get(rt_key)
+        if old == hhmm:
+            return old
+        if old is not None:
+            entry = (_hhmm_to_seconds(old), rt_key)
+            i = bisect.bisect_left(self.ordered, entry)
+            if i < len(self.ordered) and self.ordered[i] == entry:
+                del self.ordered[i]
+        self.start_times[rt_key] = hhmm
+        bisect.insort(self.ordered, (_hhmm_to_seconds(hhmm), rt_key))
+        return old
+
+    def update(self, race_id, hhmm, today_str):
+        """1レース分の発走時刻を反映する。戻り値: 新規または変更があったかどうか"""
+        rt_key = race_key_from_race_id(race_id)
+        if not rt_key or not rt_key.startswith(today_str):
+            return False
+        if not (isinstance(hhmm, str) and len(hhmm) == 4 and hhmm.isdigit()
+                and int(hhmm[:2]) < 24 and int(hhmm[2:]) < 60):
+            return False
+        with self.lock:
+            self._roll(today_str)
+            old = self._set(rt_key, hhmm)
+            if old == hhmm:
+                return False
+            self._dirty = True
+        if old is not None:
+            logging.info(f"発走時刻変更: {rt_key} {old} → {hhmm}")
+        return True
+
+    def add_from_bundles(self, merged_data, keys, today_str):
+        """
+        解析済みバンドルのうち keys ((race_id, happyo_time) の集合) に含まれる "latest" のRAレコードから発走時刻を反映する。
+        戻り値: 新規または変更のあったレース数
+        """
+        updated = 0
+        for r_id, h_time in keys:
+            if h_time != "latest":
+                continue
+            ra_records = merged_data.get(r_id, {}).get("latest", {}).get("records", {}).get("RA")
+            if ra_records and self.update(r_id, ra_records[-1].get("start_time_hhmm"), today_str):
+                updated += 1
+        return updated
+
+    def window(self, now_dt, before_sec, after_sec):
+        """
+        発走時刻が now_dt の before_sec 秒前〜after_sec 秒後の範囲にあるレースキーを発走時刻順に返す。
+        (発走 after_sec 秒前〜発走後 before_sec 秒のレース)
+        """
+        today_str = now_dt.strftime("%Y%m%d")
+        now_sec = now_dt.hour * 3600 + now_dt.minute * 60 + now_dt.second
+        with self.lock:
+            self._roll(today_str)
+            lo = bisect.bisect_left(self.ordered, (now_sec - before_sec,))
+            hi = bisect.bisect_left(self.ordered, (now_sec + after_sec + 1,))
+            return [rt_key for _, rt_key in self.ordered[lo:hi]]
+
+    def start_time(self, rt_key):
+        """レースの発走時刻 "HHMM" (未登録の場合は None)"""
+        with self.lock:
+            return self.start_times.get(rt_key)
+
+    def seconds_until_start(self, now_dt, after_sec=0):
+        """発走時刻が now_dt の after_sec 秒後より後の最初のレースについて、発走までの秒数を返す (無ければ None)"""
+        now_sec = now_dt.hour * 3600 + now_dt.minute * 60 + now_dt.second
+        with self.lock:
+            self._roll(now_dt.strftime("%Y%m%d"))
+            i = bisect.bisect_left(self.ordered, (now_sec + after_sec + 1,))
+            if i >= len(self.ordered):
+                return None
+            return self.ordered[i][0] - now_sec
+
+    def __len__(self):
+        with self.lock:
+            return len(self.start_times)
@@ -1,7 +1,138 @@
 import logging
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# O1レコードの固定長ブロック定義 (開始位置, ストライド, 件数)
+O1_WIN_BLOCK = (43, 8, 28)
+O1_SHOW_BLOCK = (267, 12, 28)
+O1_BRACKET_BLOCK = (603, 8, 36)
+O1_MIN_LENGTH = 603 + 8 * 36
+
+# 枠連の組番 (仕様書の並び順: 1-1, 1-2, ..., 8-8)
+BRACKET_COMBOS = [f"{w1}-{w2}" for w1 in range(1, 9) for w2 in range(w1, 9)]
+
+# O2レコードの固定長ブロック定義 (開始位置, ストライド, 件数)
+O2_QUINELLA_BLOCK = (40, 13, 153)
+O2_MIN_LENGTH = 40 + 13 * 153
+MAX_HORSES = 18
+
+# O3〜O6レコードのレイアウト (ブロック定義と、ブロック内の組番/オッズ/人気の位置)
+COMBO_ODDS_LAYOUTS = {
+    "O3": {"key": "wide_odds", "block": (40, 17, 153), "kumi": (0, 4), "odds": (4, 9), "odds_max": (9, 14), "ninki": (14, 17)},
+    "O4": {"key": "exacta_odds", "block": (40, 13, 306), "kumi": (0, 4), "odds": (4, 10), "ninki": (10, 13)},
+    "O5": {"key": "trio_odds", "block": (40, 15, 816), "kumi": (0, 6), "odds": (6, 12), "ninki": (12, 15)},
+    "O6": {"key": "trifecta_odds", "block": (40, 17, 4896), "kumi": (0, 6), "odds": (6, 13), "ninki": (13, 17)},
+}
+
+
+def ascii_field(value):
+    """レコードの英数字欄を文字列として取り出す（JVRead の str / JVGets の bytes 両対応）"""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("ascii", errors="replace")
+    return value
+
+
+def _to_record_matrix(records, min_length):
+    """
+    レコード群を1つのbytesバッファに連結し、(件数, レコード長) のuint8ビューとして返す。
+    文字列はShift-JISに変換し、短いレコードは空白で埋める。
+    """
+    buf = b"".join(
+        (r.encode("shift_jis", errors="replace") if isinstance(r, str) else bytes(r))[:min_length].ljust(min_length, b" ")
+        for r in records
+    )
+    return np.frombuffer(buf, dtype=np.uint8).reshape(len(records), min_length)
+
+
+def _decode_digits(fields):
+    """
+    (..., 桁数) のASCII数字配列を整数に一括変換する。
+    前後の空白は無視し、数字以外を含む欄・空欄は無効 (valid=False) として扱う。
+    """
+    digits = fields.astype(np.int16) - 48
+    is_digit = (digits >= 0) & (digits <= 9)
+    valid = np.all(is_digit | (fields == 32), axis=-1) & np.any(is_digit, axis=-1)
+
+    values = np.zeros(fields.shape[:-1], dtype=np.int64)
+    for k in range(fields.shape[-1]):
+        values = np.where(is_digit[..., k], values * 10 + digits[..., k], values)
+    return values, valid
+
+
+class QuinellaOdds:
+    """
+    馬連オッズの18×18上三角行列表現（オッズは10倍値の整数, 0 = 発売なし）。
+    "u1-u2" キーの辞書形式はシリアライズ時に to_dict() で初めて生成する。
+    """
+    __slots__ = ("odds", "ninki")
+
+    def __init__(self, odds, ninki):
+        self.odds = odds
+        self.ninki = ninki
+
+    def __len__(self):
+        return int(np.count_nonzero(self.odds))
+
+    def get(self, u1, u2):
+        """馬番の組 (u1, u2) のオッズ辞書を返す。発売なしの場合はNone"""
+        if u1 > u2:
+            u1, u2 = u2, u1
+        if not (1 <= u1 and u2 <= MAX_HORSES):
+            return None
+        odds = int(self.odds[u1 - 1, u2 - 1])
+        if odds <= 0:
+            return None
+        return {"odds": odds / 10.0, "ninki": int(self.ninki[u1 - 1, u2 - 1])}
+
+    def to_dict(self):
+        """従来の {"u1-u2": {"odds", "ninki"}} 形式に展開する"""
+        rows, cols = np.nonzero(self.odds)
+        odds = self.odds[rows, cols].tolist()
+        ninki = self.ninki[rows, cols].tolist()
+        return {
+            f"{r + 1}-{c + 1}": {"odds": o / 10.0, "ninki": n}
+            for r, c, o, n in zip(rows.tolist(), cols.tolist(), odds, ninki)
+        }
+
+
+class ComboOdds:
+    """
+    ワイド/馬単/3連複/3連単オッズの疎な列指向表現。発売なし・欠損の組番は保持しない。
+    kumi は組番をそのまま整数化した値 (例: "010203" -> 10203)、オッズは10倍値の整数。
+    """
+    __slots__ = ("kumi", "odds", "odds_max", "ninki")
+
+    def __init__(self, kumi, odds, ninki, odds_max=None):
+        self.kumi = kumi
+        self.odds = odds
+        self.odds_max = odds_max
+        self.ninki = ninki
+
+    def __len__(self):
+        return len(self.kumi)
+
+    def to_dict(self):
+        """列毎のリストとしてコンパクトに展開する"""
+        columns = {"kumi": self.kumi.tolist(), "odds10": self.odds.tolist()}
+        if self.odds_max is not None:
+            columns["odds_max10"] = self.odds_max.tolist()
+        columns["ninki"] = self.ninki.tolist()
+        return columns
+
+
+def to_json_compatible(obj):
+    """json.dumps の default 用。遅延展開するオッズ表現を変換する"""
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _block_view(matrix, block):
+    """固定長の繰り返しブロックを (件数, 繰り返し数, ストライド) のビューとして切り出す"""
+    base, stride, count = block
+    return matrix[:, base:base + stride * count].reshape(matrix.shape[0], count, stride)
+
 class JRAVanParser:
     """
     JRA-VAN の固定長レコードを解析し、辞書形式に変換するクラス。
@@ -76,30 +207,178 @@ class JRAVanParser:
         """
         O2レコード（馬連オッズ）の解析
         ダンプデータから確定したインデックス（オフセット40, ストライド13）
+        153組をNumPyで一括デコードし、QuinellaOdds (18×18上三角行列) として保持する
         """
         try:
-            if record_str[0:2] != "O2": return None
-            race_id = record_str[11:27]
-            
-            base_offset = 40  # 修正：正確なオフセット位置
-            stride = 13
-            max_combos = 153
-            
-            quinella_odds = {}
-            for i in range(max_combos):
-                start = base_offset + (i * stride)
-                data = record_str[start:start+stride]
-                if len(data) < 13: break
-                
-                u1_str, u2_str, odds_str, ninki_str = data[0:2].strip(), data[2:4].strip(), data[4:10].strip(), data[10:13].strip()
-                
-                if u1_str and u2_str and odds_str and odds_str.isdigit() and int(odds_str) > 0:
-                    quinella_odds[f"{int(u1_str)}-{int(u2_str)}"] = {
-                        "odds": int(odds_str) / 10.0,
-                        "ninki": int(ninki_str) if ninki_str.isdigit() else 999
-                    }
-                    
-            return {"race_id": race_id, "quinella_odds": quinella_odds}
+            if ascii_field(record_str[0:2]) != "O2": return None
+            matrix = _to_record_matrix([record_str], O2_MIN_LENGTH)
+            race_id = matrix[0, 11:27].tobytes().decode("ascii", errors="replace")
+
+            quinella = _block_view(matrix, O2_QUINELLA_BLOCK)[0]
+            u1, u1_ok = _decode_digits(quinella[:, 0:2])
+            u2, u2_ok = _decode_digits(quinella[:, 2:4])
+            odds, odds_ok = _decode_digits(quinella[:, 4:10])
+            ninki, ninki_ok = _decode_digits(quinella[:, 10:13])
+
+            valid = (u1_ok & u2_ok & odds_ok & (odds > 0)
+                     & (u1 >= 1) & (u1 < u2) & (u2 <= MAX_HORSES))
+            u1, u2 = u1[valid] - 1, u2[valid] - 1
+
+            odds_matrix = np.zeros((MAX_HORSES, MAX_HORSES), dtype=np.int32)
+            ninki_matrix = np.zeros((MAX_HORSES, MAX_HORSES), dtype=np.int16)
+            odds_matrix[u1, u2] = odds[valid]
+            ninki_matrix[u1, u2] = np.where(ninki_ok, ninki, 999)[valid]
+
+            return {"race_id": race_id, "quinella_odds": QuinellaOdds(odds_matrix, ninki_matrix)}
         except Exception as e:
             logger.error(f"O2レコード解析エラー: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def parse_o1_batch(self, records):
+        """
+        O1レコード群（単勝・複勝・枠連オッズ）をNumPyでまとめて解析する（バッチ版）
+        オッズは10倍値の整数 (0 = 発売なし/欠損)、人気は欠損時99として保持する。
+        戻り値: {race_id: {"happyo_times": [...], "horse_count": int16[n],
+                 "win_odds": int32[n,28], "win_ninki": int16[n,28],
+                 "show_odds_min": int32[n,28], "show_odds_max": int32[n,28], "show_ninki": int16[n,28],
+                 "bracket_odds": int32[n,36], "bracket_ninki": int16[n,36]}}
+        """
+        records = [r for r in records if ascii_field(r[0:2]) == "O1"]
+        if not records:
+            return {}
+
+        try:
+            matrix = _to_record_matrix(records, O1_MIN_LENGTH)
+            n = matrix.shape[0]
+
+            race_ids = [matrix[i, 11:27].tobytes().decode("ascii", errors="replace") for i in range(n)]
+            happyo_times = [matrix[i, 27:35].tobytes().decode("ascii", errors="replace") for i in range(n)]
+
+            horse_count, hc_valid = _decode_digits(matrix[:, 35:37])
+            horse_count = np.where(hc_valid, horse_count, 0)
+            in_race = np.arange(O1_WIN_BLOCK[2])[None, :] < horse_count[:, None]
+
+            # --- 1. 単勝オッズ ---
+            win = _block_view(matrix, O1_WIN_BLOCK)
+            win_odds, win_ok = _decode_digits(win[:, :, 2:6])
+            win_ninki, win_n_ok = _decode_digits(win[:, :, 6:8])
+            win_ok &= in_race & (win_odds > 0)
+
+            # --- 2. 複勝オッズ ---
+            show = _block_view(matrix, O1_SHOW_BLOCK)
+            show_min, show_ok = _decode_digits(show[:, :, 2:6])
+            show_max, show_max_ok = _decode_digits(show[:, :, 6:10])
+            show_ninki, show_n_ok = _decode_digits(show[:, :, 10:12])
+            show_ok &= in_race & (show_min > 0)
+            show_max = np.where(show_max_ok, show_max, show_min)
+
+            # --- 3. 枠連オッズ ---
+            bracket = _block_view(matrix, O1_BRACKET_BLOCK)
+            _, w_ok = _decode_digits(bracket[:, :, 0:2])
+            bracket_odds, bracket_ok = _decode_digits(bracket[:, :, 2:6])
+            bracket_ninki, bracket_n_ok = _decode_digits(bracket[:, :, 6:8])
+            bracket_ok &= w_ok & (bracket_odds > 0)
+
+            columns = {
+                "horse_count": horse_count.astype(np.int16),
+                "win_odds": np.where(win_ok, win_odds, 0).astype(np.int32),
+                "win_ninki": np.where(win_n_ok, win_ninki, 99).astype(np.int16),
+                "show_odds_min": np.where(show_ok, show_min, 0).astype(np.int32),
+                "show_odds_max": np.where(show_ok, show_max, 0).astype(np.int32),
+                "show_ninki": np.where(show_n_ok, show_ninki, 99).astype(np.int16),
+                "bracket_odds": np.where(bracket_ok, bracket_odds, 0).astype(np.int32),
+                "bracket_ninki": np.where(bracket_n_ok, bracket_ninki, 99).astype(np.int16),
+            }
+        except Exception as e:
+            logger.error(f"O1バッチ解析エラー: {e}")
+            return {}
+
+        # レース毎に行をまとめる
+        rows_by_race = {}
+        for i, race_id in enumerate(race_ids):
+            rows_by_race.setdefault(race_id, []).append(i)
+
+        result = {}
+        for race_id, rows in rows_by_race.items():
+            race_batch = {"race_id": race_id, "happyo_times": [happyo_times[i] for i in rows]}
+            for name, col in columns.items():
+                race_batch[name] = col[rows]
+            result[race_id] = race_batch
+        return result
+
+    def o1_batch_to_dicts(self, race_batch):
+        """
+        parse_o1_batch のレース単位の結果を、parse_o1_record と同じ辞書形式へ展開する。
+        戻り値: [(happyo_time, parsed_dict), ...]
+        """
+        race_id = race_batch["race_id"]
+        win_odds = race_batch["win_odds"].tolist()
+        win_ninki = race_batch["win_ninki"].tolist()
+        show_min = race_batch["show_odds_min"].tolist()
+        show_max = race_batch["show_odds_max"].tolist()
+        show_ninki = race_batch["show_ninki"].tolist()
+        bracket_odds = race_batch["bracket_odds"].tolist()
+        bracket_ninki = race_batch["bracket_ninki"].tolist()
+
+        results = []
+        for row, happyo_time in enumerate(race_batch["happyo_times"]):
+            results.append((happyo_time, {
+                "race_id": race_id, "place_code": race_id[8:10], "race_num": race_id[14:16],
+                "win_odds": {
+                    i + 1: {"odds": o / 10.0, "ninki": n}
+                    for i, (o, n) in enumerate(zip(win_odds[row], win_ninki[row])) if o > 0
+                },
+                "show_odds": {
+                    i + 1: {"odds_min": o_min / 10.0, "odds_max": o_max / 10.0, "ninki": n}
+                    for i, (o_min, o_max, n) in enumerate(zip(show_min[row], show_max[row], show_ninki[row])) if o_min > 0
+                },
+                "bracket_odds": {
+                    combo: {"odds": o / 10.0, "ninki": n}
+                    for combo, o, n in zip(BRACKET_COMBOS, bracket_odds[row], bracket_ninki[row]) if o > 0
+                },
+            }))
+        return results
+
+    def parse_combo_odds_record(self, record_str):
+        """
+        O3〜O6レコード（ワイド・馬単・3連複・3連単オッズ）の解析
+        全組番をNumPyで一括デコードし、発売のある組番だけを ComboOdds として保持する
+        """
+        record_type = ascii_field(record_str[0:2])
+        layout = COMBO_ODDS_LAYOUTS.get(record_type)
+        if layout is None:
+            return None
+
+        try:
+            base, stride, count = layout["block"]
+            matrix = _to_record_matrix([record_str], base + stride * count)
+            race_id = matrix[0, 11:27].tobytes().decode("ascii", errors="replace")
+            combos = _block_view(matrix, layout["block"])[0]
+
+            def column(name):
+                start, end = layout[name]
+                return _decode_digits(combos[:, start:end])
+
+            kumi, kumi_ok = column("kumi")
+            odds, odds_ok = column("odds")
+            ninki, ninki_ok = column("ninki")
+            valid = kumi_ok & odds_ok & (odds > 0)
+
+            ninki_width = layout["ninki"][1] - layout["ninki"][0]
+            ninki = np.where(ninki_ok, ninki, 10 ** ninki_width - 1)
+
+            odds_max = None
+            if "odds_max" in layout:
+                odds_max, odds_max_ok = column("odds_max")
+                odds_max = np.where(odds_max_ok, odds_max, odds)[valid].astype(np.int32)
+
+            combo_odds = ComboOdds(
+                kumi[valid].astype(np.int32),
+                odds[valid].astype(np.int32),
+                ninki[valid].astype(np.int16),
+                odds_max=odds_max,
+            )
+            return {"race_id": race_id, "record_type": record_type, layout["key"]: combo_odds}
+        except Exception as e:
+            logger.error(f"{record_type}レコード解析エラー: {e}")
+            return None
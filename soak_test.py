@@ -0,0 +1,284 @@
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import tempfile
+import threading
+import tracemalloc
+from fake_link import FakeLink
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 時計を差し替えるモジュール (fetch_worker_loop から呼ばれる範囲)
+CLOCK_MODULES = [
+    "fetch_worker", "fetchers", "fake_link", "fetch_planner", "race_key_index",
+    "race_schedule", "poll_scheduler", "processor", "bundle_writer", "odds_delta", "parse_memo",
+]
+
+# キャッシュ等が埋まるまでの日数。この日以降の増加量で判定する
+WARMUP_DAYS = 2
+
+class SimClock:
+    """
+    加速した模擬時計。sleep() は待たずに (speed > 0 の場合は 1/speed だけ待って) 時刻を進める。
+    日付を跨いだ sleep では on_new_day(前日の日付) を呼ぶ (受信ループが待機中の、処理の切れ目で呼ばれる)。
+    """
+    def __init__(self, start_dt, speed=0, on_new_day=None):
+        self.now_ts = start_dt.timestamp()
+        self.speed = speed
+        self.on_new_day = on_new_day
+        self.lock = threading.Lock()
+
+    def time(self):
+        with self.lock:
+            return self.now_ts
+
+    def now(self, tz=None):
+        return datetime.datetime.fromtimestamp(self.time(), tz)
+
+    def sleep(self, seconds):
+        if self.speed > 0:
+            time.sleep(seconds / self.speed)
+        with self.lock:
+            before = datetime.date.fromtimestamp(self.now_ts)
+            self.now_ts += max(seconds, 0)
+            crossed = datetime.date.fromtimestamp(self.now_ts) != before
+        if crossed and self.on_new_day:
+            self.on_new_day(before)
+
+class _ClockTime:
+    """time モジュールの代わり。time()/sleep() だけ模擬時計を使う"""
+    def __init__(self, clock):
+        self.clock = clock
+        self.time = clock.time
+        self.sleep = clock.sleep
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+class _ClockDatetime:
+    """datetime モジュールの代わり。datetime.now() だけ模擬時計を使う"""
+    def __init__(self, clock):
+        class _Datetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now(tz)
+        self.datetime = _Datetime
+
+    def __getattr__(self, name):
+        return getattr(datetime, name)
+
+class DailyFakeLink(FakeLink):
+    """
+    日付が変わる毎にその日のレースを作り直す擬似リンク。race_weekdays 以外の曜日は非開催 (-1) とする。
+    実際のリンクと同じく、同じレース・発表時刻のオッズは何度開いても同じレコードを返す (合成は1回だけ行う)。
+    """
+    def __init__(self, date_str, race_weekdays=(5, 6), **kwargs):
+        self.race_weekdays = race_weekdays
+        self.link_kwargs = kwargs
+        self._load_day(date_str)
+
+    def _load_day(self, date_str):
+        FakeLink.__init__(self, date_str, **self.link_kwargs)
+        self.odds_records = {}  # (レコード種別, race_id, 発表時刻) -> レコード (その日の分のみ)
+        if datetime.datetime.strptime(date_str, "%Y%m%d").weekday() not in self.race_weekdays:
+            self.races = {}
+
+    def _odds_record(self, record_func, race_id, happyo_time):
+        key = (record_func, race_id, happyo_time)
+        record = self.odds_records.get(key)
+        if record is None:
+            record = self.odds_records[key] = super()._odds_record(record_func, race_id, happyo_time)
+        return record
+
+    def _rt_open(self, spec, key):
+        if key[:8].isdigit() and key[:8] != self.date_str:
+            self._load_day(key[:8])
+        if not self.races:
+            self.open_count += 1
+            self.buffer = []
+            return -1
+        return super()._rt_open(spec, key)
+
+    JVRTOpen = NVRTOpen = _rt_open
+
+class SoakUploader:
+    """ペイロードを作るだけで送信しないアップロード先"""
+    def __init__(self):
+        from gcs_uploader import build_payload
+        self.build = build_payload
+        self.objects = 0
+        self.wire_bytes = 0
+
+    def build_payload(self, data_dict):
+        return self.build(data_dict)
+
+    def upload_jsons_parallel(self, tasks):
+        for _, payload in tasks:
+            self.objects += 1
+            self.wire_bytes += len(payload.data)
+        return [task[0] for task in tasks]
+
+def current_rss():
+    """現在の常駐メモリ (バイト)。取得できない環境では None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def patch_environment(clock, base_dir):
+    """対象モジュールの time/datetime を模擬時計に、get_base_dir を一時ディレクトリに差し替える。戻り値: 元に戻す関数"""
+    import processor
+    original_base_dir = processor.get_base_dir
+    restores = []
+    for name in CLOCK_MODULES:
+        module = sys.modules.get(name) or __import__(name)
+        for attr, shim in (("time", _ClockTime(clock)), ("datetime", _ClockDatetime(clock))):
+            if getattr(module, attr, None) in (time, datetime):
+                restores.append((module, attr, getattr(module, attr)))
+                setattr(module, attr, shim)
+    for module in list(sys.modules.values()):
+        if getattr(module, "get_base_dir", None) is original_base_dir:
+            restores.append((module, "get_base_dir", original_base_dir))
+            module.get_base_dir = lambda: base_dir
+
+    def restore():
+        for module, attr, value in reversed(restores):
+            setattr(module, attr, value)
+    return restore
+
+def top_allocators(before, after, limit=10):
+    return [
+        {"where": str(stat.traceback), "size_diff_kb": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff}
+        for stat in after.compare_to(before, "lineno")[:limit]
+    ]
+
+def run_soak(days, source, start_date, speed=0, max_growth_kb=1024, max_rss_growth_mb=8, verbose=False,
+             places=(5, 6), races_per_place=6):
+    """
+    fetch_worker_loop を擬似リンク・送信しないアップロード先で days 日分動かし、日毎にメモリ・GCの状況を記録する。
+    ウォームアップ後の1日あたりの増加量が閾値を超えた場合は失敗とする。
+    """
+    import fetch_worker
+    from fetchers import JRAVanFetcher, UmaConnFetcher
+    from record_parser import JRAVanParser
+    from race_info_parser import RaceInfoParser
+    from processor import UploadCache
+
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    base_dir = tempfile.mkdtemp(prefix="soak_test_")
+    samples = []
+    snapshots = {}
+    stop_event = fetch_worker.stop_event
+
+    def on_new_day(finished_date):
+        gc.collect()
+        traced, _ = tracemalloc.get_traced_memory()
+        rss = current_rss()
+        sample = {
+            "day": len(samples) + 1,
+            "date": finished_date.isoformat(),
+            "rss_mb": round(rss / 1024 / 1024, 1) if rss else None,
+            "traced_kb": round(traced / 1024, 1),
+            "gc_objects": len(gc.get_objects()),
+            "gc_counts": gc.get_count(),
+            "uploaded_objects": uploader.objects,
+        }
+        samples.append(sample)
+        logging.warning(f"[soak] {json.dumps(sample)}")
+        if sample["day"] in (WARMUP_DAYS, days):
+            snapshots[sample["day"]] = tracemalloc.take_snapshot()
+        if sample["day"] >= days:
+            stop_event.set()
+
+    clock = SimClock(datetime.datetime.combine(start_date, datetime.time(8, 0)), speed, on_new_day)
+    restore = patch_environment(clock, base_dir)
+    uploader = SoakUploader()
+    fetcher_class = JRAVanFetcher if source == "jra" else UmaConnFetcher
+    source_name = "JRA-VAN" if source == "jra" else "UmaConn"
+
+    class _SoakFetcher(fetcher_class):
+        def __init__(self, **kwargs):
+            kwargs["link"] = DailyFakeLink(
+                start_date.strftime("%Y%m%d"), places=places, races_per_place=races_per_place,
+                open_latency=0.05, read_latency=0.002,
+            )
+            super().__init__(**kwargs)
+
+    tracemalloc.start()
+    stop_event.clear()
+    started = time.perf_counter()
+    upload_cache = UploadCache(os.path.join(base_dir, "upload_cache.db"), os.path.join(base_dir, "upload_cache.json"))
+    try:
+        worker = threading.Thread(
+            target=fetch_worker.fetch_worker_loop,
+            args=(source_name, _SoakFetcher, JRAVanParser(), RaceInfoParser(), uploader, upload_cache),
+        )
+        worker.start()
+        worker.join()
+    finally:
+        tracemalloc.stop()
+        restore()
+        upload_cache.close()
+
+    report = {
+        "source": source, "days": days, "real_sec": round(time.perf_counter() - started, 1),
+        "samples": samples, "failures": [],
+    }
+    measured = [s for s in samples if s["day"] >= WARMUP_DAYS]
+    if len(measured) >= 2:
+        span = measured[-1]["day"] - measured[0]["day"]
+        traced_growth = (measured[-1]["traced_kb"] - measured[0]["traced_kb"]) / span
+        report["traced_growth_kb_per_day"] = round(traced_growth, 1)
+        if traced_growth > max_growth_kb:
+            report["failures"].append(f"traced memory +{traced_growth:.1f}KB/day > {max_growth_kb}KB/day")
+        # 比較用の tracemalloc スナップショット自体がRSSを増やすため、RSSはスナップショットを取った翌日から比べる
+        rss_measured = [s for s in measured if s["day"] > WARMUP_DAYS and s["rss_mb"] is not None]
+        if len(rss_measured) >= 2:
+            rss_growth = (rss_measured[-1]["rss_mb"] - rss_measured[0]["rss_mb"]) / (rss_measured[-1]["day"] - rss_measured[0]["day"])
+            report["rss_growth_mb_per_day"] = round(rss_growth, 2)
+            if rss_growth > max_rss_growth_mb:
+                report["failures"].append(f"RSS +{rss_growth:.2f}MB/day > {max_rss_growth_mb}MB/day")
+        if WARMUP_DAYS in snapshots and days in snapshots:
+            report["top_allocators"] = top_allocators(snapshots[WARMUP_DAYS], snapshots[days])
+    return report
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="擬似リンクで fetch_worker_loop を加速した時計で長時間動かし、メモリの増加を調べる")
+    arg_parser.add_argument("--days", type=int, default=14, help="模擬する日数")
+    arg_parser.add_argument("--source", default="jra", choices=["jra", "nar"], help="動かすワーカー")
+    arg_parser.add_argument("--start-date", default=datetime.date.today().isoformat(), help="開始日 (YYYY-MM-DD)")
+    arg_parser.add_argument("--places", default="5,6", help="擬似リンクの開催場コード (カンマ区切り)")
+    arg_parser.add_argument("--races-per-place", type=int, default=6, help="開催場毎のレース数 (メモリの増加は日数で見るため、既定は実際より少なくして短時間で回す)")
+    arg_parser.add_argument("--speed", type=float, default=0, help="時計の速度 (0=待ち時間なし、N=N倍速)")
+    arg_parser.add_argument("--max-growth-kb", type=float, default=1024, help="許容する tracemalloc の1日あたりの増加量 (KB)")
+    arg_parser.add_argument("--max-rss-growth-mb", type=float, default=8, help="許容するRSSの1日あたりの増加量 (MB)")
+    arg_parser.add_argument("--output", help="結果JSONの保存先")
+    arg_parser.add_argument("--verbose", action="store_true", help="受信ループのINFOログも出力する")
+    args = arg_parser.parse_args()
+
+    if args.days < WARMUP_DAYS + 2:
+        print(f"--days は {WARMUP_DAYS + 2} 以上を指定してください")
+        sys.exit(2)
+    report = run_soak(
+        args.days, args.source, datetime.date.fromisoformat(args.start_date), args.speed,
+        args.max_growth_kb, args.max_rss_growth_mb, args.verbose,
+        tuple(int(place) for place in args.places.split(",")), args.races_per_place,
+    )
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    sys.exit(1 if report["failures"] else 0)
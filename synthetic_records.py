@@ -0,0 +1,168 @@
+import random
+
+# 擬似リンク・ベンチマーク用の合成レコード生成（JV-Data の固定長レイアウトに合わせた最小限の内容）
+
+def race_id_for(date_str, place_code, race_num, kai=3, nichi=2):
+    """race_id (YYYYMMDDJJKKNNRR) を組み立てる"""
+    return f"{date_str}{place_code:02d}{kai:02d}{nichi:02d}{race_num:02d}"
+
+def _sjis_field(text, width):
+    raw = text.encode("shift_jis")[:width]
+    return raw + b" " * (width - len(raw))
+
+def ra_record(race_id, start_hhmm="1540", seed=0):
+    """RAレコード (レース詳細, 1272バイト)"""
+    rnd = random.Random(seed)
+    b = bytearray(b" " * 1270 + b"\r\n")
+    b[0:11] = ("RA1" + race_id[0:8]).encode()
+    b[11:27] = race_id.encode()
+    b[572:592] = _sjis_field(rnd.choice(["天皇賞", "菊花賞", "３歳未勝利", "一般"]), 20)
+    b[697:701] = f"{rnd.choice([1200, 1600, 1800, 2000, 2400]):04d}".encode()
+    b[705:707] = b"11"
+    b[709:711] = b"00"
+    b[873:877] = start_hhmm.encode()
+    b[887:890] = b"112"
+    return bytes(b)
+
+def o1_record(race_id, happyo_time, horse_count=16, seed=0):
+    """O1レコード (単勝・複勝・枠連オッズ)"""
+    rnd = random.Random(seed)
+    s = "O1" + "1" + race_id[0:8] + race_id + happyo_time + f"{horse_count:02d}{horse_count:02d}" + "777" + "3"
+    for i in range(28):
+        s += f"{i + 1:02d}{rnd.randint(11, 9999):04d}{rnd.randint(1, horse_count):02d}" if i < horse_count else " " * 8
+    for i in range(28):
+        if i < horse_count:
+            low = rnd.randint(10, 999)
+            s += f"{i + 1:02d}{low:04d}{low + rnd.randint(0, 99):04d}{rnd.randint(1, horse_count):02d}"
+        else:
+            s += " " * 12
+    for a in range(1, 9):
+        for c in range(a, 9):
+            s += f"{a}{c}{rnd.randint(1, 9999):04d}{rnd.randint(1, 36):02d}"
+    s += "0" * 33
+    return (s + "\r\n").encode("ascii")
+
+def o2_record(race_id, happyo_time, horse_count=16, seed=0):
+    """O2レコード (馬連オッズ)"""
+    rnd = random.Random(seed)
+    s = "O2" + "1" + race_id[0:8] + race_id + happyo_time + f"{horse_count:02d}{horse_count:02d}" + "7"
+    for a in range(1, 19):
+        for c in range(a + 1, 19):
+            if c <= horse_count:
+                s += f"{a:02d}{c:02d}{rnd.randint(1, 999999):06d}{rnd.randint(1, 153):03d}"
+            else:
+                s += f"{a:02d}{c:02d}" + " " * 9
+    s += "0" * 11
+    return (s + "\r\n").encode("ascii")
+
+def se_record(race_id, umaban, seed=0):
+    """SEレコード (馬毎レース情報, 555バイト)"""
+    rnd = random.Random(seed * 100 + umaban)
+    b = bytearray(b" " * 553 + b"\r\n")
+    b[0:11] = ("SE1" + race_id[0:8]).encode()
+    b[11:27] = race_id.encode()
+    b[27:28] = str((umaban + 1) // 2 if umaban <= 16 else 8).encode()
+    b[28:30] = f"{umaban:02d}".encode()
+    b[30:40] = f"{rnd.randint(2015100001, 2023109999):010d}".encode()
+    b[40:76] = _sjis_field(rnd.choice(["イクイノックス", "ドウデュース", "リバティアイランド", "スターズオンアース"]), 36)
+    b[78:79] = rnd.choice([b"1", b"2", b"3"])
+    b[82:84] = f"{rnd.randint(2, 8):02d}".encode()
+    b[306:314] = _sjis_field(rnd.choice(["ルメール", "武豊", "川田将雅", "戸崎圭太"]), 8)
+    b[324:327] = f"{rnd.randint(420, 540)}".encode()
+    b[327:331] = f"{rnd.choice('+-')}{rnd.randint(0, 20):03d}".encode()
+    b[359:363] = f"{rnd.randint(11, 9999):04d}".encode()
+    b[363:365] = f"{rnd.randint(1, 18):02d}".encode()
+    return bytes(b)
+
+def we_record(date_str, place_code, happyo_time, seed=0):
+    """WEレコード (天候馬場状態, 42バイト)"""
+    rnd = random.Random(seed)
+    b = bytearray(b" " * 40 + b"\r\n")
+    b[0:11] = ("WE1" + date_str).encode()
+    b[11:27] = (race_id_for(date_str, place_code, 0)[:14] + happyo_time[:2]).encode()
+    b[34:37] = f"{rnd.randint(1, 6)}{rnd.randint(1, 4)}{rnd.randint(1, 4)}".encode()
+    return bytes(b)
+
+def wh_record(race_id, happyo_time, horse_count=16, seed=0):
+    """WHレコード (馬体重, 847バイト)"""
+    rnd = random.Random(seed)
+    b = bytearray(("WH1" + race_id[0:8] + race_id + happyo_time).encode())
+    for i in range(18):
+        if i < horse_count:
+            b += f"{i + 1:02d}".encode() + _sjis_field(rnd.choice(["イクイノックス", "ドウデュース", "ソールオリエンス"]), 36)
+            b += f"{rnd.randint(420, 540)}{rnd.choice('+-')}{rnd.randint(0, 20):03d}".encode()
+        else:
+            b += b" " * 45
+    return bytes(b) + b"\r\n"
+
+def _combos(horses, size, ordered):
+    if size == 2:
+        return [(a, c) for a in range(1, horses + 1) for c in range(1, horses + 1) if (a != c if ordered else a < c)]
+    return [
+        (a, c, d) for a in range(1, horses + 1) for c in range(1, horses + 1) for d in range(1, horses + 1)
+        if (len({a, c, d}) == 3 if ordered else a < c < d)
+    ]
+
+# O3〜O6: (組番の頭数, 順序付きか, オッズ桁数, 最高オッズ桁数 (ワイドのみ), 人気桁数)
+COMBO_RECORD_FORMATS = {
+    "O3": (2, False, 5, 5, 3),  # ワイド (2654バイト)
+    "O4": (2, True, 6, 0, 3),   # 馬単 (4031バイト)
+    "O5": (3, False, 6, 0, 3),  # 3連複 (12293バイト)
+    "O6": (3, True, 7, 0, 4),   # 3連単 (83285バイト)
+}
+
+def combo_odds_record(record_type, race_id, happyo_time, horse_count=16, seed=0):
+    """O3〜O6レコード。18頭立ての全組番の枠を持ち、出走頭数を超える組番は空白とする"""
+    size, ordered, odds_width, odds_max_width, ninki_width = COMBO_RECORD_FORMATS[record_type]
+    rnd = random.Random(seed)
+    parts = [record_type, "1", race_id[0:8], race_id, happyo_time, f"{horse_count:02d}{horse_count:02d}", "7"]
+    block_width = size * 2 + odds_width + odds_max_width + ninki_width
+    combo_count = 0
+    for combo in _combos(18, size, ordered):
+        kumi = "".join(f"{umaban:02d}" for umaban in combo)
+        combo_count += 1
+        if max(combo) > horse_count:
+            parts.append(kumi + " " * (block_width - len(kumi)))
+            continue
+        odds = rnd.randint(10, 10 ** odds_width - 1)
+        parts.append(f"{kumi}{odds:0{odds_width}d}")
+        if odds_max_width:
+            parts.append(f"{min(odds + rnd.randint(0, 50), 10 ** odds_max_width - 1):0{odds_max_width}d}")
+        parts.append(f"{rnd.randint(1, combo_count):0{ninki_width}d}")
+    parts.append(f"{rnd.randint(0, 10 ** 11 - 1):011d}")
+    return ("".join(parts) + "\r\n").encode("ascii")
+
+def day_records(date_str, places=(5, 6, 8), races_per_place=12, horse_count=16, snapshots=1,
+                record_types=("RA", "SE", "WE", "WH", "O1", "O2", "O3", "O4", "O5", "O6"), seed=0):
+    """
+    1日分の合成レコード (Shift-JISのバイト列) を返す。
+    RA/SE/WH はレース毎に1件ずつ、WE は開催場毎に1件、オッズ (O1〜O6) はレース毎に snapshots 回分の発表時刻で作る。
+    """
+    records = []
+    for place in places:
+        if "WE" in record_types:
+            records.append(we_record(date_str, place, date_str[4:8] + "0930", seed))
+        for race_num in range(1, races_per_place + 1):
+            race_id = race_id_for(date_str, place, race_num)
+            minutes = 600 + (race_num - 1) * 30 + place
+            start_hhmm = f"{minutes // 60:02d}{minutes % 60:02d}"
+            race_seed = seed * 10000 + place * 100 + race_num
+            if "RA" in record_types:
+                records.append(ra_record(race_id, start_hhmm, race_seed))
+            if "SE" in record_types:
+                records.extend(se_record(race_id, umaban, race_seed) for umaban in range(1, horse_count + 1))
+            if "WH" in record_types:
+                records.append(wh_record(race_id, date_str[4:8] + start_hhmm, horse_count, race_seed))
+            for snapshot in range(snapshots):
+                minutes_before = (snapshots - snapshot) * 5
+                happyo_minutes = minutes - minutes_before
+                happyo_time = f"{date_str[4:8]}{happyo_minutes // 60:02d}{happyo_minutes % 60:02d}"
+                snapshot_seed = race_seed * 100 + snapshot
+                if "O1" in record_types:
+                    records.append(o1_record(race_id, happyo_time, horse_count, snapshot_seed))
+                if "O2" in record_types:
+                    records.append(o2_record(race_id, happyo_time, horse_count, snapshot_seed))
+                for record_type in ("O3", "O4", "O5", "O6"):
+                    if record_type in record_types:
+                        records.append(combo_odds_record(record_type, race_id, happyo_time, horse_count, snapshot_seed))
+    return records
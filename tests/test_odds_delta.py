@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from record_parser import JRAVanParser, to_json_compatible
+from race_info_parser import RaceInfoParser
+from processor import parse_into_merged
+from odds_delta import OddsDeltaEncoder, DeltaResolver, apply_delta
+from synthetic_records import race_id_for, o1_record, o2_record, combo_odds_record
+
+DATE = "20261017"
+RACE_ID = race_id_for(DATE, 5, 11)
+HAPPYO_TIMES = ["10171520", "10171525", "10171530", "10171535", "10171540"]
+
+
+def _replace(record, start, text):
+    return record[:start] + text.encode("ascii") + record[start + len(text):]
+
+
+def _snapshots():
+    """発表時刻毎に数組だけオッズが変わる O1/O2/O3 のバンドル (race_id -> happyo_time -> バンドル)"""
+    records = []
+    for step, happyo_time in enumerate(HAPPYO_TIMES):
+        o1 = o1_record(RACE_ID, happyo_time, seed=1)
+        o2 = o2_record(RACE_ID, happyo_time, seed=2)
+        o3 = combo_odds_record("O3", RACE_ID, happyo_time, seed=3)
+        for i in range(step):
+            o1 = _replace(o1, 43 + 8 * i + 2, f"{100 + step:04d}")
+            o2 = _replace(o2, 40 + 13 * i + 4, f"{2000 + step:06d}")
+            o3 = _replace(o3, 40 + 17 * i + 4, f"{300 + step:05d}")
+        records.extend([o1, o2, o3])
+    merged = {}
+    parse_into_merged(records, JRAVanParser(), RaceInfoParser(), "jra", merged, "2026-10-17T15:40:00")
+    return merged[RACE_ID]
+
+
+def _as_json(bundle):
+    return json.loads(json.dumps(bundle, default=to_json_compatible))
+
+
+def _upload(encoder, bundles, failed=()):
+    """encode したスナップショットを JSON で保存する (failed の発表時刻は送信失敗として保存しない)"""
+    stored = {}
+    for happyo_time in HAPPYO_TIMES:
+        encoded = encoder.encode(DATE, RACE_ID, happyo_time, bundles[happyo_time])
+        if happyo_time in failed:
+            encoder.discard(RACE_ID, happyo_time)
+            continue
+        encoder.confirm(RACE_ID, happyo_time)
+        stored[happyo_time] = _as_json(encoded)
+    return stored
+
+
+def test_delta_round_trip():
+    bundles = _snapshots()
+    encoder = OddsDeltaEncoder(keyframe_interval=3)
+    stored = _upload(encoder, bundles)
+
+    delta_bases = {
+        happyo_time: {record_type: record_list[0].get("delta_base") for record_type, record_list in snapshot["records"].items()}
+        for happyo_time, snapshot in stored.items()
+    }
+    assert delta_bases[HAPPYO_TIMES[0]] == {"O1": None, "O2": None, "O3": None}
+    assert delta_bases[HAPPYO_TIMES[1]] == {"O1": HAPPYO_TIMES[0], "O2": HAPPYO_TIMES[0], "O3": HAPPYO_TIMES[0]}
+    # keyframe_interval 回毎に全量を挟む
+    assert delta_bases[HAPPYO_TIMES[3]] == {"O1": None, "O2": None, "O3": None}
+    assert delta_bases[HAPPYO_TIMES[4]] == {"O1": HAPPYO_TIMES[3], "O2": HAPPYO_TIMES[3], "O3": HAPPYO_TIMES[3]}
+    assert encoder.stats()["deltas"] > 0
+
+    resolver = DeltaResolver(lambda happyo_time: stored[happyo_time])
+    for happyo_time in reversed(HAPPYO_TIMES):
+        assert resolver.resolve(happyo_time) == _as_json(bundles[happyo_time])
+
+
+def test_delta_skips_discarded_snapshots():
+    bundles = _snapshots()
+    encoder = OddsDeltaEncoder(keyframe_interval=10)
+    stored = _upload(encoder, bundles, failed={HAPPYO_TIMES[1]})
+
+    assert HAPPYO_TIMES[1] not in stored
+    assert stored[HAPPYO_TIMES[2]]["records"]["O1"][0]["delta_base"] == HAPPYO_TIMES[0]
+    assert encoder.stats()["pending"] == 0
+
+    resolver = DeltaResolver(lambda happyo_time: stored[happyo_time])
+    for happyo_time in stored:
+        assert resolver.resolve(happyo_time) == _as_json(bundles[happyo_time])
+
+
+def test_apply_delta_rejects_missing_sections():
+    bundles = _snapshots()
+    base = _as_json(bundles[HAPPYO_TIMES[0]])["records"]["O1"][0]
+    delta = {"delta_base": HAPPYO_TIMES[0], "fields": {"race_id": RACE_ID}, "changed": {"quinella_odds": {"1-2": [10, 1]}}}
+    with pytest.raises(ValueError):
+        apply_delta(base, delta)
@@ -0,0 +1,119 @@
+import pytest
+
+from record_parser import JRAVanParser, COMBO_ODDS_LAYOUTS
+from synthetic_records import race_id_for, o1_record, o2_record, combo_odds_record
+
+DATE = "20261017"
+
+
+def _replace(record, start, text):
+    """固定長レコードの start 位置から text で上書きしたレコードを返す"""
+    return record[:start] + text.encode("ascii") + record[start + len(text):]
+
+
+def _o1_records():
+    records = []
+    for place, horse_count in ((5, 16), (6, 18), (8, 9)):
+        race_id = race_id_for(DATE, place, 11)
+        for seed, happyo_time in enumerate(("10171530", "10171535", "10171540")):
+            records.append(o1_record(race_id, happyo_time, horse_count, seed=place * 10 + seed))
+    # 欠損 (空白) のオッズ・人気と、発売なし (0) の組番を含める
+    records[0] = _replace(records[0], 43 + 8 * 2 + 2, "    ")
+    records[1] = _replace(records[1], 267 + 12 * 3 + 10, "  ")
+    records[2] = _replace(records[2], 603 + 8 * 5 + 2, "0000")
+    return records
+
+
+@pytest.mark.parametrize("read_mode", ["str", "bytes"])
+def test_o1_batch_matches_per_record(read_mode):
+    parser = JRAVanParser()
+    records = _o1_records()
+    expected = {}
+    for record in records:
+        text = record.decode("shift_jis")
+        expected[(text[11:27], text[27:35])] = parser.parse_o1_record(text)
+
+    batch_input = [record.decode("shift_jis") for record in records] if read_mode == "str" else records
+    actual = {}
+    for race_id, race_batch in parser.parse_o1_batch(batch_input).items():
+        for happyo_time, parsed in parser.o1_batch_to_dicts(race_batch):
+            actual[(race_id, happyo_time)] = parsed
+
+    assert actual == expected
+
+
+def test_o1_batch_skips_other_record_types():
+    parser = JRAVanParser()
+    records = _o1_records()
+    result = parser.parse_o1_batch(records[:1] + [b"O2" + records[1][2:]])
+    assert list(result) == [records[0][11:27].decode("ascii")]
+    assert result[records[0][11:27].decode("ascii")]["happyo_times"] == ["10171530"]
+
+
+def _reference_o2(text):
+    """組番毎に1件ずつ読む O2 の解析 (従来の "u1-u2" 辞書形式)"""
+    quinella_odds = {}
+    for i in range(153):
+        data = text[40 + i * 13:40 + (i + 1) * 13]
+        u1, u2, odds, ninki = data[0:2].strip(), data[2:4].strip(), data[4:10].strip(), data[10:13].strip()
+        if u1 and u2 and odds.isdigit() and int(odds) > 0:
+            quinella_odds[f"{int(u1)}-{int(u2)}"] = {"odds": int(odds) / 10.0, "ninki": int(ninki) if ninki.isdigit() else 999}
+    return quinella_odds
+
+
+@pytest.mark.parametrize("horse_count", [8, 16, 18])
+def test_o2_matrix_matches_per_record(horse_count):
+    parser = JRAVanParser()
+    record = o2_record(race_id_for(DATE, 5, 11), "10171530", horse_count, seed=horse_count)
+    record = _replace(record, 40 + 13 * 4 + 10, "   ")  # 人気の欠損
+    expected = _reference_o2(record.decode("shift_jis"))
+
+    for record_input in (record, record.decode("shift_jis")):
+        parsed = parser.parse_o2_record(record_input)
+        quinella = parsed["quinella_odds"]
+        assert parsed["race_id"] == race_id_for(DATE, 5, 11)
+        assert quinella.to_dict() == expected
+        assert len(quinella) == len(expected)
+        for key, value in expected.items():
+            u1, u2 = map(int, key.split("-"))
+            assert quinella.get(u2, u1) == value
+    assert quinella.get(horse_count, horse_count + 1) is None
+
+
+def _reference_combo(text, layout):
+    """組番毎に1件ずつ読む O3〜O6 の解析 (ComboOdds.to_dict() と同じ列形式)"""
+    base, stride, count = layout["block"]
+    ninki_width = layout["ninki"][1] - layout["ninki"][0]
+    columns = {"kumi": [], "odds10": [], "odds_max10": [], "ninki": []}
+    for i in range(count):
+        block = text[base + i * stride:base + (i + 1) * stride]
+        kumi, odds, ninki = (block[slice(*layout[name])].strip() for name in ("kumi", "odds", "ninki"))
+        if not (kumi.isdigit() and odds.isdigit() and int(odds) > 0):
+            continue
+        columns["kumi"].append(int(kumi))
+        columns["odds10"].append(int(odds))
+        if "odds_max" in layout:
+            odds_max = block[slice(*layout["odds_max"])].strip()
+            columns["odds_max10"].append(int(odds_max) if odds_max.isdigit() else int(odds))
+        columns["ninki"].append(int(ninki) if ninki.isdigit() else 10 ** ninki_width - 1)
+    if "odds_max" not in layout:
+        del columns["odds_max10"]
+    return columns
+
+
+@pytest.mark.parametrize("record_type", sorted(COMBO_ODDS_LAYOUTS))
+def test_combo_odds_match_per_record(record_type):
+    parser = JRAVanParser()
+    layout = COMBO_ODDS_LAYOUTS[record_type]
+    base, stride, _ = layout["block"]
+    record = combo_odds_record(record_type, race_id_for(DATE, 6, 11), "10171530", 14, seed=3)
+    # 人気の欠損と、発売なし (0) の組番を含める
+    record = _replace(record, base + stride * 2 + layout["ninki"][0], " " * (layout["ninki"][1] - layout["ninki"][0]))
+    record = _replace(record, base + stride * 5 + layout["odds"][0], "0" * (layout["odds"][1] - layout["odds"][0]))
+    expected = _reference_combo(record.decode("shift_jis"), layout)
+
+    for record_input in (record, record.decode("shift_jis")):
+        parsed = parser.parse_combo_odds_record(record_input)
+        assert parsed["race_id"] == race_id_for(DATE, 6, 11)
+        assert parsed["record_type"] == record_type
+        assert parsed[layout["key"]].to_dict() == expected
@@ -0,0 +1,47 @@
+import json
+
+from record_parser import JRAVanParser, to_json_compatible
+from race_info_parser import RaceInfoParser
+from processor import UploadCache, parse_into_merged, upload_bundles
+from synthetic_records import day_records
+
+DATE = "20261017"
+
+
+class _Payload:
+    def __init__(self, data):
+        self.data = data
+        self.raw_size = len(data)
+
+
+class _RecordingUploader:
+    """送信せずに blob 名を記録するアップロード先"""
+    def __init__(self):
+        self.uploaded = []
+
+    def build_payload(self, data_dict):
+        return _Payload(json.dumps(data_dict, ensure_ascii=False, default=to_json_compatible).encode("utf-8"))
+
+    def upload_jsons_parallel(self, tasks):
+        self.uploaded.extend(name for name, _ in tasks)
+        return [name for name, _ in tasks]
+
+
+def _latest_bundles(fetched_at):
+    records = day_records(DATE, places=(5,), races_per_place=2, record_types=("RA", "SE"))
+    merged = {}
+    parse_into_merged(records, JRAVanParser(), RaceInfoParser(), "jra", merged, fetched_at)
+    return [(r_id, "latest", times["latest"], None) for r_id, times in merged.items()]
+
+
+def test_latest_without_fingerprint_ignores_fetched_at(tmp_path):
+    cache = UploadCache(str(tmp_path / "upload_cache.db"), str(tmp_path / "upload_cache.json"))
+    uploader = _RecordingUploader()
+
+    first = upload_bundles(_latest_bundles("2026-10-17T10:00:00"), uploader, "jra", cache, DATE)
+    second = upload_bundles(_latest_bundles("2026-10-17T10:05:00"), uploader, "jra", cache, DATE)
+    cache.close()
+
+    assert first == (2, 0)
+    assert second == (0, 2)
+    assert len(uploader.uploaded) == 2
@@ -0,0 +1,82 @@
+import os
+import json
+import types
+import datetime
+
+import pytest
+
+import processor
+from processor import UploadCache
+from synthetic_records import race_id_for
+
+
+class _Clock:
+    """processor の datetime.datetime.now() を固定する"""
+    def __init__(self, now):
+        clock = self
+        self.now = now
+
+        class _Datetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now
+
+        self.module = types.SimpleNamespace(datetime=_Datetime)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock(datetime.datetime(2026, 10, 17, 9, 0))
+    monkeypatch.setattr(processor, "datetime", clock.module)
+    return clock
+
+
+def _key(date_str, race_num, happyo_time="10171530"):
+    return f"odds_history/jra/{date_str}/{race_id_for(date_str, 5, race_num)}/{happyo_time}.json"
+
+
+def _open(tmp_path):
+    return UploadCache(str(tmp_path / "upload_cache.db"), str(tmp_path / "upload_cache.json"))
+
+
+def test_mark_many_persists(tmp_path, clock):
+    cache = _open(tmp_path)
+    keys = [_key("20261017", race_num) for race_num in range(1, 13)]
+    cache.mark_many(keys)
+    cache.mark_many(keys[:3])  # 重複は無視される
+    assert all(cache.is_uploaded(key) for key in keys)
+    assert not cache.is_uploaded(_key("20261017", 1, "10171535"))
+    cache.close()
+
+    reopened = _open(tmp_path)
+    assert all(reopened.is_uploaded(key) for key in keys)
+    reopened.close()
+
+
+def test_past_days_are_evicted(tmp_path, clock):
+    cache = _open(tmp_path)
+    today_key = _key("20261017", 1)
+    cache.mark_many([today_key])
+
+    clock.now = datetime.datetime(2026, 10, 18, 0, 1)
+    assert not cache.is_uploaded(today_key)
+    assert cache.conn.execute("SELECT COUNT(*) FROM uploaded").fetchone()[0] == 0
+
+    # 過去日のキーは記録しない
+    cache.mark_many([_key("20261017", 2), _key("20261018", 2)])
+    assert not cache.is_uploaded(_key("20261017", 2))
+    assert cache.is_uploaded(_key("20261018", 2))
+    cache.close()
+
+
+def test_legacy_json_is_migrated(tmp_path, clock):
+    legacy_keys = [_key("20261017", race_num) for race_num in range(1, 4)] + [_key("20261016", 1)]
+    legacy_file = tmp_path / "upload_cache.json"
+    legacy_file.write_text(json.dumps(legacy_keys), encoding="utf-8")
+
+    cache = _open(tmp_path)
+    assert all(cache.is_uploaded(key) for key in legacy_keys[:3])
+    assert not cache.is_uploaded(legacy_keys[3])
+    assert not legacy_file.exists()
+    assert os.path.exists(str(legacy_file) + ".migrated")
+    cache.close()
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import threading
+
+import pytest
+
+# upload_service は gcs_uploader 経由で google-cloud-storage を import する
+pytest.importorskip("google.cloud.storage")
+
+from gcs_uploader import Payload
+from upload_service import UploadService
+
+
+class _FlakyUploader:
+    """最初の failures 回は送信に失敗し、以降は成功するアップロード先"""
+    max_workers = 1
+
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.started = threading.Event()
+        self.calls = []
+        self.uploaded = {}
+        self.lock = threading.Lock()
+
+    def build_payload(self, data_dict):
+        data = json.dumps(data_dict).encode("utf-8")
+        return Payload(data, len(data))
+
+    def upload_payload(self, blob_name, payload):
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait()
+        with self.lock:
+            self.calls.append(blob_name)
+            if len(self.calls) <= self.failures:
+                return False
+            self.uploaded[blob_name] = json.loads(payload.data)
+            return True
+
+
+class _RecordingCache:
+    def __init__(self):
+        self.marked = []
+
+    def mark_many(self, cache_keys):
+        self.marked.extend(cache_keys)
+
+
+def _service(tmp_path, uploader, cache=None, **kwargs):
+    kwargs.setdefault("retry_base", 0.01)
+    return UploadService(uploader, cache or _RecordingCache(), spool_dirname=str(tmp_path / "spool"), **kwargs)
+
+
+def _task(uploader, blob_name, data_dict, cache_key):
+    return (blob_name, uploader.build_payload(data_dict), cache_key)
+
+
+def _spool_meta(tmp_path):
+    spool_dir = tmp_path / "spool"
+    return [json.loads((spool_dir / name).read_text(encoding="utf-8")) for name in sorted(os.listdir(spool_dir)) if name.endswith(".json")]
+
+
+def _wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_attempts_survive_restart(tmp_path):
+    uploader = _FlakyUploader(failures=10)
+    service = _service(tmp_path, uploader, retry_base=60)
+    service.start()
+    service.enqueue([_task(uploader, "a.json", {"v": 1}, "key-a")])
+    assert _wait_until(lambda: _spool_meta(tmp_path)[0]["attempts"] == 1)
+    service.stop()
+
+    meta = _spool_meta(tmp_path)[0]
+    assert meta["retry_at"] > time.time()
+
+    # 再起動後は失敗回数と再送予定時刻を引き継ぎ、すぐには再送しない
+    restarted = _service(tmp_path, _FlakyUploader())
+    assert restarted._resume_spool() == 1
+    assert restarted.queue.empty()
+    assert [item["attempts"] for _, _, item in restarted.retry_heap] == [1]
+    assert restarted.is_pending("key-a")
+
+
+def test_resume_after_restart_retries_until_success(tmp_path):
+    first = _FlakyUploader()
+    _service(tmp_path, first).enqueue([_task(first, "a.json", {"v": 1}, "key-a")])
+
+    uploader = _FlakyUploader(failures=2)
+    cache = _RecordingCache()
+    service = _service(tmp_path, uploader, cache)
+    service.start()
+    try:
+        assert _wait_until(lambda: "a.json" in uploader.uploaded and not service.is_pending("key-a"))
+    finally:
+        service.stop()
+
+    assert uploader.calls == ["a.json"] * 3
+    assert cache.marked == ["key-a"]
+    assert _spool_meta(tmp_path) == []
+
+
+def test_newer_enqueue_replaces_older(tmp_path):
+    uploader = _FlakyUploader()
+    stopped = _service(tmp_path, uploader)
+    stopped.enqueue([_task(uploader, "a.json", {"v": 1}, "key-a1")])
+    stopped.enqueue([_task(uploader, "a.json", {"v": 2}, "key-a2")])
+    assert len(_spool_meta(tmp_path)) == 2
+
+    cache = _RecordingCache()
+    service = _service(tmp_path, uploader, cache)
+    service.start()
+    try:
+        assert _wait_until(lambda: not service.is_pending("key-a2"))
+    finally:
+        service.stop()
+
+    assert uploader.calls == ["a.json"]
+    assert uploader.uploaded["a.json"] == {"v": 2}
+    assert cache.marked == ["key-a2"]
+    assert _spool_meta(tmp_path) == []
+
+
+def test_cache_is_marked_only_after_success(tmp_path):
+    uploader = _FlakyUploader(failures=2)
+    cache = _RecordingCache()
+    service = _service(tmp_path, uploader, cache)
+    service.start()
+    try:
+        service.enqueue([_task(uploader, "a.json", {"v": 1}, ["key-a", "key-b"])])
+        assert service.is_pending("key-a") and service.is_pending("key-b")
+
+        assert _wait_until(lambda: len(uploader.calls) >= 1)
+        assert cache.marked == []
+        assert service.is_pending("key-a")
+
+        assert _wait_until(lambda: not service.is_pending("key-a"))
+    finally:
+        service.stop()
+
+    assert len(uploader.calls) == 3
+    assert cache.marked == ["key-a", "key-b"]
+    assert not service.is_pending("key-b")
+
+
+def test_overflow_drains_when_queue_has_room(tmp_path):
+    gate = threading.Event()
+    uploader = _FlakyUploader(gate=gate)
+    cache = _RecordingCache()
+    service = _service(tmp_path, uploader, cache, max_queue=1)
+    service.start()
+    blobs = [f"{i}.json" for i in range(4)]
+    try:
+        # 唯一のワーカーが送信中の間にキューを溢れさせる
+        service.enqueue([_task(uploader, blobs[0], {"v": 0}, "key-0")])
+        assert uploader.started.wait(5)
+        accepted = service.enqueue([_task(uploader, blob, {"v": i}, f"key-{i}") for i, blob in enumerate(blobs) if i > 0])
+        assert accepted == 3
+        assert service.queue.qsize() == 1
+        assert service.overflow
+        assert len(_spool_meta(tmp_path)) == 4
+
+        gate.set()
+        assert _wait_until(lambda: not any(service.is_pending(f"key-{i}") for i in range(4)))
+    finally:
+        gate.set()
+        service.stop()
+
+    assert sorted(uploader.uploaded) == blobs
+    assert sorted(cache.marked) == [f"key-{i}" for i in range(4)]
+    assert _spool_meta(tmp_path) == []
@@ -0,0 +1,318 @@
+import os
+import json
+import heapq
+import time
+import random
+import queue
+import logging
+import threading
+from gcs_uploader import Payload
+from processor import get_base_dir
+
+logger = logging.getLogger(__name__)
+
+def _as_key_list(cache_key):
+    """キャッシュキー (単独/リスト/None) をリストに揃える"""
+    if cache_key is None:
+        return []
+    if isinstance(cache_key, (list, tuple)):
+        return list(cache_key)
+    return [cache_key]
+
+class UploadService:
+    """
+    常駐型のバックグラウンドアップロードサービス。
+    送信待ちのペイロードは先にディスク上の送信箱 (spool) へ書き出してから有界キューへ投入し、
+    常駐ワーカースレッドがGCSへ送信する。失敗したものは指数バックオフで再送し、
+    再起動時は送信箱に残ったものから送信を再開する。
+    """
+    def __init__(self, uploader, upload_cache, spool_dirname="upload_spool", max_queue=1000,
+                 retry_base=5, retry_max=600, num_workers=None):
+        self.uploader = uploader
+        self.upload_cache = upload_cache
+        self.spool_dir = os.path.join(get_base_dir(), spool_dirname)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.num_workers = num_workers or uploader.max_workers
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.retry_heap = []
+        self.latest_seq = {}      # blob_name -> 最新の送信依頼番号
+        self.pending_keys = {}    # cache_key -> 送信待ち件数
+        self.queued_seqs = set()  # メモリ上のキュー/再送待ちにある送信依頼番号
+        self.overflow = False     # キューに入りきらず送信箱にのみ存在する依頼があるか
+        self.last_seq = 0
+        self.threads = []
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    # ------------------------------------------
+    # process_and_upload から利用するインターフェース
+    # ------------------------------------------
+    @property
+    def max_workers(self):
+        return self.num_workers
+
+    def build_payload(self, data_dict):
+        return self.uploader.build_payload(data_dict)
+
+    def is_pending(self, cache_key):
+        with self.lock:
+            return cache_key in self.pending_keys
+
+    def enqueue(self, upload_tasks):
+        """
+        (blob_name, Payload, cache_key) の並びを送信箱に書き出して送信キューへ投入する。
+        cache_key にはリストも指定でき、送信成功時にまとめてキャッシュへ記録する。
+        キューが満杯の場合は送信箱にのみ残し、空きができ次第送信する（呼び出し元は待たせない）。
+        戻り値: 受け付けた件数
+        """
+        accepted = 0
+        for blob_name, payload, cache_key in upload_tasks:
+            item = {
+                "seq": self._next_seq(),
+                "blob_name": blob_name,
+                "cache_keys": _as_key_list(cache_key),
+                "content_type": payload.content_type,
+                "content_encoding": payload.content_encoding,
+                "raw_size": payload.raw_size,
+                "attempts": 0,
+            }
+            try:
+                self._write_spool(item, payload.data)
+            except Exception as e:
+                logger.error(f"送信箱への書き出しに失敗しました ({blob_name}): {e}")
+                continue
+
+            with self.lock:
+                self.latest_seq[blob_name] = item["seq"]
+                self._add_pending(item)
+            self._offer(item, payload)
+            accepted += 1
+        return accepted
+
+    def stats(self):
+        """監視用: 送信キューの状況と、アップローダーの同時数・スループット"""
+        with self.lock:
+            service_stats = {"queued": self.queue.qsize(), "retrying": len(self.retry_heap), "pending": len(self.latest_seq)}
+        if hasattr(self.uploader, "stats"):
+            service_stats.update(self.uploader.stats())
+        return service_stats
+
+    # ------------------------------------------
+    # ライフサイクル
+    # ------------------------------------------
+    def start(self):
+        resumed = self._resume_spool()
+        if resumed:
+            logger.info(f"送信箱から未送信データを再開します ({resumed}件)")
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._worker_loop, name=f"upload-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+        t = threading.Thread(target=self._scheduler_loop, name="upload-scheduler", daemon=True)
+        t.start()
+        self.threads.append(t)
+
+    def stop(self, timeout=5):
+        """ワーカーを停止する。未送信分は送信箱に残り、次回起動時に再開される"""
+        self.stop_event.set()
+        for t in self.threads:
+            t.join(timeout=timeout)
+
+    # ------------------------------------------
+    # 送信箱 (spool)
+    # ------------------------------------------
+    def _next_seq(self):
+        with self.lock:
+            # 再起動を跨いでも単調増加となるよう時刻ベースで採番する
+            self.last_seq = max(self.last_seq + 1, time.time_ns())
+            return self.last_seq
+
+    def _spool_path(self, seq, ext):
+        return os.path.join(self.spool_dir, f"{seq:020d}.{ext}")
+
+    def _write_spool(self, item, data):
+        data_path = self._spool_path(item["seq"], "bin")
+        with open(data_path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(data_path + ".tmp", data_path)
+        # メタ情報の書き込み完了をもって送信箱への登録完了とする
+        self._write_spool_meta(item)
+
+    def _write_spool_meta(self, item):
+        meta_path = self._spool_path(item["seq"], "json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(item, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _read_spool_data(self, item):
+        with open(self._spool_path(item["seq"], "bin"), "rb") as f:
+            return f.read()
+
+    def _remove_spool(self, item):
+        for ext in ("json", "bin"):
+            try:
+                os.remove(self._spool_path(item["seq"], ext))
+            except FileNotFoundError:
+                pass
+
+    def _load_spool_items(self):
+        items = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if name.endswith(".tmp"):
+                # 書き込み途中で停止した残骸
+                try: os.remove(os.path.join(self.spool_dir, name))
+                except OSError: pass
+                continue
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name), "r", encoding="utf-8") as f:
+                    item = json.load(f)
+                if "cache_keys" not in item:
+                    item["cache_keys"] = _as_key_list(item.pop("cache_key", None))
+                items.append(item)
+            except Exception as e:
+                logger.warning(f"送信箱の読み込みに失敗しました ({name}): {e}")
+        return items
+
+    def _resume_spool(self):
+        """起動時に送信箱を読み込む。同じblobの古い依頼は最新のものに置き換える"""
+        items = self._load_spool_items()
+        latest = {}
+        for item in items:
+            current = latest.get(item["blob_name"])
+            if current is None or item["seq"] > current["seq"]:
+                if current is not None:
+                    self._remove_spool(current)
+                latest[item["blob_name"]] = item
+            else:
+                self._remove_spool(item)
+
+        now = time.time()
+        for item in latest.values():
+            with self.lock:
+                self.last_seq = max(self.last_seq, item["seq"])
+                self.latest_seq[item["blob_name"]] = item["seq"]
+                self._add_pending(item)
+                retry_at = item.get("retry_at")
+                if retry_at and retry_at > now:
+                    # 停止前に再送待ちだったものは、記録済みの再送予定時刻まで待つ
+                    heapq.heappush(self.retry_heap, (retry_at, item["seq"], item))
+                    self.queued_seqs.add(item["seq"])
+                    continue
+            self._offer(item, None)
+        return len(latest)
+
+    def _rescan_spool(self):
+        """キューに空きができたら、送信箱にのみ残っている依頼をキューへ戻す"""
+        with self.lock:
+            if not self.overflow:
+                return
+            self.overflow = False
+        for item in self._load_spool_items():
+            with self.lock:
+                if item["seq"] in self.queued_seqs:
+                    continue
+                superseded = self.latest_seq.get(item["blob_name"]) != item["seq"]
+            if superseded:
+                # 同じblobに新しい内容が投入済みの古い依頼は送信せずに破棄する
+                self._finish(item)
+                continue
+            if not self._offer(item, None):
+                break
+
+    # ------------------------------------------
+    # 送信処理
+    # ------------------------------------------
+    def _offer(self, item, payload):
+        """メモリ上のキューへ投入する。満杯なら送信箱にのみ残して False を返す"""
+        with self.lock:
+            if item["seq"] in self.queued_seqs:
+                return True
+            try:
+                self.queue.put_nowait((item, payload))
+            except queue.Full:
+                self.overflow = True
+                return False
+            self.queued_seqs.add(item["seq"])
+            return True
+
+    def _finish(self, item):
+        with self.lock:
+            self.queued_seqs.discard(item["seq"])
+            if self.latest_seq.get(item["blob_name"]) == item["seq"]:
+                del self.latest_seq[item["blob_name"]]
+            for cache_key in item["cache_keys"]:
+                count = self.pending_keys.get(cache_key, 0) - 1
+                if count > 0:
+                    self.pending_keys[cache_key] = count
+                else:
+                    self.pending_keys.pop(cache_key, None)
+        self._remove_spool(item)
+
+    def _add_pending(self, item):
+        """送信待ちのキャッシュキーを登録する（lock 取得済みで呼ぶこと）"""
+        for cache_key in item["cache_keys"]:
+            self.pending_keys[cache_key] = self.pending_keys.get(cache_key, 0) + 1
+
+    def _worker_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                item, payload = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                superseded = self.latest_seq.get(item["blob_name"]) != item["seq"]
+            if superseded:
+                # 同じblobに新しい内容が投入済みのため、古い依頼は送信しない
+                self._finish(item)
+                continue
+
+            try:
+                if payload is None:
+                    payload = Payload(self._read_spool_data(item), item["raw_size"],
+                                      item["content_type"], item["content_encoding"])
+                success = self.uploader.upload_payload(item["blob_name"], payload)
+            except Exception as e:
+                logger.error(f"GCSアップロード失敗 ({item['blob_name']}): {e}")
+                success = False
+
+            if success:
+                self.upload_cache.mark_many(item["cache_keys"])
+                self._finish(item)
+            else:
+                self._schedule_retry(item)
+
+    def _schedule_retry(self, item):
+        item["attempts"] += 1
+        delay = min(self.retry_base * (2 ** (item["attempts"] - 1)), self.retry_max)
+        delay *= random.uniform(0.8, 1.2)
+        item["retry_at"] = time.time() + delay
+        try:
+            # 再起動後も失敗回数とバックオフを引き継げるよう送信箱のメタ情報を更新する
+            self._write_spool_meta(item)
+        except Exception as e:
+            logger.warning(f"送信箱の更新に失敗しました ({item['blob_name']}): {e}")
+        with self.lock:
+            # 再送待ちの間も queued_seqs に残し、送信箱の再走査で二重に投入されないようにする
+            heapq.heappush(self.retry_heap, (item["retry_at"], item["seq"], item))
+        logger.warning(f"再送予定: {item['blob_name']} ({item['attempts']}回目失敗, {delay:.0f}秒後)")
+
+    def _scheduler_loop(self):
+        while not self.stop_event.wait(1):
+            now = time.time()
+            while True:
+                with self.lock:
+                    if not self.retry_heap or self.retry_heap[0][0] > now:
+                        break
+                    _, _, item = heapq.heappop(self.retry_heap)
+                    self.queued_seqs.discard(item["seq"])
+                # 再送時のペイロードは送信箱から読み直す
+                self._offer(item, None)
+            if not self.queue.full():
+                self._rescan_spool()